@@ -1,24 +1,18 @@
 import os
-from dotenv import load_dotenv
 from flask import Flask
 from config import config
 
-# Load environment variables from .env file
-load_dotenv()
-
-def create_app(config_name=None):
+def create_app(config_name=None, config_overrides=None):
     if config_name is None:
         config_name = os.environ.get('FLASK_CONFIG', 'default')
 
     app = Flask(__name__)
     app.config.from_object(config[config_name])
+    if config_overrides:
+        app.config.update(config_overrides)
 
-    # Example of reading an API key from .env
-    anam_api_key = os.getenv("ANAM_API_KEY")
-    if anam_api_key:
-        print("Anam API Key loaded successfully.")
-    else:
-        print("Anam API Key not found. Please check your .env file.")
+    if not app.config.get('ANAM_API_KEY') and not app.config.get('FAKE_PROVIDERS'):
+        app.logger.warning("ANAM_API_KEY not set. Please check your .env file.")
 
     # Ensure instance folder exists
     try:
@@ -29,10 +23,75 @@ def create_app(config_name=None):
     # Ensure upload folder exists
     os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
+    # Provider clients (Gemini, ElevenLabs, Anam), built on first use
+    from app.services.registry import init_services
+    init_services(app)
+
+    # Pipeline tracing and metrics
+    from app.services.tracing import tracer
+    tracer.init_app(app)
+
+    # Provider rate limits and adaptive concurrency
+    from app.services.rate_limits import rate_limiter
+    rate_limiter.init_app(app)
+
+    # Project store
+    from app.services.project_store import project_store
+    project_store.init_app(app)
+
+    # Content-addressed media files
+    from app.services.media import media_store
+    media_store.init_app(app)
+
+    # Page renditions
+    from app.services.renditions import rendition_service
+    rendition_service.init_app(app)
+
+    # Rendered HTML fragments (project cards)
+    from app.services.fragment_cache import fragment_cache
+    fragment_cache.init_app(app)
+
+    # Comic (PDF/image) ingestion
+    from app.services.comics import comic_ingest
+    comic_ingest.init_app(app)
+
+    # Media storage budget, garbage collection and usage stats
+    from app.services.storage import storage_manager
+    storage_manager.init_app(app)
+
+    # Creative brief cache
+    from app.services.brief_cache import brief_cache
+    brief_cache.init_app(app)
+
+    # Anam avatars: local inventory and session token pool
+    from app.services.anam import anam_service
+    anam_service.init_app(app)
+
+    # Designed voice registry
+    from app.services.voice_registry import voice_registry
+    voice_registry.init_app(app)
+
+    # Batch manga generation
+    from app.services.manga_batch import manga_batch
+    manga_batch.init_app(app)
+
+    # Background job pool
+    from app.services.jobs import job_manager
+    job_manager.init_app(app)
+
+    # Offline provider stand-ins (tests, benchmarks)
+    if app.config.get('FAKE_PROVIDERS'):
+        from app.services.fakes import install_fakes
+        install_fakes(app)
+
     # Register Blueprints
     from app.blueprints.main import main_bp
     app.register_blueprint(main_bp)
 
+    # CLI commands (flask manga batch ...)
+    from app.commands import manga_cli
+    app.cli.add_command(manga_cli)
+
     # Root route
     @app.route('/')
     def hello_world():
@@ -43,4 +102,15 @@ def create_app(config_name=None):
     def health():
         return {'status': 'ok', 'app': 'Comics Factory'}, 200
 
+    # Media storage usage (bytes by kind, largest projects, last sweep)
+    @app.route('/storage')
+    def storage():
+        return storage_manager.usage(), 200
+
+    # Prometheus metrics (per worker process)
+    @app.route('/metrics')
+    def metrics():
+        tracer.record_cache_stats('brief', brief_cache.stats())
+        return tracer.render_metrics(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
     return app
@@ -1,7 +1,7 @@
 from flask_wtf import FlaskForm
 from flask_wtf.file import FileField, FileRequired, FileAllowed
-from wtforms import StringField, SubmitField, SelectField, TextAreaField
-from wtforms.validators import DataRequired
+from wtforms import StringField, SubmitField, SelectField, TextAreaField, IntegerField, BooleanField
+from wtforms.validators import DataRequired, Optional, NumberRange
 
 class ProjectForm(FlaskForm):
     title = StringField('Project Title', validators=[DataRequired()])
@@ -10,10 +10,6 @@ class ProjectForm(FlaskForm):
         ('female', 'Female'), 
         ('neutral', 'Non-Binary/Other')
     ], validators=[DataRequired()])
-    comic_file = FileField('Manga Comic', validators=[
-        FileRequired(),
-        FileAllowed(['pdf', 'jpg', 'png', 'jpeg'], 'Images or PDFs only!')
-    ])
     protagonist_image = FileField('Protagonist Image', validators=[
         FileRequired(),
         FileAllowed(['jpg', 'png', 'jpeg'], 'Images only!')
@@ -25,6 +21,12 @@ class MangaForm(FlaskForm):
     plot = TextAreaField('Plot / Story', validators=[DataRequired()], render_kw={"rows": 5})
     style = StringField('Visual Style', default="In cute Kawaii style")
     reference_images = FileField('Reference Images', validators=[
-        FileAllowed(['jpg', 'png', 'jpeg'], 'Images only!')
+        FileAllowed(['pdf', 'jpg', 'png', 'jpeg'], 'Images or PDFs only!')
     ], render_kw={'multiple': True})
-    submit = SubmitField('Generate Manga & Voice')
\ No newline at end of file
+    submit = SubmitField('Generate Manga & Voice')
+
+class RegeneratePagesForm(FlaskForm):
+    page = IntegerField('Page', validators=[Optional(), NumberRange(min=1)])
+    failed = BooleanField('Retry failed pages')
+    cascade = BooleanField('Also regenerate the pages that continue from it')
+    submit = SubmitField('Regenerate')
\ No newline at end of file
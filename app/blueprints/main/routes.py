@@ -1,111 +1,467 @@
 import os
-from flask import render_template, redirect, url_for, current_app, flash, request, abort
-from werkzeug.utils import secure_filename
+import json
+import mimetypes
+from datetime import datetime, timezone
+from flask import render_template, redirect, url_for, current_app, flash, request, abort, jsonify, Response, stream_with_context, send_file
+from werkzeug.security import safe_join
+from flask_wtf.csrf import validate_csrf
+from wtforms.validators import ValidationError
 from app.models import AvatarProject, MangaProject
 from app.services.anam import anam_service
-from app.services.manga_generator import manga_service
+from app.services.manga_generator import manga_service, CONTINUITY_MODES
+from app.services.manga_batch import manga_batch
+from app.services.jobs import job_manager
+from app.services.project_store import project_store, encode_cursor, decode_cursor
+from app.services.renditions import rendition_service
+from app.services.fragment_cache import fragment_cache
+from app.services.storage import storage_manager
+from app.services.media import media_store, media_url, is_hashed_name
 from . import main_bp
-from .forms import ProjectForm, MangaForm
+from .forms import ProjectForm, MangaForm, RegeneratePagesForm
 
-# In-memory storage
-PROJECTS = []
-NEXT_ID = 1
+def _add_project(project_cls, **fields):
+    """
+    Materialize a finished job's project. Called from job worker threads.
+    """
+    project = project_store.create(project_cls, **fields)
+    storage_manager.claim(project)
+    return {'project_id': project.id, 'project_type': project.type}
+
+def _release_uploads(*names):
+    """
+    Drop the references a failed job held on its uploads.
+    """
+    for name in names:
+        media_store.release(name)
+
+def _run_batch(lines, resolve_reference, continuity, progress):
+    """
+    Batch job: the manga_batch results, with progress per finished record.
+    """
+    total = sum(1 for line in lines if line.strip())
+    records = []
+    progress('records', current=0, total=total)
+    for result in manga_batch.run(lines, resolve_reference, continuity):
+        records.append(result)
+        progress('records', current=len(records), total=total)
+    failed = sum(1 for record in records if record['status'] != 'done')
+    progress('records', status='done', current=len(records), total=total,
+             message=f"{total - failed} of {total} records done")
+    return {'records': records, 'failed': failed}
+
+def _job_payload(job):
+    payload = job.to_dict()
+    result = payload['result']
+    if result and 'records' in result:
+        records = [dict(record) for record in result['records']]
+        for record in records:
+            if record.get('project_id'):
+                record['url'] = url_for('main.view_manga', project_id=record['project_id'])
+        payload['result'] = {**result, 'records': records}
+    elif result:
+        endpoint = 'main.view_project' if result['project_type'] == 'avatar' else 'main.view_manga'
+        payload['url'] = url_for(endpoint, project_id=result['project_id'])
+    return payload
+
+def _job_submitted(job):
+    """
+    JSON clients get the job id right away; browsers go to the progress page.
+    """
+    status_url = url_for('main.job_status', job_id=job.id)
+    if request.accept_mimetypes.best == 'application/json':
+        return jsonify(_job_payload(job)), 202, {'Location': status_url}
+    return redirect(url_for('main.view_job', job_id=job.id))
+
+def _card_ready(project):
+    """
+    False while a manga card would still show its original page instead
+    of the thumbnail rendition.
+    """
+    return project.type != 'manga' or not project.pages or rendition_service.ready(project.pages[0])
+
+def _project_card(project):
+    """
+    A project's card, cached per store version. Cards that aren't ready
+    are rendered again next time, so they pick up the rendition.
+    """
+    def render():
+        return render_template('_project_card.html', project=project), _card_ready(project)
+    return fragment_cache.get_or_render(('project_card', project.id, project.version), render)
+
+def _project_listing(cursor):
+    """
+    One page of project cards after `cursor`: (cards, next_cursor, complete).
+    `complete` is False while any card is still waiting on a rendition.
+    """
+    try:
+        before = decode_cursor(cursor) if cursor else None
+    except ValueError:
+        abort(400)
+    per_page = current_app.config.get('PROJECTS_PER_PAGE', 24)
+    # Newest first, straight from the created_at index; one extra row tells us there's more
+    projects = project_store.list_recent(limit=per_page + 1, before=before)
+    next_cursor = encode_cursor(projects[per_page - 1]) if len(projects) > per_page else None
+    projects = projects[:per_page]
+    cards = [_project_card(project) for project in projects]
+    complete = all(_card_ready(project) for project in projects)
+    return cards, next_cursor, complete
+
+def _render_index(project_form=None, manga_form=None, status=200):
+    cursor = request.args.get('cursor')
+    cards, next_cursor, _ = _project_listing(cursor)
+    return render_template(
+        'index.html',
+        project_form=project_form or ProjectForm(),
+        manga_form=manga_form or MangaForm(),
+        cards=cards, cursor=cursor, next_cursor=next_cursor
+    ), status
+
+def _invalid_form(form, **forms):
+    if request.accept_mimetypes.best == 'application/json':
+        return jsonify({'errors': form.errors}), 400
+    return _render_index(status=400, **forms)
 
 @main_bp.route('/', methods=['GET', 'POST'])
 def index():
-    global NEXT_ID
+    # Forms carry CSRF tokens, so the index itself isn't validated or cached
+    if request.method == 'POST':
+        # Legacy combined form: dispatch on the fields only the avatar form has
+        if 'protagonist_image' in request.files or 'gender' in request.form:
+            return create_avatar()
+        return create_manga()
+    return _render_index()
+
+@main_bp.route('/projects')
+def list_projects():
+    """
+    The project grid fragment (cards plus the "older" link), validated by
+    the store generation: ETag / Last-Modified are checked before anything
+    is listed or rendered.
+    """
+    cursor = request.args.get('cursor') or ''
+    generation, modified_at = project_store.generation()
+    etag = f"projects-{generation}-{cursor}-{current_app.config.get('PROJECTS_PER_PAGE', 24)}"
+    last_modified = datetime.fromtimestamp(int(modified_at), timezone.utc)
+    if request.if_none_match.contains_weak(etag) or (
+            not request.if_none_match and request.if_modified_since and request.if_modified_since >= last_modified):
+        response = Response(status=304)
+        response.set_etag(etag, weak=True)
+        return response
+
+    cards, next_cursor, complete = _project_listing(cursor)
+    response = Response(render_template('_project_grid.html', cards=cards, cursor=cursor, next_cursor=next_cursor))
+    if complete:
+        # Placeholder thumbnails would otherwise be revalidated as current
+        response.set_etag(etag, weak=True)
+        response.last_modified = last_modified
+        response.cache_control.public = True
+        response.cache_control.no_cache = True
+    else:
+        response.cache_control.no_store = True
+    return response
+
+@main_bp.route('/avatars', methods=['POST'])
+def create_avatar():
     project_form = ProjectForm()
+    if not project_form.validate_on_submit():
+        return _invalid_form(project_form, project_form=project_form)
+
+    title = project_form.title.data
+    protagonist = project_form.protagonist_image.data
+
+    # Streamed to disk under its content hash; identical uploads share one blob
+    protagonist_filename = media_store.save_upload(protagonist)
+
+    def materialize(avatar_id):
+        result = _add_project(
+            AvatarProject,
+            title=title,
+            protagonist_image_path=protagonist_filename,
+            anam_avatar_id=avatar_id
+        )
+        anam_service.assign_project(avatar_id, result['project_id'])
+        return result
+
+    job = job_manager.submit(
+        'avatar', title,
+        anam_service.create_avatar_from_image,
+        media_store.path(protagonist_filename),
+        name=title,
+        gender=project_form.gender.data,
+        on_complete=materialize,
+        on_failure=lambda: _release_uploads(protagonist_filename)
+    )
+    return _job_submitted(job)
+
+@main_bp.route('/manga', methods=['POST'])
+def create_manga():
     manga_form = MangaForm()
-    
-    # Handle ProjectForm (Avatar)
-    if 'submit' in request.form and project_form.validate_on_submit():
-        title = project_form.title.data
-        comic = project_form.comic_file.data
-        protagonist = project_form.protagonist_image.data
-        
-        comic_filename = secure_filename(comic.filename)
-        protagonist_filename = secure_filename(protagonist.filename)
-        
-        upload_folder = current_app.config['UPLOAD_FOLDER']
-        comic.save(os.path.join(upload_folder, comic_filename))
-        protagonist.save(os.path.join(upload_folder, protagonist_filename))
-        
-        try:
-            avatar_id = anam_service.create_avatar_from_image(
-                os.path.join(upload_folder, protagonist_filename),
-                name=title,
-                gender=project_form.gender.data
-            )
-            
-            project = AvatarProject(
-                id=NEXT_ID,
-                title=title,
-                comic_file_path=comic_filename,
-                protagonist_image_path=protagonist_filename,
-                anam_avatar_id=avatar_id
-            )
-            PROJECTS.append(project)
-            NEXT_ID += 1
-            
-            flash('Avatar created successfully!', 'success')
-            return redirect(url_for('main.view_project', project_id=project.id))
-            
-        except Exception as e:
-            current_app.logger.error(f"Error creating avatar: {e}")
-            flash(f'Error creating avatar: {e}', 'danger')
-
-    # Handle MangaForm
-    if 'submit' in request.form and manga_form.validate_on_submit():
-        title = manga_form.title.data
-        plot = manga_form.plot.data
-        files = request.files.getlist(manga_form.reference_images.name)
-        
-        saved_ref_paths = []
-        upload_folder = current_app.config['UPLOAD_FOLDER']
-        for file in files:
-            if file and file.filename:
-                filename = secure_filename(file.filename)
-                path = os.path.join(upload_folder, filename)
-                file.save(path)
-                saved_ref_paths.append(path)
-        
+    if not manga_form.validate_on_submit():
+        return _invalid_form(manga_form, manga_form=manga_form)
+
+    title = manga_form.title.data
+    plot = manga_form.plot.data
+    files = request.files.getlist(manga_form.reference_images.name)
+
+    # The blob digest (the media name's stem) is the references' identity for the caches
+    saved_refs = [media_store.save_upload(file) for file in files if file and file.filename]
+    saved_ref_paths = [media_store.path(name) for name in saved_refs]
+
+    def materialize(result):
+        return _add_project(
+            MangaProject,
+            title=title,
+            script=result['script'],
+            audio_path=result['audio_file'],
+            pages=result['pages'],
+            audio_segments=result.get('audio_segments'),
+            brief=result.get('brief'),
+            continuity=result.get('continuity'),
+            references=result.get('references'),
+            page_outputs=result.get('page_outputs')
+        )
+
+    job = job_manager.submit(
+        'manga', title,
+        manga_service.generate_manga, title, plot, saved_ref_paths,
+        on_complete=materialize,
+        on_failure=lambda: _release_uploads(*saved_refs)
+    )
+    return _job_submitted(job)
+
+@main_bp.route('/manga/batch', methods=['POST'])
+def create_manga_batch():
+    """
+    Start a batch job generating a manga per JSONL record ({"title",
+    "plot", "references", "series", "continuity", "id"}); its result holds
+    one entry per record, in completion order. Send the records as the
+    body, or as a `records` file with the reference images as `references`
+    files (records name them by file name). `?continuity=` sets the
+    default mode.
+
+    There is no form to carry the CSRF token: send the session's token
+    (any form on the index page has it) as an X-CSRFToken header or a
+    `csrf_token` field.
+    """
+    if current_app.config.get('WTF_CSRF_ENABLED', True):
         try:
-            result = manga_service.generate_manga(title, plot, saved_ref_paths)
-            
-            project = MangaProject(
-                id=NEXT_ID,
-                title=title,
-                script=result['script'],
-                audio_path=result['audio_file'],
-                pages=result['pages']
-            )
-            PROJECTS.append(project)
-            NEXT_ID += 1
-            
-            flash('Manga generated successfully!', 'success')
-            return redirect(url_for('main.view_manga', project_id=project.id))
-            
-        except Exception as e:
-            current_app.logger.error(f"Error generating manga: {e}")
-            flash(f'Error generating manga: {e}', 'danger')
-
-    # Sort projects by creation time (newest first)
-    sorted_projects = sorted(PROJECTS, key=lambda p: p.created_at, reverse=True)
-    return render_template('index.html', project_form=project_form, manga_form=manga_form, projects=sorted_projects)
+            validate_csrf(request.headers.get('X-CSRFToken') or request.form.get('csrf_token'))
+        except ValidationError as e:
+            return jsonify({'error': f"CSRF validation failed: {e}"}), 400
+
+    continuity = request.args.get('continuity')
+    if continuity and continuity not in CONTINUITY_MODES:
+        return jsonify({'error': f"Unknown continuity mode: {continuity}"}), 400
+
+    if 'records' in request.files:
+        lines = request.files['records'].read().decode('utf-8').splitlines()
+    else:
+        lines = request.get_data(as_text=True).splitlines()
+    count = sum(1 for line in lines if line.strip())
+    max_records = current_app.config.get('MANGA_BATCH_MAX_RECORDS', 100)
+    if count > max_records:
+        return jsonify({'error': f"A batch holds at most {max_records} records, got {count}"}), 400
+
+    uploads = {}
+    # Stored once however many records name them
+    for file in request.files.getlist('references'):
+        if file and file.filename:
+            uploads[file.filename] = media_store.save_upload(file)
+
+    def resolve(reference):
+        if reference not in uploads:
+            raise ValueError(f"Reference {reference!r} was not uploaded")
+        return uploads[reference]
+
+    job = job_manager.submit('batch', f"Batch of {count} manga", _run_batch, lines, resolve, continuity)
+    return _job_submitted(job)
+
+def _get_job_or_404(job_id):
+    job = job_manager.get(job_id)
+    if not job:
+        abort(404)
+    return job
+
+@main_bp.route('/jobs/<job_id>')
+def view_job(job_id):
+    job = _get_job_or_404(job_id)
+    return render_template('view_job.html', job=_job_payload(job))
+
+@main_bp.route('/jobs/<job_id>/status')
+def job_status(job_id):
+    job = _get_job_or_404(job_id)
+    return jsonify(_job_payload(job))
+
+@main_bp.route('/jobs/<job_id>/trace')
+def job_trace(job_id):
+    """
+    The job's spans so far (latency, bytes, retries, cache hits per provider call).
+    """
+    job = _get_job_or_404(job_id)
+    trace = job.trace_dict()
+    if trace is None:
+        abort(404)
+    return jsonify(trace)
+
+@main_bp.route('/jobs/<job_id>/events')
+def job_events(job_id):
+    """
+    Server-sent events: one 'progress' event per job change, until it finishes.
+    """
+    job = _get_job_or_404(job_id)
+
+    def stream():
+        version = -1
+        while True:
+            current = job.wait_for_change(version, timeout=15)
+            if current == version:
+                yield ": keep-alive\n\n"
+                continue
+            payload = _job_payload(job)
+            version = payload['version']
+            yield f"event: progress\ndata: {json.dumps(payload)}\n\n"
+            if payload['status'] in ('done', 'failed'):
+                break
+
+    headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    return Response(stream_with_context(stream()), mimetype='text/event-stream', headers=headers)
 
 @main_bp.route('/project/<int:project_id>')
 def view_project(project_id):
-    project = next((p for p in PROJECTS if p.id == project_id), None)
-    if not project or project.type != 'avatar':
+    project = project_store.get(project_id, 'avatar')
+    if not project:
         abort(404)
         
-    config = anam_service.get_avatar_config(project.anam_avatar_id)
-    return render_template('view_project.html', project=project, anam_config=config)
+    anam_service.touch_avatar(project.anam_avatar_id)
+    # Render right away; the page fetches its session token asynchronously
+    anam_service.tokens.warm(project.anam_avatar_id)
+    return render_template('view_project.html', project=project)
+
+@main_bp.route('/project/<int:project_id>/session-token')
+def project_session_token(project_id):
+    project = project_store.get(project_id, 'avatar')
+    if not project:
+        abort(404)
+
+    try:
+        config = anam_service.get_avatar_config(project.anam_avatar_id)
+    except Exception as e:
+        current_app.logger.error(f"Error getting session token: {e}")
+        return jsonify({'error': 'Could not get a session token'}), 502
+    response = jsonify(config)
+    response.headers['Cache-Control'] = 'no-store'
+    return response
 
 @main_bp.route('/manga/<int:project_id>')
 def view_manga(project_id):
-    project = next((p for p in PROJECTS if p.id == project_id), None)
-    if not project or project.type != 'manga':
+    project = project_store.get(project_id, 'manga')
+    if not project:
         abort(404)
-        
-    return render_template('view_manga.html', project=project)
+
+    # Stored segments start the narration while the joined voiceover is still loading
+    segment_urls = []
+    if project.audio_segments and all(is_hashed_name(segment.get('file') or '') for segment in project.audio_segments):
+        segment_urls = [media_url(segment['file']) for segment in project.audio_segments]
+    return render_template('view_manga.html', project=project, segment_urls=segment_urls,
+                           regenerate_form=RegeneratePagesForm())
+
+@main_bp.route('/manga/<int:project_id>/regenerate', methods=['POST'])
+def regenerate_manga_pages(project_id):
+    """
+    Regenerate one page (`page`, 1-based, optionally with `cascade` to the
+    pages chained to it) or every failed page (`failed`), reusing the
+    stored brief, references and the other pages.
+    """
+    project = project_store.get(project_id, 'manga')
+    if not project:
+        abort(404)
+
+    form = RegeneratePagesForm()
+    error = None
+    indexes = []
+    if not project.regenerable:
+        error = "This manga was created before page regeneration was available."
+    elif not form.validate_on_submit():
+        error = "Invalid regeneration request."
+    elif form.failed.data:
+        indexes = [index for index, output in enumerate(project.page_outputs) if not output['file']]
+        if not indexes:
+            error = "No failed pages to retry."
+    elif form.page.data and form.page.data <= len(project.page_outputs):
+        indexes = [form.page.data - 1]
+    else:
+        error = "Choose a page to regenerate."
+
+    if error:
+        if request.accept_mimetypes.best == 'application/json':
+            return jsonify({'error': error}), 400 if project.regenerable else 409
+        flash(error, 'danger')
+        return redirect(url_for('main.view_manga', project_id=project_id))
+
+    def materialize(result):
+        # Re-read so a concurrent regeneration of other pages isn't overwritten
+        current = project_store.get(project_id, 'manga')
+        for index in result['regenerated']:
+            current.page_outputs[index] = result['page_outputs'][index]
+        current.pages = [output['file'] for output in current.page_outputs if output['file']]
+        project_store.update(current)
+        storage_manager.claim(current)
+        for name in result['replaced']:
+            media_store.release(name)
+        return {'project_id': project_id, 'project_type': 'manga'}
+
+    job = job_manager.submit(
+        'manga', project.title,
+        manga_service.regenerate_pages,
+        project.brief, project.continuity, project.references, project.page_outputs, indexes,
+        cascade=form.cascade.data and not form.failed.data,
+        on_complete=materialize
+    )
+    return _job_submitted(job)
+
+# Blob names are content derived, so their responses never change; derived files
+# (evicted and regenerated under the storage budget) are revalidated
+MEDIA_MAX_AGE = 365 * 24 * 3600
+DERIVED_MEDIA_MAX_AGE = 3600
+
+@main_bp.route('/media/<path:name>')
+def media(name):
+    """
+    Serve stored media with a strong ETag, 304s and byte ranges. Blobs
+    (content-hashed names) are cached as immutable with their hash as the
+    ETag; derived files (renditions, comic pages), which can be evicted
+    and regenerated, get a short max-age and an mtime/size ETag. With
+    MEDIA_X_ACCEL_PREFIX set the transfer is handed to nginx; with
+    USE_X_SENDFILE Flask emits X-Sendfile instead.
+    """
+    path = safe_join(media_store.folder, name)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+    storage_manager.touch(name)
+
+    basename = os.path.basename(name)
+    immutable = is_hashed_name(name)
+    max_age = MEDIA_MAX_AGE if immutable else DERIVED_MEDIA_MAX_AGE
+    if immutable:
+        etag = os.path.splitext(basename)[0]
+    else:
+        stat = os.stat(path)
+        etag = f"{int(stat.st_mtime)}-{stat.st_size}"
+
+    accel_prefix = current_app.config.get('MEDIA_X_ACCEL_PREFIX')
+    if accel_prefix:
+        response = Response(mimetype=mimetypes.guess_type(basename)[0] or 'application/octet-stream')
+        response.set_etag(etag)
+        if request.if_none_match.contains(etag):
+            response.status_code = 304
+        else:
+            # nginx serves the bytes (and handles Range) from an internal location
+            response.headers['X-Accel-Redirect'] = f"{accel_prefix.rstrip('/')}/{name}"
+    else:
+        response = send_file(path, conditional=True, etag=etag, max_age=max_age)
+
+    response.cache_control.public = True
+    response.cache_control.max_age = max_age
+    if immutable:
+        response.cache_control.immutable = True
+    return response
@@ -0,0 +1,40 @@
+import json
+import os
+import click
+from flask.cli import AppGroup
+from app.services.manga_batch import manga_batch
+from app.services.manga_generator import CONTINUITY_MODES
+from app.services.media import media_store
+
+manga_cli = AppGroup('manga', help="Manga generation.")
+
+
+@manga_cli.command('batch')
+@click.argument('records', type=click.File('r', encoding='utf-8'))
+@click.option('--output', '-o', type=click.File('w', encoding='utf-8'), default='-',
+              help="Where to write the JSONL results (default: stdout).")
+@click.option('--continuity', type=click.Choice(CONTINUITY_MODES),
+              help="Continuity mode for records that don't set one.")
+def batch(records, output, continuity):
+    """
+    Generate a manga for every line of RECORDS, a JSONL file of
+    {"title", "plot", "references", "series", "continuity", "id"} objects
+    with reference paths relative to the file. A JSONL result line is
+    written as each one finishes; exits 1 if any failed.
+    """
+    base = os.getcwd() if records.name == '<stdin>' else os.path.dirname(os.path.abspath(records.name))
+
+    def resolve(reference):
+        path = os.path.join(base, reference)
+        if not os.path.isfile(path):
+            raise ValueError(f"Reference not found: {reference}")
+        return media_store.put_file(path, move=False)
+
+    failed = 0
+    for result in manga_batch.run(records, resolve, continuity):
+        failed += result['status'] != 'done'
+        output.write(json.dumps(result) + "\n")
+        output.flush()
+    if failed:
+        click.echo(f"{failed} record(s) failed", err=True)
+        raise click.exceptions.Exit(1)
@@ -1,21 +1,71 @@
 from datetime import datetime, timezone
 
 class AvatarProject:
-    def __init__(self, id, title, protagonist_image_path, comic_file_path, anam_avatar_id):
-        self.type = 'avatar'
+    __slots__ = ('id', 'title', 'protagonist_image_path', 'comic_file_path', 'anam_avatar_id', 'created_at', 'version')
+    type = 'avatar'
+    # Persisted in the project store's JSON data column
+    DATA_FIELDS = ('protagonist_image_path', 'comic_file_path', 'anam_avatar_id')
+
+    def __init__(self, id, title, protagonist_image_path, anam_avatar_id, comic_file_path=None, created_at=None, version=0):
         self.id = id
         self.title = title
         self.protagonist_image_path = protagonist_image_path
-        self.comic_file_path = comic_file_path
+        self.comic_file_path = comic_file_path # Only set on projects created before the comic upload was dropped
         self.anam_avatar_id = anam_avatar_id
-        self.created_at = datetime.now(timezone.utc)
+        self.created_at = created_at or datetime.now(timezone.utc)
+        self.version = version # Project store generation of the last write
+
+    @property
+    def media_names(self):
+        """
+        Media names (blobs) the project depends on.
+        """
+        return [name for name in (self.protagonist_image_path, self.comic_file_path) if name]
 
 class MangaProject:
-    def __init__(self, id, title, script, audio_path, pages):
-        self.type = 'manga'
+    __slots__ = ('id', 'title', 'script', 'audio_path', 'pages', 'audio_segments',
+                 'brief', 'continuity', 'references', 'page_outputs', 'created_at', 'version')
+    type = 'manga'
+    DATA_FIELDS = ('script', 'audio_path', 'pages', 'audio_segments', 'brief', 'continuity', 'references', 'page_outputs')
+
+    def __init__(self, id, title, script, audio_path, pages, audio_segments=None,
+                 brief=None, continuity=None, references=None, page_outputs=None, created_at=None, version=0):
         self.id = id
         self.title = title
         self.script = script
         self.audio_path = audio_path
         self.pages = pages # List of filenames
-        self.created_at = datetime.now(timezone.utc)
+        self.audio_segments = audio_segments or [] # Timing index: media name, start/duration per page segment
+        # Kept so single pages can be regenerated without redoing the brief/voice
+        self.brief = brief
+        self.continuity = continuity
+        self.references = references or [] # Media names of the reference images
+        self.page_outputs = page_outputs or [] # Per page: prompt, file (None if failed), conditioned_on
+        self.created_at = created_at or datetime.now(timezone.utc)
+        self.version = version # Project store generation of the last write
+
+    @property
+    def regenerable(self):
+        return bool(self.brief and self.page_outputs)
+
+    @property
+    def media_names(self):
+        """
+        Media names (blobs and comic cache files) the project depends on.
+        """
+        segments = (segment.get('file') for segment in self.audio_segments)
+        return [name for name in (self.audio_path, *segments, *self.pages, *self.references) if name]
+
+    @property
+    def page_slots(self):
+        """
+        (index, file) for every page, including failed ones (file None).
+        """
+        if self.page_outputs:
+            return [(index, output['file']) for index, output in enumerate(self.page_outputs)]
+        return list(enumerate(self.pages))
+
+PROJECT_TYPES = {
+    AvatarProject.type: AvatarProject,
+    MangaProject.type: MangaProject
+}
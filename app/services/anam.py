@@ -1,97 +1,253 @@
 import os
 import requests
-import mimetypes
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from flask import current_app
+from app.services.avatar_images import prepare_avatar_image
+from app.services.media import digest_for
+from app.services.avatar_inventory import AvatarInventory
+from app.services.session_tokens import SessionTokenManager, parse_expiry
+from app.services.tracing import tracer
+from app.services.registry import get_service
+
+IMAGE_LOCK_STRIPES = 64
 
 class AnamService:
     def __init__(self):
-        self.api_key = os.environ.get('ANAM_API_KEY')
-        self.base_url = os.environ.get('ANAM_API_URL', 'https://api.anam.ai/v1')
+        self.tokens = None
+        self.sync_interval = 300
+        self._inventory = None
+        self._inventory_lock = threading.Lock()
+        self._sync_pid = None
+        self._touches = {}  # avatar_id -> last view not yet written to the inventory
+        self._touch_lock = threading.Lock()
+        # Striped by image digest: bounded, and one upload per image at a time
+        self._image_locks = [threading.Lock() for _ in range(IMAGE_LOCK_STRIPES)]
+
+    def init_app(self, app):
+        config = app.config
+        path = config.get('ANAM_INVENTORY_PATH') or os.path.join(app.instance_path, 'avatar_inventory.json')
+        self._inventory = AvatarInventory(str(path))
+        self._inventory.reload()
+        self.sync_interval = config.get('ANAM_INVENTORY_SYNC_INTERVAL', self.sync_interval)
+        self._sync_pid = None
+        self._touches = {}
+        # Session token pool (pre-minted tokens for hot avatars)
+        self.tokens = SessionTokenManager(
+            app,
+            self.mint_session_token,
+            pool_size=config.get('ANAM_TOKEN_POOL_SIZE', 2),
+            ttl=config.get('ANAM_SESSION_TOKEN_TTL', 3600),
+            hot_avatars=config.get('ANAM_TOKEN_HOT_AVATARS', 10)
+        )
+        app.extensions['anam'] = self
+
+    @property
+    def http(self):
+        """
+        Shared pooled client (keep-alive, timeouts, retries with backoff),
+        built on first use from the ANAM_* settings.
+        """
+        return get_service('anam_http')
+
+    @tracer.traced('anam.list_avatars')
+    def list_avatars(self, limit=50):
+        response = self.http.get(f"avatars?limit={limit}")
+        response.raise_for_status()
+        return response.json().get('data', [])
+
+    def delete_avatars(self, avatar_ids):
+        """
+        Delete avatars concurrently. Returns {avatar_id: response}.
+        """
+        if not avatar_ids:
+            return {}
+        with ThreadPoolExecutor(max_workers=min(8, len(avatar_ids))) as executor:
+            responses = executor.map(tracer.propagate(self._delete_avatar), avatar_ids)
+            return dict(zip(avatar_ids, responses))
+
+    @tracer.traced('anam.delete_avatar')
+    def _delete_avatar(self, avatar_id):
+        return self.http.delete(f"avatars/{avatar_id}")
+
+    def _wait_for_avatar_count(self, target, timeout=None):
+        """
+        Poll until the API reports at most `target` avatars (deletes can take
+        a moment to propagate), or until the timeout runs out.
+        """
+        timeout = timeout if timeout is not None else current_app.config.get('ANAM_CLEANUP_WAIT_TIMEOUT', 10)
+        deadline = time.monotonic() + timeout
+        interval = 0.25
+        while True:
+            count = len(self.list_avatars())
+            if count <= target:
+                return True
+            if time.monotonic() + interval > deadline:
+                current_app.logger.warning(f"Avatar count still {count} (want <= {target}) after {timeout}s")
+                return False
+            time.sleep(interval)
+            interval = min(interval * 2, 2)
+
+    @property
+    def inventory(self):
+        """
+        Local avatar inventory (loaded in init_app). A background thread
+        started on first use in each process reconciles it with the API
+        (right away if stale) and writes buffered views, so requests only
+        ever read the local file.
+        """
+        self._start_inventory_sync()
+        return self._inventory
+
+    def _sync_inventory(self, inventory):
+        try:
+            inventory.reconcile(self.list_avatars())
+        except Exception as e:
+            current_app.logger.error(f"Error syncing avatar inventory: {e}")
+
+    def _start_inventory_sync(self):
+        # Once per process, so the sync thread is never lost across a fork
+        if self._sync_pid == os.getpid():
+            return
+        with self._inventory_lock:
+            if self._sync_pid == os.getpid():
+                return
+            inventory, interval = self._inventory, self.sync_interval
+            inventory.reload()
+            self._sync_pid = os.getpid()
+        app = current_app._get_current_object()
+
+        def run():
+            while True:
+                with app.app_context():
+                    self._flush_touches()
+                    if not inventory.synced_at or (interval and time.time() - inventory.synced_at >= interval):
+                        self._sync_inventory(inventory)
+                if not interval:
+                    return
+                time.sleep(interval)
+
+        threading.Thread(target=run, name='anam-inventory-sync', daemon=True).start()
+
+    def assign_project(self, avatar_id, project_id):
+        self.inventory.assign(avatar_id, project_id)
+
+    def touch_avatar(self, avatar_id):
+        """
+        Record a view so actively used avatars are the last to be evicted.
+        Buffered in memory and written on the sync interval.
+        """
+        inventory = self.inventory
+        with self._touch_lock:
+            self._touches[avatar_id] = time.time()
+        if not self.sync_interval:
+            self._flush_touches(inventory)
+
+    def _flush_touches(self, inventory=None):
+        with self._touch_lock:
+            touches, self._touches = self._touches, {}
+        if touches:
+            (inventory or self._inventory).touch_many(touches)
 
     def cleanup_old_avatars(self):
         """
-        List existing avatars and delete the oldest ones if the limit is reached.
+        Delete the least recently viewed avatars if the limit is reached.
         Anam Free/Pro plans often have a limit on concurrent one-shot avatars (e.g. 10).
+        The decision is made from the local inventory, without listing avatars.
         """
         try:
-            # 1. List Avatars
-            url = f"{self.base_url}/avatars?limit=50" # Adjust limit as needed
-            headers = {"Authorization": f"Bearer {self.api_key}"}
-            response = requests.get(url, headers=headers)
-            response.raise_for_status()
-            avatars = response.json().get('data', [])
-            
-            current_app.logger.info(f"Found {len(avatars)} existing avatars.")
+            inventory = self.inventory
+            # Evict by the latest views, including ones not yet written
+            self._flush_touches(inventory)
             
             # Keep a safe buffer. Limit is usually 10. Let's keep 5.
-            safe_limit = 5 
-            if len(avatars) >= safe_limit:
-                # Delete excess
-                num_to_delete = len(avatars) - safe_limit + 1
-                current_app.logger.info(f"Cleaning up {num_to_delete} old avatars to stay under limit...")
+            safe_limit = current_app.config.get('ANAM_AVATAR_LIMIT', 5)
+            # Make room for the avatar about to be created
+            to_delete = inventory.eviction_candidates(safe_limit - 1)
+            if to_delete:
+                current_app.logger.info(f"Cleaning up {len(to_delete)} least recently viewed avatars to stay under limit...")
                 
-                # Sort by creation time (Oldest first)
-                avatars.sort(key=lambda x: x.get('createdAt', ''), reverse=False)
-                
-                for i in range(num_to_delete):
-                    avatar_to_delete = avatars[i]
-                    del_url = f"{self.base_url}/avatars/{avatar_to_delete['id']}"
-                    del_response = requests.delete(del_url, headers=headers)
-                    
-                    if del_response.status_code in [200, 204]:
-                        current_app.logger.info(f"Deleted avatar {avatar_to_delete['id']} (Status: {del_response.status_code})")
+                deleted = 0
+                for avatar_id, del_response in self.delete_avatars(to_delete).items():
+                    if del_response.status_code in [200, 204, 404]:
+                        deleted += 1
+                        inventory.remove(avatar_id)
+                        self.tokens.forget(avatar_id)
+                        current_app.logger.info(f"Deleted avatar {avatar_id} (Status: {del_response.status_code})")
                     else:
-                        current_app.logger.warning(f"Failed to delete avatar {avatar_to_delete['id']}: {del_response.text}")
+                        current_app.logger.warning(f"Failed to delete avatar {avatar_id}: {del_response.text}")
 
-                # Give the API a moment to propagate changes
-                time.sleep(2)
+                # Wait until the API actually reflects the deletes
+                if deleted:
+                    self._wait_for_avatar_count(len(inventory))
                     
         except Exception as e:
             current_app.logger.error(f"Error cleaning up avatars: {e}")
 
-    def create_avatar_from_image(self, image_path, name, gender='neutral'):
+    @tracer.traced('anam.create_avatar')
+    def create_avatar_from_image(self, image_path, name, gender='neutral', progress=None):
         """
         Create an avatar from an image using Anam API.
+
+        An image already turned into a live avatar (same content digest)
+        reuses that avatar without uploading. New images are cropped to the
+        face or subject, downscaled and re-encoded before the upload.
         """
+        digest = digest_for(image_path)
+        # One upload per image, even when jobs for the same image overlap
+        with self._image_lock(digest):
+            avatar_id = self.inventory.avatar_for_image(digest) if current_app.config.get('ANAM_AVATAR_REUSE', True) else None
+            tracer.cache('avatar_image', avatar_id is not None)
+            if avatar_id:
+                current_app.logger.info(f"Reusing avatar {avatar_id} for image {digest[:12]}")
+                self.inventory.touch(avatar_id)
+                self.tokens.warm(avatar_id)
+                if progress:
+                    progress('upload', status='done', message="Reused existing avatar")
+                return avatar_id
+            return self._upload_avatar(image_path, digest, name, progress)
+
+    def _image_lock(self, digest):
+        return self._image_locks[hash(digest) % len(self._image_locks)]
+
+    def _upload_avatar(self, image_path, digest, name, progress=None):
+        if progress:
+            progress('cleanup')
         # Attempt cleanup first
         self.cleanup_old_avatars()
+        if progress:
+            progress('cleanup', status='done')
+            progress('upload')
 
-        url = f"{self.base_url}/avatars"
-        headers = {
-            "Authorization": f"Bearer {self.api_key}"
-        }
-        
-        # Guess MIME type
-        mime_type, _ = mimetypes.guess_type(image_path)
-        
-        # Fallback/Manual map for common types if system registry is empty
-        if not mime_type:
-            ext = os.path.splitext(image_path)[1].lower()
-            if ext in ['.jpg', '.jpeg']:
-                mime_type = 'image/jpeg'
-            elif ext == '.png':
-                mime_type = 'image/png'
-            elif ext == '.webp':
-                mime_type = 'image/webp'
-        
-        current_app.logger.info(f"Uploading image: {image_path}")
-        current_app.logger.info(f"Detected MIME type: {mime_type}")
-        current_app.logger.info(f"File size: {os.path.getsize(image_path)} bytes")
-
-        if not mime_type:
-            mime_type = 'application/octet-stream'
+        config = current_app.config
+        with tracer.span('anam.prepare_image'):
+            image_bytes, mime_type, filename = prepare_avatar_image(
+                image_path,
+                max_dimension=config.get('ANAM_AVATAR_IMAGE_MAX_DIM', 1024),
+                quality=config.get('ANAM_AVATAR_IMAGE_QUALITY', 88),
+                formats=config.get('ANAM_AVATAR_IMAGE_FORMATS', ('JPEG', 'WEBP'))
+            )
+        current_app.logger.info(
+            f"Uploading image: {image_path} as {mime_type}, "
+            f"{len(image_bytes)} bytes (from {os.path.getsize(image_path)})"
+        )
             
         try:
-            with open(image_path, 'rb') as f:
-                # Explicitly set filename and content_type
-                files = {'imageFile': (os.path.basename(image_path), f, mime_type)}
-                # Only send displayName, gender is usually set in persona config or ignored here
-                data = {'displayName': name}
-                response = requests.post(url, headers=headers, files=files, data=data)
+            # Explicitly set filename and content_type
+            files = {'imageFile': (filename, image_bytes, mime_type)}
+            # Only send displayName, gender is usually set in persona config or ignored here
+            data = {'displayName': name}
+            # Creating is not idempotent: a resend after a read timeout would create a second avatar
+            response = self.http.post("avatars", files=files, data=data, idempotent=False)
                 
             response.raise_for_status()
             data = response.json()
+            self.inventory.add(data['id'], created_at=data.get('createdAt'), image_digest=digest)
+            # Pre-mint tokens so the first view of the new avatar doesn't wait on one
+            self.tokens.warm(data['id'])
+            if progress:
+                progress('upload', status='done')
             return data['id']
             
         except requests.exceptions.RequestException as e:
@@ -103,13 +259,19 @@ class AnamService:
     def get_avatar_config(self, avatar_id):
         """
         Get session token and config to embed the avatar.
+        Served from the pre-minted token pool when possible.
         """
-        url = f"{self.base_url}/auth/session-token"
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json"
+        # Return everything needed for the frontend
+        return {
+            "sessionToken": self.tokens.acquire(avatar_id),
+            "avatarId": avatar_id
         }
-        
+
+    @tracer.traced('anam.session_token')
+    def mint_session_token(self, avatar_id):
+        """
+        Request a new session token. Returns (token, expires_at or None).
+        """
         # Complete persona config to satisfy "Legacy session tokens" error
         # We need to define the persona's behavior and traits.
         payload = {
@@ -125,15 +287,10 @@ class AnamService:
         }
         
         try:
-            response = requests.post(url, headers=headers, json=payload)
+            response = self.http.post("auth/session-token", json=payload)
             response.raise_for_status()
             data = response.json()
-            
-            # Return everything needed for the frontend
-            return {
-                "sessionToken": data['sessionToken'],
-                "avatarId": avatar_id
-            }
+            return data['sessionToken'], parse_expiry(data.get('expiresAt'))
             
         except requests.exceptions.RequestException as e:
             current_app.logger.error(f"Anam API Error (Get Token): {e}")
@@ -0,0 +1,119 @@
+"""
+MP3 helpers for joining TTS segments without re-encoding.
+
+MP3 is a sequence of self-contained frames, so segments encoded with the
+same settings can be joined by concatenating their frames. ID3 tags and the
+Xing/Info header frame of each segment are dropped, since they describe the
+segment rather than the joined stream.
+"""
+
+# Bitrates in kbps, indexed by [version_is_mpeg1][layer][bitrate_index]
+_BITRATES = {
+    True: {
+        1: [0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448],
+        2: [0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384],
+        3: [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    },
+    False: {
+        1: [0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256],
+        2: [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+        3: [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+    },
+}
+
+# Sample rates in Hz, indexed by version bits
+_SAMPLE_RATES = {
+    3: [44100, 48000, 32000],  # MPEG-1
+    2: [22050, 24000, 16000],  # MPEG-2
+    0: [11025, 12000, 8000],   # MPEG-2.5
+}
+
+
+def _parse_header(data, offset):
+    """
+    Return (frame_length, samples, sample_rate) for a frame header at
+    `offset`, or None if there is no valid header there.
+    """
+    if offset + 4 > len(data):
+        return None
+    b1, b2, b3 = data[offset + 1], data[offset + 2], data[offset + 3]
+    if data[offset] != 0xFF or (b1 & 0xE0) != 0xE0:
+        return None
+    version = (b1 >> 3) & 0x03
+    layer_bits = (b1 >> 1) & 0x03
+    bitrate_index = (b2 >> 4) & 0x0F
+    sample_rate_index = (b2 >> 2) & 0x03
+    if version == 1 or layer_bits == 0 or bitrate_index in (0, 15) or sample_rate_index == 3:
+        return None
+
+    mpeg1 = version == 3
+    layer = 4 - layer_bits
+    bitrate = _BITRATES[mpeg1][layer][bitrate_index] * 1000
+    sample_rate = _SAMPLE_RATES[version][sample_rate_index]
+    padding = (b2 >> 1) & 0x01
+
+    if layer == 1:
+        return (12 * bitrate // sample_rate + padding) * 4, 384, sample_rate
+    if layer == 3 and not mpeg1:
+        return 72 * bitrate // sample_rate + padding, 576, sample_rate
+    return 144 * bitrate // sample_rate + padding, 1152, sample_rate
+
+
+def _skip_id3v2(data):
+    if data[:3] != b'ID3' or len(data) < 10:
+        return 0
+    size = (data[6] & 0x7F) << 21 | (data[7] & 0x7F) << 14 | (data[8] & 0x7F) << 7 | (data[9] & 0x7F)
+    footer = 10 if data[5] & 0x10 else 0
+    return 10 + size + footer
+
+
+def mp3_frames(data):
+    """
+    Split MP3 bytes into (audio_frames_bytes, duration_seconds), dropping
+    ID3 tags and a leading Xing/Info header frame.
+    """
+    end = len(data)
+    if end >= 128 and data[end - 128:end - 125] == b'TAG':
+        end -= 128
+    offset = _skip_id3v2(data)
+    view = memoryview(data)
+    frames = []
+    duration = 0.0
+    first = True
+
+    while offset < end:
+        header = _parse_header(data, offset)
+        if header is None:
+            # Resync on garbage between frames
+            offset += 1
+            continue
+        length, samples, sample_rate = header
+        if length <= 0 or offset + length > end:
+            break
+        frame = view[offset:offset + length]
+        if first:
+            first = False
+            tag_area = bytes(frame[:64])
+            if b'Xing' in tag_area or b'Info' in tag_area:
+                offset += length
+                continue
+        frames.append(frame)
+        duration += samples / sample_rate
+        offset += length
+
+    return b''.join(frames), duration
+
+
+def concatenate_mp3(segment_paths, output_path):
+    """
+    Join MP3 segments frame by frame into output_path.
+    Returns the duration in seconds of each segment.
+    """
+    durations = []
+    with open(output_path, 'wb') as out:
+        for path in segment_paths:
+            with open(path, 'rb') as f:
+                frames, duration = mp3_frames(f.read())
+            out.write(frames)
+            durations.append(duration)
+    return durations
@@ -0,0 +1,115 @@
+import io
+import os
+from PIL import Image, ImageChops, ImageOps
+
+# Formats the Anam avatar endpoint accepts, by PIL format name
+ACCEPTED_FORMATS = {'JPEG': 'image/jpeg', 'PNG': 'image/png', 'WEBP': 'image/webp'}
+EXTENSIONS = {'image/jpeg': 'jpg', 'image/png': 'png', 'image/webp': 'webp'}
+# Pixels further than this from the background colour count as subject
+SUBJECT_THRESHOLD = 24
+# Faces and subjects are located on a copy no larger than this
+PROBE_DIMENSION = 512
+
+# Optional face detection: OpenCV's bundled Haar cascade
+try:
+    import cv2
+    import numpy
+except ImportError:
+    cv2 = None
+
+
+def face_support():
+    return cv2 is not None
+
+
+def _face_box(image):
+    """
+    Head-and-shoulders box around the largest detected face, or None.
+    """
+    if cv2 is None:
+        return None
+    classifier = cv2.CascadeClassifier(os.path.join(cv2.data.haarcascades, 'haarcascade_frontalface_default.xml'))
+    side = min(image.size)
+    faces = classifier.detectMultiScale(
+        numpy.asarray(image.convert('L')), scaleFactor=1.1, minNeighbors=5, minSize=(side // 10, side // 10)
+    )
+    if len(faces) == 0:
+        return None
+    x, y, w, h = max(faces, key=lambda face: face[2] * face[3])
+    # Avatars animate the head: keep hair above and shoulders below the face
+    return (x - w * 0.6, y - h * 0.7, x + w * 1.6, y + h * 1.9)
+
+
+def _subject_box(image):
+    """
+    Bounding box of what differs from the background (the transparent area,
+    or the colour the corners share), or None if that's the whole image.
+    """
+    if image.mode in ('RGBA', 'LA'):
+        box = image.getchannel('A').point(lambda alpha: 255 if alpha > 16 else 0).getbbox()
+    else:
+        rgb = image.convert('RGB')
+        corners = [rgb.getpixel(point) for point in
+                   ((0, 0), (rgb.width - 1, 0), (0, rgb.height - 1), (rgb.width - 1, rgb.height - 1))]
+        background = max(set(corners), key=corners.count)
+        if corners.count(background) < 3:
+            return None  # No uniform background to separate the subject from
+        difference = ImageChops.difference(rgb, Image.new('RGB', rgb.size, background)).convert('L')
+        box = difference.point(lambda value: 255 if value > SUBJECT_THRESHOLD else 0).getbbox()
+    if box is None:
+        return None
+    left, top, right, bottom = box
+    margin = 0.08 * max(right - left, bottom - top)
+    return (left - margin, top - margin, right + margin, bottom + margin)
+
+
+def _clamp(box, size):
+    left, top, right, bottom = box
+    return (max(0, int(left)), max(0, int(top)), min(size[0], int(right)), min(size[1], int(bottom)))
+
+
+def prepare_avatar_image(path, max_dimension=1024, quality=88, formats=('JPEG', 'WEBP')):
+    """
+    Crop a protagonist image to the face (with OpenCV installed) or the
+    subject, fit it in `max_dimension` and encode it in whichever of
+    `formats` comes out smallest. The original bytes are kept when they
+    are already small, accepted and need no crop.
+
+    Returns (data, mime_type, filename).
+    """
+    with Image.open(path) as original:
+        source_format = original.format
+        image = ImageOps.exif_transpose(original)
+        image.load()
+
+    probe = image.copy()
+    probe.thumbnail((PROBE_DIMENSION, PROBE_DIMENSION))
+    box = _face_box(probe) or _subject_box(probe)
+    cropped = False
+    if box is not None:
+        scale = image.width / probe.width
+        box = _clamp([edge * scale for edge in box], image.size)
+        # Ignore slivers: a crop that keeps almost everything isn't worth a re-encode
+        if (box[2] - box[0]) * (box[3] - box[1]) < 0.9 * image.width * image.height:
+            image = image.crop(box)
+            cropped = True
+
+    candidates = []
+    if not cropped and max(image.size) <= max_dimension and source_format in ACCEPTED_FORMATS:
+        with open(path, 'rb') as f:
+            candidates.append((f.read(), ACCEPTED_FORMATS[source_format]))
+
+    image.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+    if image.mode != 'RGB':
+        # Transparency would only be flattened by the avatar pipeline anyway
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.convert('RGBA').getchannel('A'))
+        image = background
+    for fmt in formats:
+        buffer = io.BytesIO()
+        image.save(buffer, format=fmt, quality=quality, optimize=True)
+        candidates.append((buffer.getvalue(), ACCEPTED_FORMATS[fmt]))
+
+    data, mime_type = min(candidates, key=lambda candidate: len(candidate[0]))
+    stem = os.path.splitext(os.path.basename(path))[0]
+    return data, mime_type, f"{stem}.{EXTENSIONS[mime_type]}"
@@ -0,0 +1,198 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+class AvatarInventory:
+    """
+    Local record of the Anam avatars this app owns: id, createdAt, the
+    project using it, when it was last viewed and the content digest of
+    the image it was made from (so a repeat image reuses the avatar).
+
+    Avatars are kept in least-recently-viewed order, so picking eviction
+    candidates is a local decision instead of a list call per upload. The
+    inventory is persisted as JSON (shared by all worker processes) and
+    reconciled against the API periodically by AnamService. Every change
+    re-reads, mutates and replaces the file under an exclusive flock on
+    <path>.lock, so concurrent writers in other processes aren't lost.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.synced_at = None
+        self._avatars = OrderedDict()  # avatar_id -> {'createdAt', 'project_id', 'last_viewed'}
+        self._signature = None
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        with self._lock:
+            self._reload()
+            return len(self._avatars)
+
+    def __contains__(self, avatar_id):
+        with self._lock:
+            self._reload()
+            return avatar_id in self._avatars
+
+    def reload(self):
+        """
+        Pick up changes other processes made to the file.
+        """
+        with self._lock:
+            self._reload()
+
+    def _reload(self, force=False):
+        # Caller holds self._lock
+        if not self.path:
+            return
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return
+        signature = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if signature == self._signature and not force:
+            return
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        self._avatars = OrderedDict((entry['id'], entry) for entry in data.get('avatars', []))
+        self.synced_at = data.get('synced_at')
+        self._signature = signature
+
+    @contextmanager
+    def _update(self):
+        """
+        Read-modify-write: holds the file lock while the caller mutates the
+        freshly loaded entries, then saves them.
+        """
+        with self._lock:
+            if not self.path:
+                yield
+                return
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(f"{self.path}.lock", 'a') as lock_file:
+                if fcntl:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    self._reload(force=True)
+                    yield
+                    self._save()
+                finally:
+                    if fcntl:
+                        fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _save(self):
+        # Caller holds the file lock (see _update)
+        tmp_path = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'synced_at': self.synced_at, 'avatars': list(self._avatars.values())}, f, indent=2)
+        os.replace(tmp_path, self.path)
+        stat = os.stat(self.path)
+        self._signature = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+    def add(self, avatar_id, created_at=None, project_id=None, image_digest=None):
+        with self._update():
+            self._avatars[avatar_id] = {
+                'id': avatar_id,
+                'createdAt': created_at,
+                'project_id': project_id,
+                'last_viewed': time.time(),
+                'image_digest': image_digest
+            }
+            self._avatars.move_to_end(avatar_id)
+
+    def assign(self, avatar_id, project_id):
+        with self._update():
+            entry = self._avatars.get(avatar_id)
+            if entry:
+                entry['project_id'] = project_id
+
+    def touch(self, avatar_id):
+        """
+        Mark an avatar as just viewed (moves it to the back of the eviction queue).
+        """
+        with self._update():
+            entry = self._avatars.get(avatar_id)
+            if entry:
+                entry['last_viewed'] = time.time()
+                self._avatars.move_to_end(avatar_id)
+
+    def touch_many(self, viewed):
+        """
+        Apply buffered views ({avatar_id: timestamp}) in one write. A view
+        another process recorded more recently wins.
+        """
+        with self._update():
+            for avatar_id, viewed_at in sorted(viewed.items(), key=lambda item: item[1]):
+                entry = self._avatars.get(avatar_id)
+                if entry and viewed_at >= (entry.get('last_viewed') or 0):
+                    entry['last_viewed'] = viewed_at
+                    self._avatars.move_to_end(avatar_id)
+
+    def remove(self, avatar_id):
+        with self._update():
+            self._avatars.pop(avatar_id, None)
+
+    def eviction_candidates(self, keep):
+        """
+        Least recently viewed avatar ids to delete so at most `keep` remain.
+        """
+        with self._lock:
+            self._reload()
+            excess = len(self._avatars) - keep
+            if excess <= 0:
+                return []
+            return [avatar_id for avatar_id, _ in zip(self._avatars, range(excess))]
+
+    def reconcile(self, api_avatars):
+        """
+        Match the inventory to the API listing: forget avatars deleted
+        elsewhere, and add unknown ones (e.g. created by another deployment
+        that may still use them) as the most recently viewed, newest last.
+        """
+        with self._update():
+            api_ids = {avatar['id'] for avatar in api_avatars}
+            for avatar_id in [avatar_id for avatar_id in self._avatars if avatar_id not in api_ids]:
+                del self._avatars[avatar_id]
+
+            unknown = sorted(
+                (avatar for avatar in api_avatars if avatar['id'] not in self._avatars),
+                key=lambda avatar: avatar.get('createdAt') or ''
+            )
+            for avatar in unknown:
+                self._avatars[avatar['id']] = {
+                    'id': avatar['id'],
+                    'createdAt': avatar.get('createdAt'),
+                    'project_id': None,
+                    'last_viewed': None
+                }
+
+            self.synced_at = time.time()
+
+    def avatar_for_image(self, image_digest):
+        """
+        The live avatar made from an image with this digest, or None. Evicted
+        or externally deleted avatars drop out with their entries.
+        """
+        with self._lock:
+            self._reload()
+            for avatar_id, entry in reversed(self._avatars.items()):
+                if entry.get('image_digest') == image_digest:
+                    return avatar_id
+            return None
+
+    def project_for(self, avatar_id):
+        with self._lock:
+            self._reload()
+            entry = self._avatars.get(avatar_id)
+            return entry['project_id'] if entry else None
@@ -0,0 +1,157 @@
+import copy
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+class BriefCache:
+    """
+    Two-tier (memory LRU + on-disk JSON) cache for parsed creative briefs.
+    Entries are content addressed: the key covers title, plot, model,
+    prompt template version and the reference image bytes, so a retry with
+    identical inputs skips the brief call completely.
+    """
+
+    def __init__(self, cache_dir=None, max_entries=128, max_disk_bytes=64 * 1024 * 1024, ttl=7 * 24 * 3600):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.max_disk_bytes = max_disk_bytes
+        self.ttl = ttl
+        self._memory = OrderedDict()  # key -> (stored_at, brief)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def init_app(self, app):
+        self.cache_dir = str(app.config.get('BRIEF_CACHE_DIR') or os.path.join(app.instance_path, 'brief_cache'))
+        self.max_entries = app.config.get('BRIEF_CACHE_MAX_ENTRIES', self.max_entries)
+        self.max_disk_bytes = app.config.get('BRIEF_CACHE_MAX_BYTES', self.max_disk_bytes)
+        self.ttl = app.config.get('BRIEF_CACHE_TTL', self.ttl)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with self._lock:
+            self._memory.clear()
+            self.hits = self.memory_hits = self.disk_hits = self.misses = 0
+        app.extensions['brief_cache'] = self
+
+    @staticmethod
+    def make_key(title, text, model, prompt_version, reference_digests):
+        """
+        `reference_digests` are the SHA-256 digests of the reference images'
+        bytes (see app.services.media.digest_for).
+        """
+        digest = hashlib.sha256()
+        for part in (title, text, model, str(prompt_version), *reference_digests):
+            digest.update(part.encode('utf-8'))
+            digest.update(b'\0')
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry and now - entry[0] <= self.ttl:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                self.memory_hits += 1
+                return copy.deepcopy(entry[1])
+            if entry:
+                del self._memory[key]
+
+        brief, stored_at = self._read_disk(key, now)
+        with self._lock:
+            if brief is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.disk_hits += 1
+            self._remember(key, brief, stored_at)
+        return copy.deepcopy(brief)
+
+    def set(self, key, brief):
+        with self._lock:
+            self._remember(key, copy.deepcopy(brief), time.time())
+        if self.cache_dir:
+            path = self._path(key)
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(brief, f)
+            os.replace(tmp_path, path)
+            self._evict_disk()
+
+    def _remember(self, key, brief, stored_at):
+        # Caller holds self._lock
+        self._memory[key] = (stored_at, brief)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _read_disk(self, key, now):
+        if not self.cache_dir:
+            return None, None
+        path = self._path(key)
+        try:
+            stored_at = os.path.getmtime(path)
+            if now - stored_at > self.ttl:
+                os.remove(path)
+                return None, None
+            with open(path, encoding='utf-8') as f:
+                return json.load(f), stored_at
+        except (OSError, ValueError):
+            return None, None
+
+    def _evict_disk(self):
+        """
+        Drop expired entries, then the least recently written ones until the
+        directory fits in max_disk_bytes.
+        """
+        now = time.time()
+        entries = []
+        total = 0
+        with os.scandir(self.cache_dir) as it:
+            for entry in it:
+                if not entry.name.endswith('.json'):
+                    continue
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                if now - stat.st_mtime > self.ttl:
+                    self._remove(entry.path)
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_disk_bytes:
+                break
+            self._remove(path)
+            total -= size
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'memory_entries': len(self._memory)
+            }
+
+
+brief_cache = BriefCache()
@@ -0,0 +1,254 @@
+import json
+import threading
+import time
+
+_WHITESPACE = ' \t\r\n'
+
+
+def _scan_value(text, pos):
+    """
+    End index (exclusive) of the JSON value starting at `pos`, or None if
+    `text` doesn't hold all of it yet.
+    """
+    char = text[pos]
+    if char == '"':
+        index = pos + 1
+        while True:
+            index = text.find('"', index)
+            if index == -1:
+                return None
+            # A quote preceded by an odd number of backslashes is escaped
+            backslashes = 0
+            while text[index - 1 - backslashes] == '\\':
+                backslashes += 1
+            if backslashes % 2 == 0:
+                return index + 1
+            index += 1
+    if char in '{[':
+        depth, in_string, escaped = 0, False, False
+        for index in range(pos, len(text)):
+            char = text[index]
+            if in_string:
+                if escaped:
+                    escaped = False
+                elif char == '\\':
+                    escaped = True
+                elif char == '"':
+                    in_string = False
+            elif char == '"':
+                in_string = True
+            elif char in '{[':
+                depth += 1
+            elif char in '}]':
+                depth -= 1
+                if depth == 0:
+                    return index + 1
+        return None
+    # Number or literal: complete once a delimiter follows it
+    for index in range(pos, len(text)):
+        if text[index] in ',}]' or text[index] in _WHITESPACE:
+            return index
+    return None
+
+
+class BriefStreamParser:
+    """
+    Incremental parser for the creative brief's JSON object, fed the
+    response text as it streams in. Calls `on_field(name, value)` as each
+    top-level value completes and `on_page(index, prompt)` as each element
+    of the "pages" array does, long before the closing brace arrives.
+    Leading markdown fences are skipped.
+    """
+
+    def __init__(self, on_field=None, on_page=None):
+        self.on_field = on_field or (lambda name, value: None)
+        self.on_page = on_page or (lambda index, prompt: None)
+        self.brief = {}
+        self._text = ''
+        self._pos = 0
+        self._state = 'start'
+        self._key = None
+        self._pages = []
+
+    def feed(self, chunk):
+        self._text += chunk
+        while self._step():
+            pass
+
+    def _skip(self, characters=_WHITESPACE):
+        while self._pos < len(self._text) and self._text[self._pos] in characters:
+            self._pos += 1
+        return self._pos < len(self._text)
+
+    def _step(self):
+        text = self._text
+        if self._state == 'start':
+            start = text.find('{', self._pos)
+            if start == -1:
+                self._pos = len(text)
+                return False
+            self._pos = start + 1
+            self._state = 'key'
+            return True
+
+        if self._state == 'key':
+            if not self._skip(_WHITESPACE + ','):
+                return False
+            if text[self._pos] == '}':
+                self._state = 'done'
+                return False
+            end = _scan_value(text, self._pos)
+            if end is None:
+                return False
+            self._key = json.loads(text[self._pos:end])
+            self._pos = end
+            self._state = 'colon'
+            return True
+
+        if self._state == 'colon':
+            if not self._skip():
+                return False
+            if text[self._pos] != ':':
+                raise ValueError(f"Malformed brief JSON at offset {self._pos}")
+            self._pos += 1
+            self._state = 'value'
+            return True
+
+        if self._state == 'value':
+            if not self._skip():
+                return False
+            if self._key == 'pages' and text[self._pos] == '[':
+                self._pos += 1
+                self._state = 'pages'
+                return True
+            end = _scan_value(text, self._pos)
+            if end is None:
+                return False
+            self._set(self._key, json.loads(text[self._pos:end]))
+            self._pos = end
+            self._state = 'key'
+            return True
+
+        if self._state == 'pages':
+            if not self._skip(_WHITESPACE + ','):
+                return False
+            if text[self._pos] == ']':
+                self._pos += 1
+                self._set('pages', list(self._pages))
+                self._state = 'key'
+                return True
+            end = _scan_value(text, self._pos)
+            if end is None:
+                return False
+            prompt = json.loads(text[self._pos:end])
+            self._pos = end
+            self._pages.append(prompt)
+            self.on_page(len(self._pages) - 1, prompt)
+            return True
+
+        return False
+
+    def _set(self, name, value):
+        self.brief[name] = value
+        self.on_field(name, value)
+
+    def close(self):
+        """
+        The complete brief. Raises ValueError if the stream ended early.
+        """
+        if self._state != 'done':
+            raise ValueError("Creative brief stream ended before the JSON object was complete")
+        return self.brief
+
+
+class BriefFeed:
+    """
+    A creative brief that may still be streaming in: readers block until
+    the field or page prompt they need is complete (or the brief is, or
+    has failed). Shared between the brief producer and the page and voice
+    workers.
+    """
+
+    def __init__(self):
+        self.fields = {}
+        self.prompts = []
+        self.done = False
+        self.error = None
+        self.first_page_at = None  # perf_counter() when the first page prompt arrived
+        self._changed = threading.Condition()
+
+    @classmethod
+    def complete(cls, brief):
+        feed = cls()
+        feed.finish(brief)
+        return feed
+
+    def add_field(self, name, value):
+        with self._changed:
+            self.fields[name] = value
+            self._changed.notify_all()
+
+    def add_page(self, index, prompt):
+        with self._changed:
+            if index == len(self.prompts):
+                self.prompts.append(prompt)
+                if self.first_page_at is None:
+                    self.first_page_at = time.perf_counter()
+                self._changed.notify_all()
+
+    def finish(self, brief):
+        with self._changed:
+            self.fields.update(brief)
+            # Keep prompts already handed out; a re-parse can only confirm them
+            self.prompts.extend(brief.get('pages', [])[len(self.prompts):])
+            if self.prompts and self.first_page_at is None:
+                self.first_page_at = time.perf_counter()
+            self.done = True
+            self._changed.notify_all()
+
+    def fail(self, error):
+        with self._changed:
+            self.error = error
+            self.done = True
+            self._changed.notify_all()
+
+    def _wait(self, ready):
+        with self._changed:
+            while not ready() and not self.done:
+                self._changed.wait()
+            if self.error is not None:
+                raise self.error
+            return ready()
+
+    def field(self, name, default=None):
+        """
+        Block until `name` is known; `default` if the brief completes without it.
+        """
+        if self._wait(lambda: name in self.fields):
+            return self.fields[name]
+        return default
+
+    def page(self, index):
+        """
+        Block until page prompt `index` is known; None past the last page.
+        """
+        if self._wait(lambda: index < len(self.prompts)):
+            return self.prompts[index]
+        return None
+
+    def pages(self):
+        index = 0
+        while (prompt := self.page(index)) is not None:
+            yield prompt
+            index += 1
+
+    def brief(self):
+        """
+        Block until the brief is complete and return it.
+        """
+        self._wait(lambda: False)
+        return {**self.fields, 'pages': list(self.prompts)}
+
+    def known_pages(self):
+        with self._changed:
+            return len(self.prompts)
@@ -0,0 +1,262 @@
+import json
+import os
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from flask import current_app
+from PIL import Image, ImageStat
+from app.services.media import media_store, digest_for
+from app.services.storage import storage_manager
+from app.services.tracing import tracer
+
+COMIC_DIR = 'comics'
+PDF_EXTENSIONS = ('.pdf',)
+PAGE_FORMAT = 'jpg'
+PAGE_QUALITY = 88
+
+# Optional PDF backends: pypdfium2 (preferred) or PyMuPDF
+try:
+    import pypdfium2 as pdfium
+except ImportError:
+    pdfium = None
+try:
+    import fitz
+except ImportError:
+    fitz = None
+
+
+def is_pdf(path):
+    return os.path.splitext(path)[1].lower() in PDF_EXTENSIONS
+
+
+def pdf_support():
+    return pdfium is not None or fitz is not None
+
+
+def page_count(source_path):
+    """
+    Number of pages in a PDF, or frames in a (multi-frame) image.
+    """
+    if not is_pdf(source_path):
+        with Image.open(source_path) as image:
+            return getattr(image, 'n_frames', 1)
+    if pdfium is not None:
+        document = pdfium.PdfDocument(source_path)
+        try:
+            return len(document)
+        finally:
+            document.close()
+    if fitz is not None:
+        with fitz.open(source_path) as document:
+            return document.page_count
+    raise ValueError("PDF comics need pypdfium2 or PyMuPDF installed")
+
+
+def _render_pdf_page(source_path, page_index, dpi, max_dimension):
+    # Pick the render scale up front so oversized pages are never rasterized at full size
+    if pdfium is not None:
+        document = pdfium.PdfDocument(source_path)
+        try:
+            page = document[page_index]
+            width, height = page.get_size()
+            scale = min(dpi / 72, max_dimension / max(width, height))
+            return page.render(scale=scale).to_pil()
+        finally:
+            document.close()
+    with fitz.open(source_path) as document:
+        page = document[page_index]
+        scale = min(dpi / 72, max_dimension / max(page.rect.width, page.rect.height))
+        pixmap = page.get_pixmap(matrix=fitz.Matrix(scale, scale), alpha=False)
+        return Image.frombytes('RGB', (pixmap.width, pixmap.height), pixmap.samples)
+
+
+def _load_image_frame(source_path, frame_index, max_dimension):
+    with Image.open(source_path) as image:
+        image.seek(frame_index)
+        image.draft('RGB', (max_dimension, max_dimension))
+        frame = image.convert('RGB')
+    frame.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+    return frame
+
+
+def rasterize_page(source_path, page_index, dpi, max_dimension, output_path):
+    """
+    Render one page to a normalized RGB JPEG (longest side capped at
+    max_dimension). Runs in a worker process, which opens the document
+    itself so only one page is ever held in memory.
+    Returns a detail score (luminance spread) used to pick reference frames.
+    """
+    if is_pdf(source_path):
+        image = _render_pdf_page(source_path, page_index, dpi, max_dimension)
+    else:
+        image = _load_image_frame(source_path, page_index, max_dimension)
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+
+    tmp_path = f"{output_path}.{os.getpid()}.tmp"
+    image.save(tmp_path, format='JPEG', quality=PAGE_QUALITY)
+    # Atomic, so a concurrent ingest of the same comic never sees half a page
+    os.replace(tmp_path, output_path)
+
+    preview = image.convert('L')
+    preview.thumbnail((128, 128))
+    return round(ImageStat.Stat(preview).stddev[0], 2)
+
+
+def pick_reference_frames(detail, count):
+    """
+    Indexes of `count` representative pages: the most detailed page in each
+    of `count` equal spans, so frames cover the whole comic while skipping
+    blank covers and separator pages.
+    """
+    total = len(detail)
+    if total <= count:
+        return list(range(total))
+    frames = []
+    for span in range(count):
+        start = span * total // count
+        end = (span + 1) * total // count
+        frames.append(max(range(start, end), key=lambda index: detail[index]))
+    return frames
+
+
+class ComicIngestService:
+    """
+    Rasterizes uploaded comics (multi-page PDFs or images) into normalized
+    page images on a process pool.
+
+    Pages are cached under UPLOAD_FOLDER/media/comics/<sha256>_<dpi>/ with a
+    manifest, so a comic is rasterized once per DPI however often it is
+    used; a small set of reference frames is then picked for the creative
+    brief.
+    """
+
+    def __init__(self):
+        self.dpi = 150
+        self.max_dimension = 2048
+        self.max_workers = 2
+        self.reference_frames = 4
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.dpi = app.config.get('COMIC_DPI', self.dpi)
+        self.max_dimension = app.config.get('COMIC_MAX_PAGE_DIM', self.max_dimension)
+        self.max_workers = app.config.get('COMIC_WORKERS', self.max_workers)
+        self.reference_frames = app.config.get('COMIC_REFERENCE_FRAMES', self.reference_frames)
+        app.extensions['comics'] = self
+
+    def _get_executor(self):
+        # Created on first use so the pool is never inherited across a fork, and
+        # started from a clean server process (or spawn) rather than a fork of this one
+        with self._lock:
+            if self._executor is None:
+                method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers, mp_context=multiprocessing.get_context(method)
+                )
+            return self._executor
+
+    def cache_dir(self, source_path, dpi=None):
+        return media_store.path(os.path.join(COMIC_DIR, f"{digest_for(source_path)}_{dpi or self.dpi}"))
+
+    def _manifest_path(self, cache_dir):
+        return os.path.join(cache_dir, 'manifest.json')
+
+    def _load_manifest(self, cache_dir):
+        try:
+            with open(self._manifest_path(cache_dir), 'r') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if all(os.path.exists(os.path.join(cache_dir, name)) for name in manifest['pages']):
+            return manifest
+        return None
+
+    def iter_pages(self, source_path, dpi=None, progress=None):
+        """
+        Yield (page_index, page_path) as pages finish rasterizing (in
+        completion order), straight from the cache when the comic has been
+        ingested before.
+        """
+        dpi = dpi or self.dpi
+        cache_dir = self.cache_dir(source_path, dpi)
+        manifest = self._load_manifest(cache_dir)
+        tracer.cache('comic_pages', manifest is not None)
+        if manifest is not None:
+            storage_manager.touch(os.path.relpath(cache_dir, media_store.folder))
+            for index, name in enumerate(manifest['pages']):
+                yield index, os.path.join(cache_dir, name)
+            return
+
+        os.makedirs(cache_dir, exist_ok=True)
+        total = page_count(source_path)
+        names = [f"page_{index + 1:04d}.{PAGE_FORMAT}" for index in range(total)]
+        detail = [0.0] * total
+        executor = self._get_executor()
+        futures = {
+            executor.submit(
+                rasterize_page, source_path, index, dpi, self.max_dimension, os.path.join(cache_dir, name)
+            ): index
+            for index, name in enumerate(names)
+        }
+        try:
+            for done, future in enumerate(as_completed(futures), start=1):
+                index = futures[future]
+                detail[index] = future.result()
+                if progress:
+                    progress('comic', current=done, total=total)
+                yield index, os.path.join(cache_dir, names[index])
+        finally:
+            # Consumer stopped early or a page failed: don't keep rendering the rest
+            for future in futures:
+                future.cancel()
+
+        tmp_path = f"{self._manifest_path(cache_dir)}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({'pages': names, 'detail': detail, 'dpi': dpi}, f)
+        os.replace(tmp_path, self._manifest_path(cache_dir))
+        storage_manager.register(os.path.relpath(cache_dir, media_store.folder))
+
+    @tracer.traced('comics.ingest')
+    def ingest(self, source_path, dpi=None, progress=None):
+        """
+        Rasterize every page; returns the manifest
+        {'pages': [file names], 'detail': [scores], 'dpi': dpi}.
+        """
+        for _ in self.iter_pages(source_path, dpi, progress):
+            pass
+        manifest = self._load_manifest(self.cache_dir(source_path, dpi))
+        if manifest is None:
+            raise RuntimeError(f"Comic ingestion did not complete for {source_path}")
+        if progress:
+            progress('comic', status='done')
+        return manifest
+
+    def reference_frames_for(self, source_path, count=None, progress=None):
+        """
+        Paths of a few representative page images of a comic.
+        """
+        manifest = self.ingest(source_path, progress=progress)
+        cache_dir = self.cache_dir(source_path)
+        frames = pick_reference_frames(manifest['detail'], count or self.reference_frames)
+        return [os.path.join(cache_dir, manifest['pages'][index]) for index in frames]
+
+    def expand_references(self, reference_image_paths, progress=None):
+        """
+        Replace PDF references with their reference frames; images pass
+        through unchanged. PDFs are skipped (with a warning) when no PDF
+        backend is installed.
+        """
+        expanded = []
+        for path in reference_image_paths:
+            if not is_pdf(path):
+                expanded.append(path)
+            elif not pdf_support():
+                current_app.logger.warning(f"Skipping PDF reference {path}: install pypdfium2 or PyMuPDF")
+            else:
+                expanded.extend(self.reference_frames_for(path, progress=progress))
+        return expanded
+
+
+comic_ingest = ComicIngestService()
@@ -0,0 +1,357 @@
+"""
+Local stand-ins for the Gemini, ElevenLabs and Anam APIs.
+
+Each fake mimics the slice of the real client the services use, with
+configurable latency, failure rate and payload size, so the pipeline can
+be tested and benchmarked offline. Installed by create_app when
+FAKE_PROVIDERS is set (always in the testing config).
+"""
+import io
+import itertools
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+import requests
+from PIL import Image
+
+# MPEG-1 Layer III, 128 kbps, 44.1 kHz, no padding: 417-byte frames of 1152 samples
+MP3_FRAME_HEADER = b'\xff\xfb\x90\x64'
+MP3_FRAME_LENGTH = 417
+
+
+class FakeProviderError(Exception):
+    pass
+
+
+class FakeThrottled(FakeProviderError):
+    """
+    An injected 429, shaped like the SDK errors the rate limiter reads.
+    """
+
+    def __init__(self, message, retry_after=0.05):
+        super().__init__(message)
+        self.status_code = 429
+        self.headers = {'Retry-After': str(retry_after)}
+
+
+class FakeBehavior:
+    """
+    Latency (seconds, plus up to `jitter` extra), failure and throttle
+    (429) rates (0..1) and payload size (bytes) shared by one fake's calls.
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, failure_rate=0.0, payload_bytes=64 * 1024, seed=None,
+                 throttle_rate=0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.throttle_rate = throttle_rate
+        self.payload_bytes = payload_bytes
+        self.calls = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def call(self, name, sleep=True):
+        """
+        Simulate one call: raise an injected 429 or failure, otherwise wait
+        out the latency (or, with sleep=False, return it for the caller to spend).
+        """
+        with self._lock:
+            self.calls += 1
+            delay = self.latency + self._random.uniform(0, self.jitter)
+            fail = self._random.random() < self.failure_rate
+            throttle = self._random.random() < self.throttle_rate
+        if throttle:
+            # Rejected up front, like a real quota check
+            raise FakeThrottled(f"Injected 429 in {name}")
+        if delay and sleep:
+            time.sleep(delay)
+        if fail:
+            raise FakeProviderError(f"Injected failure in {name}")
+        return delay
+
+
+# --- Gemini -----------------------------------------------------------------
+
+class FakeImage:
+    """
+    The slice of google.genai.types.Image the page generator uses.
+    """
+
+    def __init__(self, image_bytes, mime_type):
+        self.image_bytes = image_bytes
+        self.mime_type = mime_type
+
+    def save(self, path):
+        with open(path, 'wb') as f:
+            f.write(self.image_bytes)
+
+
+class _FakeBlob:
+    def __init__(self, data, mime_type):
+        self.data = data
+        self.mime_type = mime_type
+
+
+class _FakeImagePart:
+    def __init__(self, image):
+        self._image = image
+        self.inline_data = _FakeBlob(image.image_bytes, image.mime_type)
+
+    def as_image(self):
+        return self._image
+
+
+class _FakeContentResponse:
+    def __init__(self, text=None, parts=()):
+        self.text = text
+        self.parts = list(parts)
+
+
+class _FakeModels:
+    def __init__(self, client):
+        self.client = client
+
+    def generate_content(self, model, contents, config=None):
+        modalities = [m.lower() for m in (getattr(config, 'response_modalities', None) or [])]
+        if 'image' in modalities:
+            self.client.behavior.call('gemini.generate_image')
+            return _FakeContentResponse(parts=[_FakeImagePart(self.client.page_image())])
+        self.client.behavior.call('gemini.generate_brief')
+        return _FakeContentResponse(text=json.dumps(self.client.brief(contents)))
+
+    def generate_content_stream(self, model, contents, config=None):
+        # The same total latency as generate_content, spread over the chunks
+        delay = self.client.behavior.call('gemini.stream_brief', sleep=False)
+        text = json.dumps(self.client.brief(contents))
+        chunks = [text[i:i + 64] for i in range(0, len(text), 64)]
+        for chunk in chunks:
+            if delay:
+                time.sleep(delay / len(chunks))
+            yield _FakeContentResponse(text=chunk)
+
+
+class FakeGenAIClient:
+    """
+    Stands in for genai.Client: JSON creative briefs for text requests and
+    noise PNG pages of roughly `payload_bytes` for image requests.
+    """
+
+    def __init__(self, behavior=None, pages=4):
+        self.behavior = behavior or FakeBehavior()
+        self.pages = pages
+        self.models = _FakeModels(self)
+        self._counter = itertools.count()
+        self._base = None
+        self._lock = threading.Lock()
+
+    def brief(self, contents):
+        prompt = contents[0] if contents and isinstance(contents[0], str) else ''
+        grouped = re.search(r'JSON array of (\d+) briefs', prompt)
+        if grouped:
+            # A batch's combined brief call: one brief per chapter
+            return [self._brief(prompt) for _ in range(int(grouped.group(1)))]
+        return self._brief(prompt)
+
+    def _brief(self, prompt):
+        return {
+            "voice_description": "A calm, warm narrator with a slight rasp.",
+            "narrator_script": " ".join(
+                f"Page {page} narration for a fake run." for page in range(1, self.pages + 1)
+            ),
+            "visual_style": "Fake manga style",
+            "pages": [f"Fake page {page} prompt ({len(prompt)} chars of context)" for page in range(1, self.pages + 1)]
+        }
+
+    def page_image(self):
+        with self._lock:
+            if self._base is None:
+                # Random noise doesn't compress, so the PNG is about width * height * 3 bytes
+                side = max(8, int((self.behavior.payload_bytes / 3) ** 0.5))
+                self._base = Image.frombytes('RGB', (side, side), random.randbytes(side * side * 3))
+            image = self._base.copy()
+        # Every page is distinct content, as real pages would be
+        image.putpixel((0, 0), tuple(next(self._counter).to_bytes(3, 'big')))
+        buffer = io.BytesIO()
+        image.save(buffer, format='PNG', compress_level=1)
+        return FakeImage(buffer.getvalue(), 'image/png')
+
+
+# --- ElevenLabs -------------------------------------------------------------
+
+class _Obj:
+    def __init__(self, **fields):
+        self.__dict__.update(fields)
+
+
+class _FakeTextToSpeech:
+    def __init__(self, client):
+        self.client = client
+
+    def convert(self, text, voice_id, model_id=None):
+        self.client.behavior.call('elevenlabs.text_to_speech')
+        # Valid MPEG frames, so the segment joiner can parse the output
+        frames = max(1, self.client.behavior.payload_bytes // MP3_FRAME_LENGTH)
+        frame = MP3_FRAME_HEADER + bytes(MP3_FRAME_LENGTH - len(MP3_FRAME_HEADER))
+        return iter([frame] * frames)
+
+
+class _FakeTextToVoice:
+    def __init__(self, client):
+        self.client = client
+
+    def create_previews(self, voice_description, text=None):
+        self.client.behavior.call('elevenlabs.create_previews')
+        return _Obj(previews=[_Obj(generated_voice_id=uuid.uuid4().hex)])
+
+    def create_voice_from_preview(self, voice_name, voice_description, generated_voice_id):
+        self.client.behavior.call('elevenlabs.create_voice')
+        voice_id = uuid.uuid4().hex[:20]
+        with self.client.lock:
+            self.client.voices_created.add(voice_id)
+        return _Obj(voice_id=voice_id)
+
+
+class _FakeVoices:
+    def __init__(self, client):
+        self.client = client
+
+    def delete(self, voice_id):
+        self.client.behavior.call('elevenlabs.delete_voice')
+        with self.client.lock:
+            self.client.voices_created.discard(voice_id)
+
+
+class FakeElevenLabs:
+    """
+    Stands in for the ElevenLabs client: voice design and MP3 synthesis
+    (about `payload_bytes` of silent frames per request).
+    """
+
+    def __init__(self, behavior=None):
+        self.behavior = behavior or FakeBehavior()
+        self.voices_created = set()
+        self.lock = threading.Lock()
+        self.text_to_speech = _FakeTextToSpeech(self)
+        self.text_to_voice = _FakeTextToVoice(self)
+        self.voices = _FakeVoices(self)
+
+
+# --- Anam -------------------------------------------------------------------
+
+class FakeResponse:
+    def __init__(self, status_code, payload=None):
+        self.status_code = status_code
+        self._payload = payload
+        self.text = json.dumps(payload) if payload is not None else ''
+        self.headers = {}
+
+    def json(self):
+        return self._payload
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"{self.status_code} Error", response=self)
+
+
+class FakeAnamHTTP:
+    """
+    Stands in for the Anam HTTPClient: an in-memory avatar list plus
+    session tokens. Injected failures surface as 503 responses.
+    """
+
+    def __init__(self, behavior=None, token_ttl=3600):
+        self.behavior = behavior or FakeBehavior()
+        self.token_ttl = token_ttl
+        self.avatars = {}
+        self._lock = threading.Lock()
+
+    def _call(self, name):
+        try:
+            self.behavior.call(name)
+        except FakeProviderError:
+            return FakeResponse(503, {'error': 'injected failure'})
+        return None
+
+    def request(self, method, path, **kwargs):
+        handler = {'GET': self.get, 'POST': self.post, 'DELETE': self.delete}[method.upper()]
+        return handler(path, **kwargs)
+
+    def get(self, path, **kwargs):
+        failed = self._call('anam.get')
+        if failed:
+            return failed
+        if path.startswith('avatars'):
+            with self._lock:
+                avatars = sorted(self.avatars.values(), key=lambda avatar: avatar['createdAt'], reverse=True)
+            return FakeResponse(200, {'data': avatars})
+        return FakeResponse(404, {'error': 'not found'})
+
+    def post(self, path, files=None, data=None, json=None, **kwargs):
+        failed = self._call('anam.post')
+        if failed:
+            return failed
+        now = datetime.now(timezone.utc)
+        if path == 'avatars':
+            avatar = {
+                'id': str(uuid.uuid4()),
+                'displayName': (data or {}).get('displayName'),
+                'createdAt': now.isoformat()
+            }
+            with self._lock:
+                self.avatars[avatar['id']] = avatar
+            return FakeResponse(200, avatar)
+        if path == 'auth/session-token':
+            return FakeResponse(200, {
+                'sessionToken': uuid.uuid4().hex,
+                'expiresAt': (now + timedelta(seconds=self.token_ttl)).isoformat()
+            })
+        return FakeResponse(404, {'error': 'not found'})
+
+    def delete(self, path, **kwargs):
+        failed = self._call('anam.delete')
+        if failed:
+            return failed
+        avatar_id = path.rsplit('/', 1)[-1]
+        with self._lock:
+            found = self.avatars.pop(avatar_id, None)
+        return FakeResponse(204 if found else 404)
+
+    def close(self):
+        pass
+
+
+def install_fakes(app):
+    """
+    Swap every provider client for its fake, configured from
+    FAKE_LATENCY / FAKE_JITTER / FAKE_FAILURE_RATE / FAKE_THROTTLE_RATE /
+    FAKE_PAYLOAD_BYTES.
+    Returns the fakes by provider name.
+    """
+    config = app.config
+
+    def behavior(throttle=True):
+        return FakeBehavior(
+            latency=config.get('FAKE_LATENCY', 0.0),
+            jitter=config.get('FAKE_JITTER', 0.0),
+            failure_rate=config.get('FAKE_FAILURE_RATE', 0.0),
+            throttle_rate=config.get('FAKE_THROTTLE_RATE', 0.0) if throttle else 0.0,
+            payload_bytes=config.get('FAKE_PAYLOAD_BYTES', 64 * 1024)
+        )
+
+    fakes = {
+        'gemini': FakeGenAIClient(behavior(), pages=config.get('FAKE_BRIEF_PAGES', 4)),
+        'elevenlabs': FakeElevenLabs(behavior()),
+        # The Anam fake replaces the HTTPClient (and its limiter), so 429s would only fail jobs
+        'anam': FakeAnamHTTP(behavior(throttle=False))
+    }
+    services = app.extensions['services']
+    services.override('genai', fakes['gemini'])
+    services.override('elevenlabs', fakes['elevenlabs'])
+    services.override('anam_http', fakes['anam'])
+    app.extensions['fake_providers'] = fakes
+    return fakes
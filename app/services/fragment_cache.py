@@ -0,0 +1,50 @@
+import threading
+from collections import OrderedDict
+from markupsafe import Markup
+from app.services.tracing import tracer
+
+
+class FragmentCache:
+    """
+    In-memory LRU of rendered HTML fragments (e.g. project cards), keyed
+    by something that changes with their content, such as the project's
+    store version. Stale entries are never invalidated; they age out.
+    Per process.
+    """
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._fragments = OrderedDict()
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.max_entries = app.config.get('FRAGMENT_CACHE_MAX_ENTRIES', self.max_entries)
+        with self._lock:
+            self._fragments.clear()
+        app.extensions['fragment_cache'] = self
+
+    def get_or_render(self, key, render):
+        """
+        The cached fragment for `key`, or `render()`'s. `render` returns
+        (html, cacheable); uncacheable fragments (e.g. ones still pointing
+        at a placeholder) are rendered again next time.
+        """
+        with self._lock:
+            html = self._fragments.get(key)
+            if html is not None:
+                self._fragments.move_to_end(key)
+        tracer.cache('fragment', html is not None)
+        if html is not None:
+            return html
+        html, cacheable = render()
+        html = Markup(html)
+        if cacheable and self.max_entries:
+            with self._lock:
+                self._fragments[key] = html
+                self._fragments.move_to_end(key)
+                while len(self._fragments) > self.max_entries:
+                    self._fragments.popitem(last=False)
+        return html
+
+
+fragment_cache = FragmentCache()
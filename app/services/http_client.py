@@ -0,0 +1,144 @@
+import email.utils
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+from app.services.tracing import tracer
+
+# Statuses worth retrying: rate limited or a transient server failure
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+# Non-idempotent requests (e.g. creating an avatar) only retry when the
+# server says it did not process them
+RATE_LIMIT_STATUSES = (429,)
+
+
+class HTTPClient:
+    """
+    Pooled JSON/HTTP client for a provider API.
+
+    One requests.Session (keep-alive, bounded connection pool) per process,
+    explicit (connect, read) timeouts and exponential-backoff retries that
+    honour Retry-After. With a `limiter` (rate_limits.ProviderLimiter)
+    every attempt takes one of its slots.
+    """
+
+    def __init__(self, base_url, headers=None, pool_size=10, connect_timeout=5, read_timeout=60,
+                 max_retries=3, backoff_factor=0.5, max_backoff=20, limiter=None):
+        self.base_url = base_url.rstrip('/')
+        self.headers = headers or {}
+        self.pool_size = pool_size
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+        self.limiter = limiter
+        self._session = None
+        self._lock = threading.Lock()
+
+    @property
+    def session(self):
+        # Built on first use so a pre-fork import never shares sockets between workers
+        with self._lock:
+            if self._session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                session.headers.update(self.headers)
+                self._session = session
+            return self._session
+
+    def request(self, method, path, retry_statuses=None, idempotent=True, **kwargs):
+        """
+        Send a request, retrying connection errors, timeouts and
+        `retry_statuses` with exponential backoff. Returns the final
+        response (callers decide whether to raise_for_status).
+
+        A non-idempotent request (`idempotent=False`) is only resent when
+        it never reached the server: connect failures, not read timeouts or
+        dropped responses, and by default only on RATE_LIMIT_STATUSES.
+        """
+        url = path if path.startswith('http') else f"{self.base_url}/{path.lstrip('/')}"
+        kwargs.setdefault('timeout', self.timeout)
+        if retry_statuses is None:
+            retry_statuses = RETRY_STATUSES if idempotent else RATE_LIMIT_STATUSES
+
+        for attempt in range(self.max_retries + 1):
+            last_attempt = attempt == self.max_retries
+            if attempt:
+                tracer.record(retries=1)
+            try:
+                response = self._send(method, url, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                if last_attempt or not (idempotent or _not_sent(e)):
+                    raise
+                time.sleep(self._backoff(attempt))
+                continue
+
+            body = response.request.body if response.request is not None else None
+            tracer.record(bytes_sent=len(body) if body else 0, bytes_received=len(response.content))
+            if response.status_code not in retry_statuses or last_attempt:
+                return response
+            time.sleep(self._backoff(attempt, response.headers.get('Retry-After')))
+
+    def _send(self, method, url, **kwargs):
+        if self.limiter is None:
+            return self.session.request(method, url, **kwargs)
+        with self.limiter.slot() as slot:
+            response = self.session.request(method, url, **kwargs)
+            slot.status(response.status_code, response.headers.get('Retry-After'))
+            return response
+
+    def get(self, path, **kwargs):
+        return self.request('GET', path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request('POST', path, **kwargs)
+
+    def delete(self, path, **kwargs):
+        return self.request('DELETE', path, **kwargs)
+
+    def _backoff(self, attempt, retry_after=None):
+        if retry_after:
+            delay = parse_retry_after(retry_after)
+            if delay is not None:
+                return min(delay, self.max_backoff)
+        return min(self.backoff_factor * (2 ** attempt), self.max_backoff)
+
+    def close(self):
+        with self._lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+
+
+def _not_sent(error):
+    """
+    True if the request failed before any of it reached the server.
+    """
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    if isinstance(error, requests.exceptions.Timeout):
+        return False
+    # requests wraps urllib3's MaxRetryError, whose reason is the underlying failure
+    reason = error.args[0] if error.args else None
+    reason = getattr(reason, 'reason', reason)
+    return isinstance(reason, NewConnectionError)
+
+
+def parse_retry_after(value):
+    """
+    Retry-After is either delta-seconds or an HTTP date. Returns seconds or None.
+    """
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        pass
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at is None:
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
@@ -0,0 +1,81 @@
+import io
+import threading
+from PIL import Image
+
+PASSTHROUGH_MIME_TYPES = ('image/jpeg', 'image/png', 'image/webp')
+
+
+def _part(data, mime_type):
+    # The SDK is imported on first use, not when the app starts
+    from google.genai import types
+    return types.Part.from_bytes(data=data, mime_type=mime_type)
+
+
+class ImageAssetCache:
+    """
+    Per-job cache of image payloads sent to Gemini.
+
+    Each reference image is decoded once, downscaled to `max_dimension` and
+    encoded once; the same Part is reused for the brief call and every page
+    call. Generated pages are kept in memory so the next page can condition
+    on them without re-reading the file from disk.
+    """
+
+    def __init__(self, max_dimension=1536, jpeg_quality=90):
+        self.max_dimension = max_dimension
+        self.jpeg_quality = jpeg_quality
+        self._parts = {}
+        self._lock = threading.Lock()
+
+    def child(self):
+        """
+        A cache for one job that starts with this cache's payloads, e.g.
+        the reference images a batch's chapters share. Pages the child
+        remembers stay in the child.
+        """
+        child = ImageAssetCache(self.max_dimension, self.jpeg_quality)
+        with self._lock:
+            child._parts = dict(self._parts)
+        return child
+
+    def reference_parts(self, paths):
+        return [self.reference_part(path) for path in paths]
+
+    def reference_part(self, path):
+        with self._lock:
+            part = self._parts.get(path)
+            if part is None:
+                data, mime_type = self._encode(path)
+                part = _part(data, mime_type)
+                self._parts[path] = part
+            return part
+
+    def remember_page(self, path, data, mime_type):
+        """
+        Keep a generated page's encoded bytes for the pages that follow it.
+        The Part wraps the same bytes object the response carried, uncopied.
+        """
+        with self._lock:
+            self._parts[path] = _part(data, mime_type)
+
+    def page_part(self, path):
+        """
+        Part for a previously generated page: from memory if this job wrote
+        it, otherwise decoded from disk like a reference image.
+        """
+        return self.reference_part(path)
+
+    def _encode(self, path):
+        with Image.open(path) as image:
+            # Already small enough and in a format Gemini accepts: send the original bytes
+            mime_type = Image.MIME.get(image.format)
+            if max(image.size) <= self.max_dimension and mime_type in PASSTHROUGH_MIME_TYPES:
+                with open(path, 'rb') as f:
+                    return f.read(), mime_type
+            image.thumbnail((self.max_dimension, self.max_dimension))
+            buffer = io.BytesIO()
+            if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+                image.save(buffer, format='PNG', optimize=True)
+                return buffer.getvalue(), 'image/png'
+            image.convert('RGB').save(buffer, format='JPEG', quality=self.jpeg_quality)
+            return buffer.getvalue(), 'image/jpeg'
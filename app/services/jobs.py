@@ -0,0 +1,366 @@
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+from app.services.sqlite import ThreadLocalConnection
+from app.services.tracing import tracer
+
+# Job states
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    title TEXT NOT NULL,
+    status TEXT NOT NULL,
+    message TEXT NOT NULL,
+    stages TEXT NOT NULL,
+    result TEXT,
+    error TEXT,
+    trace TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    version INTEGER NOT NULL,
+    owner TEXT NOT NULL,
+    heartbeat_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_updated_at ON jobs (updated_at);
+"""
+
+
+class Job:
+    """
+    A background generation job. Progress is reported per stage, e.g.
+    {'brief': {'status': 'done'}, 'pages': {'status': 'running', 'current': 2, 'total': 6}}.
+    """
+
+    def __init__(self, kind, title):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.title = title
+        self.status = QUEUED
+        self.stages = {}
+        self.message = 'Queued'
+        self.result = None
+        self.error = None
+        self.trace = None
+        self.created_at = time.time()
+        self.updated_at = self.created_at
+        self.version = 0
+        self._store = None
+        self._changed = threading.Condition()
+
+    @property
+    def finished(self):
+        return self.status in (DONE, FAILED)
+
+    def _touch(self):
+        # Caller holds self._changed
+        self.version += 1
+        self.updated_at = time.time()
+        if self._store:
+            self._store._save(self)
+        self._changed.notify_all()
+
+    def progress(self, stage, status=RUNNING, current=None, total=None, message=None):
+        """
+        Progress callback handed to the services.
+        """
+        with self._changed:
+            entry = {'status': status}
+            if current is not None:
+                entry['current'] = current
+            if total is not None:
+                entry['total'] = total
+            self.stages[stage] = entry
+            if message:
+                self.message = message
+            elif total:
+                self.message = f"{stage.capitalize()}: {current} of {total}"
+            else:
+                self.message = f"{stage.capitalize()}: {status}"
+            self._touch()
+
+    def _set_state(self, status, message, result=None, error=None):
+        with self._changed:
+            self.status = status
+            self.message = message
+            self.result = result
+            self.error = error
+            self._touch()
+
+    def wait_for_change(self, version, timeout=None):
+        """
+        Block until the job version moves past `version` (or timeout).
+        Returns the current version.
+        """
+        with self._changed:
+            if self.version == version and not self.finished:
+                self._changed.wait(timeout)
+            return self.version
+
+    def trace_dict(self):
+        return self.trace.to_dict() if self.trace else None
+
+    def to_dict(self):
+        with self._changed:
+            return {
+                'id': self.id,
+                'kind': self.kind,
+                'title': self.title,
+                'status': self.status,
+                'message': self.message,
+                'stages': {stage: dict(entry) for stage, entry in self.stages.items()},
+                'result': self.result,
+                'error': self.error,
+                'created_at': self.created_at,
+                'updated_at': self.updated_at,
+                'version': self.version
+            }
+
+
+class StoredJob:
+    """
+    A job run by another worker process, read back from the job store.
+    Changes are picked up by polling.
+    """
+
+    def __init__(self, manager, data, trace):
+        self._manager = manager
+        self._data = data
+        self._trace = trace
+
+    @property
+    def id(self):
+        return self._data['id']
+
+    @property
+    def finished(self):
+        return self._data['status'] in (DONE, FAILED)
+
+    def _refresh(self):
+        loaded = self._manager._load(self.id)
+        if loaded:
+            self._data, self._trace = loaded._data, loaded._trace
+
+    def wait_for_change(self, version, timeout=None):
+        deadline = time.monotonic() + (timeout or 0)
+        while True:
+            self._refresh()
+            if self._data['version'] != version or self.finished:
+                return self._data['version']
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return self._data['version']
+            time.sleep(min(self._manager.poll_interval, remaining))
+
+    def trace_dict(self):
+        return self._trace
+
+    def to_dict(self):
+        return {**self._data, 'stages': {stage: dict(entry) for stage, entry in self._data['stages'].items()}}
+
+
+class JobManager:
+    """
+    Runs long provider round-trips (manga generation, avatar creation) on a
+    bounded worker pool so web workers return immediately with a job id.
+
+    A job runs in the process that accepted it, but every change is written
+    through to a SQLite (WAL) table, so any worker process can answer its
+    status, trace and event requests. The owning process stamps a heartbeat
+    on its unfinished jobs every JOB_HEARTBEAT_INTERVAL seconds; a job whose
+    heartbeat is older than JOB_STALE_AFTER (its process died or restarted)
+    is marked failed when it is read.
+    """
+
+    def __init__(self):
+        self.app = None
+        self.max_workers = 8
+        self.max_finished = 200
+        self.poll_interval = 0.5
+        self.heartbeat_interval = 10
+        self.stale_after = 60
+        self.db = ThreadLocalConnection()
+        self._executor = None
+        self._jobs = {}
+        self._heartbeat_pid = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.app = app
+        self.max_workers = app.config.get('JOB_WORKERS', self.max_workers)
+        self.max_finished = app.config.get('JOB_MAX_FINISHED', self.max_finished)
+        self.poll_interval = app.config.get('JOB_POLL_INTERVAL', self.poll_interval)
+        self.heartbeat_interval = app.config.get('JOB_HEARTBEAT_INTERVAL', self.heartbeat_interval)
+        self.stale_after = app.config.get('JOB_STALE_AFTER', self.stale_after)
+        path = str(app.config.get('JOB_DB_PATH') or os.path.join(app.instance_path, 'jobs.sqlite3'))
+        self.db.open(path, SCHEMA)
+        app.extensions['jobs'] = self
+
+    @staticmethod
+    def _owner():
+        return f"{socket.gethostname()}:{os.getpid()}"
+
+    def _save(self, job):
+        # Called under the job's lock, so rows are written in version order.
+        # The trace is only stored once the job is over; until then the owner serves it.
+        trace = job.trace_dict() if job.finished else None
+        try:
+            with self.db.get() as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO jobs (id, kind, title, status, message, stages, result, error, trace, "
+                    "created_at, updated_at, version, owner, heartbeat_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (job.id, job.kind, job.title, job.status, job.message, json.dumps(job.stages),
+                     json.dumps(job.result, default=str), job.error,
+                     json.dumps(trace, default=str) if trace else None,
+                     job.created_at, job.updated_at, job.version, self._owner(), time.time())
+                )
+        except sqlite3.Error as e:
+            self.app.logger.warning(f"Could not store job {job.id}: {e}")
+
+    def _load(self, job_id):
+        row = self.db.get().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        if row['status'] not in (DONE, FAILED) and time.time() - row['heartbeat_at'] > self.stale_after:
+            row = self._fail_stale(row)
+        data = {key: row[key] for key in ('id', 'kind', 'title', 'status', 'message', 'error',
+                                          'created_at', 'updated_at', 'version')}
+        data['stages'] = json.loads(row['stages'])
+        data['result'] = json.loads(row['result']) if row['result'] else None
+        return StoredJob(self, data, json.loads(row['trace']) if row['trace'] else None)
+
+    def _fail_stale(self, row):
+        """
+        Mark a job whose owner stopped heartbeating as failed; returns the
+        row as it is now (the owner may have written it meanwhile).
+        """
+        error = f"The worker running this job ({row['owner']}) stopped"
+        with self.db.get() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, message = ?, error = ?, updated_at = ?, version = version + 1 "
+                "WHERE id = ? AND version = ?",
+                (FAILED, 'Failed', error, time.time(), row['id'], row['version'])
+            )
+            return conn.execute("SELECT * FROM jobs WHERE id = ?", (row['id'],)).fetchone()
+
+    def _start_heartbeat(self):
+        # Started on first submit in each process, so it's never lost across a fork
+        if not self.heartbeat_interval or self._heartbeat_pid == os.getpid():
+            return
+        with self._lock:
+            if self._heartbeat_pid == os.getpid():
+                return
+            self._heartbeat_pid = os.getpid()
+
+        def run():
+            while True:
+                time.sleep(self.heartbeat_interval)
+                with self._lock:
+                    running = [(time.time(), job.id) for job in self._jobs.values() if not job.finished]
+                if not running:
+                    continue
+                try:
+                    with self.db.get() as conn:
+                        conn.executemany("UPDATE jobs SET heartbeat_at = ? WHERE id = ?", running)
+                except sqlite3.Error as e:
+                    self.app.logger.warning(f"Could not record job heartbeats: {e}")
+
+        threading.Thread(target=run, name='job-heartbeat', daemon=True).start()
+
+    def _get_executor(self):
+        # Created on first submit so pools are never inherited across a fork
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers, thread_name_prefix='job'
+                )
+            return self._executor
+
+    def submit(self, kind, title, func, *args, on_complete=None, on_failure=None, **kwargs):
+        """
+        Queue `func(*args, progress=job.progress, **kwargs)`.
+        `on_complete(result)` runs in the worker once func succeeds and its
+        return value becomes the job result (e.g. the materialized project).
+        `on_failure()` runs in the worker if the job fails (e.g. to clean up).
+        """
+        app = self.app or current_app._get_current_object()
+        job = Job(kind, title)
+        job._store = self
+        with job._changed:
+            job._touch()
+        with self._lock:
+            self._jobs[job.id] = job
+        self._prune()
+        self._start_heartbeat()
+        self._get_executor().submit(self._run, app, job, func, args, kwargs, on_complete, on_failure)
+        return job
+
+    def _run(self, app, job, func, args, kwargs, on_complete, on_failure):
+        with app.app_context():
+            job._set_state(RUNNING, 'Starting...')
+            try:
+                # Every span of the job, including its worker threads, lands in job.trace
+                with tracer.trace(job.id, f"job.{job.kind}") as job.trace:
+                    result = func(*args, progress=job.progress, **kwargs)
+                    if on_complete:
+                        result = on_complete(result)
+                job._set_state(DONE, 'Completed', result=result)
+            except Exception as e:
+                current_app.logger.error(f"Job {job.id} ({job.kind}) failed: {e}")
+                job._set_state(FAILED, 'Failed', error=str(e))
+                if on_failure:
+                    try:
+                        on_failure()
+                    except Exception as cleanup_error:
+                        current_app.logger.error(f"Job {job.id} cleanup failed: {cleanup_error}")
+
+    def get(self, job_id):
+        """
+        The job, live if this process runs it, otherwise as last stored.
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+        return job or self._load(job_id)
+
+    def _prune(self):
+        """
+        Drop the oldest finished jobs beyond max_finished, in memory and
+        in the store.
+        """
+        with self._lock:
+            finished = [job for job in self._jobs.values() if job.finished]
+            excess = len(finished) - self.max_finished
+            if excess > 0:
+                finished.sort(key=lambda job: job.updated_at)
+                for job in finished[:excess]:
+                    del self._jobs[job.id]
+        try:
+            with self.db.get() as conn:
+                conn.execute(
+                    "DELETE FROM jobs WHERE id IN (SELECT id FROM jobs WHERE status IN (?, ?) "
+                    "ORDER BY updated_at DESC LIMIT -1 OFFSET ?)",
+                    (DONE, FAILED, self.max_finished)
+                )
+        except sqlite3.Error as e:
+            self.app.logger.warning(f"Could not prune jobs: {e}")
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor:
+            executor.shutdown(wait=wait)
+
+
+job_manager = JobManager()
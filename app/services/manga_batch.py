@@ -0,0 +1,194 @@
+import json
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+from app.models import MangaProject
+from app.services.brief_stream import BriefFeed
+from app.services.comics import comic_ingest
+from app.services.image_assets import ImageAssetCache
+from app.services.manga_generator import manga_service, CONTINUITY_MODES
+from app.services.media import media_store
+from app.services.project_store import project_store
+from app.services.storage import storage_manager
+from app.services.tracing import tracer
+
+
+class _Series:
+    """
+    Chapters sharing a reference set: the references are expanded and
+    encoded once for all of them.
+    """
+
+    def __init__(self, references, max_dimension):
+        self.references = references
+        self.assets = ImageAssetCache(max_dimension=max_dimension)
+        self._paths = None
+        self._lock = threading.Lock()
+
+    def reference_paths(self):
+        with self._lock:
+            if self._paths is None:
+                self._paths = comic_ingest.expand_references([media_store.path(name) for name in self.references])
+            return self._paths
+
+
+class MangaBatchService:
+    """
+    Generates many manga from JSONL records ({"title", "plot",
+    "references", "series", "continuity", "id"}).
+
+    Records with the same series and references are grouped, and each
+    group's briefs are requested MANGA_BATCH_BRIEF_GROUP chapters per brief
+    call, with the reference images encoded once. An item starts as soon
+    as its brief exists, and up to MANGA_BATCH_CONCURRENCY items run
+    at once. Their page and voice calls share the provider rate limiters,
+    which keep the providers saturated without overrunning them. Results
+    come back in completion order.
+    """
+
+    def __init__(self):
+        self.concurrency = 4
+        self.group_size = 4
+
+    def init_app(self, app):
+        self.concurrency = app.config.get('MANGA_BATCH_CONCURRENCY', self.concurrency)
+        self.group_size = app.config.get('MANGA_BATCH_BRIEF_GROUP', self.group_size)
+        app.extensions['manga_batch'] = self
+
+    def _prepare(self, line, number, resolve_reference, continuity):
+        record = json.loads(line)
+        if not isinstance(record, dict):
+            raise ValueError("Record is not a JSON object")
+        title, plot = record.get('title'), record.get('plot')
+        if not isinstance(title, str) or not title.strip() or not isinstance(plot, str) or not plot.strip():
+            raise ValueError("Record needs a non-empty title and plot")
+        references = record.get('references') or []
+        if not isinstance(references, list) or not all(isinstance(name, str) for name in references):
+            raise ValueError("references must be a list of file names")
+        item_continuity = record.get('continuity') or continuity
+        if item_continuity and item_continuity not in CONTINUITY_MODES:
+            raise ValueError(f"Unknown continuity mode: {item_continuity}")
+        return {
+            'line': number,
+            'id': record.get('id'),
+            'title': title.strip(),
+            'plot': plot,
+            'series': record.get('series'),
+            'continuity': item_continuity,
+            'references': tuple(resolve_reference(name) for name in references)
+        }
+
+    @staticmethod
+    def _failure(item, error):
+        return {'line': item['line'], 'id': item.get('id'), 'title': item.get('title'), 'status': 'failed',
+                'error': str(error)}
+
+    def run(self, lines, resolve_reference, continuity=None):
+        """
+        Generate a manga per JSONL line, yielding one result per record as
+        it finishes. `resolve_reference(name)` stores a record's reference
+        and returns its media name; it is called once per distinct name.
+        """
+        app = current_app._get_current_object()
+        max_dimension = app.config.get('REFERENCE_IMAGE_MAX_DIM', 1536)
+        results = queue.Queue()
+        resolved = {}
+
+        def resolve(name):
+            if name not in resolved:
+                resolved[name] = resolve_reference(name)
+            return resolved[name]
+
+        expected = 0
+        groups = {}
+        for number, line in enumerate(lines, start=1):
+            if not line.strip():
+                continue
+            expected += 1
+            try:
+                item = self._prepare(line, number, resolve, continuity)
+            except Exception as e:
+                results.put(self._failure({'line': number}, e))
+                continue
+            key = (item['series'], item['references'])
+            if key not in groups:
+                groups[key] = (_Series(item['references'], max_dimension), [])
+            groups[key][1].append(item)
+
+        brief_executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='batch-brief')
+        item_executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='batch-item')
+        try:
+            for series, items in groups.values():
+                for start in range(0, len(items), self.group_size):
+                    brief_executor.submit(
+                        self._run_briefs, app, series, items[start:start + self.group_size], item_executor, results
+                    )
+            for _ in range(expected):
+                yield results.get()
+        finally:
+            # Nothing new starts if the consumer goes away; running items finish on their own
+            brief_executor.shutdown(wait=False, cancel_futures=True)
+            item_executor.shutdown(wait=False, cancel_futures=True)
+
+    def _run_briefs(self, app, series, items, item_executor, results):
+        with app.app_context():
+            try:
+                paths = series.reference_paths()
+                briefs = manga_service.generate_creative_briefs(
+                    [(item['title'], item['plot']) for item in items], paths, series.assets
+                )
+            except Exception as e:
+                current_app.logger.error(f"Batch briefs failed for lines {[item['line'] for item in items]}: {e}")
+                for item in items:
+                    results.put(self._failure(item, e))
+                return
+            for item, brief in zip(items, briefs):
+                try:
+                    item_executor.submit(
+                        self._run_item, app, item, BriefFeed.complete(brief), paths, series.assets.child(), results
+                    )
+                except RuntimeError as e:
+                    # The batch was abandoned (executor shut down)
+                    results.put(self._failure(item, e))
+
+    def _run_item(self, app, item, feed, paths, assets, results):
+        with app.app_context():
+            started = time.perf_counter()
+            try:
+                with tracer.span('batch.manga', line=item['line']):
+                    result = manga_service.generate_manga(
+                        item['title'], item['plot'], paths, continuity=item['continuity'], feed=feed, assets=assets
+                    )
+                project = project_store.create(
+                    MangaProject,
+                    title=item['title'],
+                    script=result['script'],
+                    audio_path=result['audio_file'],
+                    pages=result['pages'],
+                    audio_segments=result.get('audio_segments'),
+                    brief=result.get('brief'),
+                    continuity=result.get('continuity'),
+                    references=result.get('references'),
+                    page_outputs=result.get('page_outputs')
+                )
+                storage_manager.claim(project)
+            except Exception as e:
+                current_app.logger.error(f"Batch item on line {item['line']} failed: {e}")
+                results.put(self._failure(item, e))
+                return
+            results.put({
+                'line': item['line'],
+                'id': item['id'],
+                'title': item['title'],
+                'status': 'done',
+                'project_id': project.id,
+                'pages': len(result['pages']),
+                'failed_pages': sum(1 for output in result['page_outputs'] if not output['file']),
+                'audio': bool(result['audio_file']),
+                'seconds': round(time.perf_counter() - started, 3)
+            })
+
+
+manga_batch = MangaBatchService()
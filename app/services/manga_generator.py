@@ -1,72 +1,34 @@
 import os
 import json
+import mimetypes
 import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from PIL import Image
 from flask import current_app
-from google import genai
-from google.genai import types
-from app.services.voice_generator import generate_voice
+from app.services.voice_generator import generate_voice, generate_voice_segments, get_voice_id_from_profile
+from app.services.brief_cache import brief_cache
+from app.services.image_assets import ImageAssetCache
+from app.services.renditions import rendition_service
+from app.services.media import media_store, digest_for
+from app.services.comics import comic_ingest
+from app.services.storage import storage_manager
+from app.services.tracing import tracer
+from app.services.rate_limits import rate_limiter
+from app.services.registry import get_service
+from app.services.brief_stream import BriefFeed, BriefStreamParser
 
-class MangaGeneratorService:
-    def __init__(self):
-        self.api_key = os.environ.get('GOOGLE_API_KEY')
-        self.client = None
-        if self.api_key:
-            self.client = genai.Client(api_key=self.api_key)
-
-    def generate_manga(self, title, text, reference_image_paths):
-        """
-        Generates manga pages and voiceover from text and reference images.
-        """
-        if not self.client:
-            raise ValueError("GOOGLE_API_KEY not set")
-
-        # 1. Generate Creative Brief
-        current_app.logger.info("Generating Creative Brief...")
-        brief = self._generate_creative_brief(title, text, reference_image_paths)
-        
-        voice_description = brief.get("voice_description", "Standard narration voice.")
-        final_script = brief.get("narrator_script", text)
-        style_reference = brief.get("visual_style", "Manga style")
-        pages_prompts = brief.get("pages", [])
+CONTINUITY_MODES = ('strict', 'anchor', 'parallel')
 
-        # 2. Generate Voiceover
-        current_app.logger.info("Generating Voiceover...")
-        audio_filename = f"voiceover_{uuid.uuid4().hex[:8]}.mp3"
-        audio_path = os.path.join(current_app.config['UPLOAD_FOLDER'], 'audio', audio_filename)
-        
-        # Ensure audio dir exists
-        os.makedirs(os.path.dirname(audio_path), exist_ok=True)
-        
-        try:
-            generate_voice(final_script, voice_description, audio_path)
-        except Exception as e:
-            current_app.logger.error(f"Voice generation failed: {e}")
-            # Continue without voice if fails, or raise?
+BRIEF_MODEL = "gemini-2.5-flash"
+PAGE_MODEL = "gemini-3-pro-image-preview"
+IMAGE_EXTENSIONS = {'image/png': 'png', 'image/jpeg': 'jpg', 'image/webp': 'webp'}
+# Bump whenever the creative brief prompt below changes, so cached briefs are not reused
+BRIEF_PROMPT_VERSION = 1
 
-        # 3. Generate Manga Pages
-        current_app.logger.info(f"Generating {len(pages_prompts)} Manga Pages...")
-        generated_pages = []
-        last_image_path = None
-
-        for i, prompt in enumerate(pages_prompts, start=1):
-            page_image_path = self._generate_page_image(i, prompt, style_reference, reference_image_paths, last_image_path)
-            if page_image_path:
-                generated_pages.append(os.path.basename(page_image_path))
-                last_image_path = page_image_path
-            else:
-                current_app.logger.error(f"Failed to generate page {i}")
-
-        return {
-            "title": title,
-            "audio_file": audio_filename if os.path.exists(audio_path) else None,
-            "pages": generated_pages,
-            "script": final_script
-        }
-
-    def _generate_creative_brief(self, title, text, reference_image_paths):
-        prompt_generation_request = f"""
+# The brief prompt up to the chapter itself (see _brief_request)
+BRIEF_INSTRUCTIONS = """
 Your task is to analyze the text and generate the image generation prompts for a manga adaptation. You must keep text in pages across the chapter plot, character, style and voice consistent.
 This brief must include both VISUAL prompts for manga page generation and AUDIO directives for voice generation.
 
@@ -86,7 +48,7 @@ However, for this task, the most important part is the *Voice Description*.
 Also provide the full script text to be read.
 
 Respond strictly as a valid JSON object with this structure:
-{{
+{
   "visual_style": "<general style guidelines covering composition, palette, medium, lighting>",
   "voice_description": "<detailed description of the voice tone, gender, age, style, accent, temper, etc.>",
   "narrator_script": "<The full text properly formatted for reading (removing stage directions if any)>",
@@ -94,50 +56,565 @@ Respond strictly as a valid JSON object with this structure:
     "<page 1 detailed prompt consisting of [Subject + Adjectives] doing [Action] in [Location/Context]. [Composition/Angle]. [Lighting/Atmosphere]. [Style/Media]. [Specific Constraint/Text] with dialogue callouts in speech bubbles and sound effects>",
     "<page 2 detailed prompt consisting of [Subject + Adjectives] doing [Action] in [Location/Context]. [Composition/Angle]. [Lighting/Atmosphere]. [Style/Media]. [Specific Constraint/Text] with dialogue callouts in speech bubbles and sound effects>"
   ]
-}}
+}
+
+"""
+
+def _no_progress(stage, **kwargs):
+    pass
+
+def page_outputs(continuity, prompts, page_paths):
+    """
+    Per-page record stored with a project: the page prompt, its media name
+    (None if it failed) and the page it was conditioned on.
+    """
+    outputs = []
+    last_page = None
+    for index, (prompt, path) in enumerate(zip(prompts, page_paths)):
+        if continuity == 'strict':
+            conditioned_on = last_page
+        elif continuity == 'anchor' and index and page_paths[0]:
+            conditioned_on = 0
+        else:
+            conditioned_on = None
+        outputs.append({
+            'prompt': prompt,
+            'file': os.path.basename(path) if path else None,
+            'conditioned_on': conditioned_on
+        })
+        if path:
+            last_page = index
+    return outputs
+
+def _is_valid_brief(brief):
+    return (isinstance(brief, dict) and isinstance(brief.get('pages'), list) and bool(brief['pages'])
+            and all(isinstance(prompt, str) for prompt in brief['pages']))
+
+def _validate_brief(brief):
+    """
+    `brief` if its "pages" are a non-empty list of prompt strings; raises
+    ValueError otherwise, before anything caches or consumes it.
+    """
+    if not _is_valid_brief(brief):
+        raise ValueError("Creative brief has no usable page prompts")
+    return brief
+
+def _store_segments(folder, timeline):
+    """
+    Move the voiceover segment files named in `timeline` from `folder`
+    into the media store; returns the timeline pointing at their media
+    names (None for a segment that is missing).
+    """
+    stored = []
+    for segment in timeline:
+        path = os.path.join(folder, segment['file'])
+        stored.append({**segment, 'file': media_store.put_file(path) if os.path.exists(path) else None})
+    return stored
+
+def downstream_pages(outputs, targets):
+    """
+    `targets` plus every page chained (via conditioned_on) to one of them.
+    """
+    pages = set(targets)
+    for index, output in enumerate(outputs):
+        if output['conditioned_on'] in pages:
+            pages.add(index)
+    return pages
+
+def _image_extension(mime_type):
+    return IMAGE_EXTENSIONS.get(mime_type) or (mimetypes.guess_extension(mime_type) or '.bin').lstrip('.')
+
+def _payload_size(contents):
+    """
+    Bytes of prompt text and inline image data in a request.
+    """
+    size = 0
+    for item in contents:
+        if isinstance(item, str):
+            size += len(item.encode('utf-8'))
+        else:
+            inline = getattr(item, 'inline_data', None)
+            if inline is not None and inline.data:
+                size += len(inline.data)
+    return size
+
+class MangaGeneratorService:
+    @property
+    def client(self):
+        """
+        The genai.Client, built on first use from GOOGLE_API_KEY (None if unset).
+        """
+        return get_service('genai')
+
+    def generate_manga(self, title, text, reference_image_paths, continuity=None, max_workers=None, progress=None,
+                       feed=None, assets=None):
+        """
+        Generates manga pages and voiceover from text and reference images.
+
+        The voiceover is generated concurrently with the page images. The
+        `continuity` mode controls how pages condition on each other:
+          - 'strict':   every page continues from the previous one (sequential)
+          - 'anchor':   page 1 is generated first, every other page continues
+                        from page 1 (pages 2..N run in parallel)
+          - 'parallel': no page-to-page conditioning, all pages run in parallel
+        Page workers are bounded by `max_workers` (MANGA_PAGE_WORKERS by default).
+        `progress(stage, status=..., current=..., total=...)` is called as
+        stages start and finish (see app.services.jobs.Job.progress).
+
+        A `feed` (BriefFeed) whose brief is produced elsewhere, e.g. by a
+        batch's combined brief call, replaces the brief step; `assets` may
+        carry reference payloads already encoded for other chapters.
+        """
+        if not self.client:
+            raise ValueError("GOOGLE_API_KEY not set")
+
+        continuity = continuity or current_app.config.get('MANGA_CONTINUITY', 'strict')
+        if continuity not in CONTINUITY_MODES:
+            raise ValueError(f"Unknown continuity mode: {continuity}")
+        max_workers = max_workers or current_app.config.get('MANGA_PAGE_WORKERS', 4)
+        progress = progress or _no_progress
+        # Decode-once image payloads shared by the brief and every page of this job
+        assets = assets or self._new_asset_cache()
+
+        timings = {"continuity": continuity}
+        started = time.perf_counter()
+
+        # PDF references are rasterized (cached) and stand in as a few reference frames
+        reference_image_paths = comic_ingest.expand_references(reference_image_paths, progress)
+
+        # 1. Creative brief, produced in the background. Streamed (MANGA_STREAM_BRIEF),
+        # its style, voice description and page prompts are usable as soon as each
+        # is complete, so pages and voice design start before the brief finishes.
+        produce_brief = feed is None
+        if produce_brief:
+            current_app.logger.info("Generating Creative Brief...")
+            progress('brief')
+            feed = BriefFeed()
+
+        app = current_app._get_current_object()
+        # Voiceover parts and the joined MP3 go to a scratch directory removed with the job;
+        # what the project keeps is moved into the media store first.
+        # Two extra workers: the brief producer, and the voiceover that never waits behind page jobs
+        with storage_manager.scratch_dir() as scratch, ThreadPoolExecutor(max_workers=max_workers + 2) as executor:
+            audio_path = os.path.join(scratch, 'voiceover.mp3')
+            brief_future = produce_brief and executor.submit(
+                tracer.propagate(self._run_timed), app, self._produce_creative_brief,
+                feed, title, text, reference_image_paths, assets, progress
+            )
+
+            # 2. Generate Voiceover (in the background)
+            current_app.logger.info("Generating Voiceover...")
+            voice_future = executor.submit(
+                tracer.propagate(self._run_timed), app, self._generate_voiceover_from_feed,
+                feed, text, audio_path, progress
+            )
+
+            # 3. Generate Manga Pages
+            current_app.logger.info(f"Generating Manga Pages ({continuity})...")
+            stage_started = time.perf_counter()
+            page_paths, page_timings = self._generate_pages(
+                app, executor, continuity, max_workers, feed, reference_image_paths, assets, progress
+            )
+            timings["pages_total"] = time.perf_counter() - stage_started
+            timings["pages"] = page_timings
+
+            if brief_future:
+                (timings["brief"], timings["brief_first_page"]), _ = brief_future.result()
+            audio_segments, timings["voice"] = voice_future.result()
+            audio_file = media_store.put_file(audio_path) if os.path.exists(audio_path) else None
+            audio_segments = _store_segments(scratch, audio_segments)
+
+        brief = feed.brief()
+        final_script = brief.get("narrator_script", text)
+        pages_prompts = brief.get("pages", [])
+
+        generated_pages = []
+        for i, page_image_path in enumerate(page_paths, start=1):
+            if page_image_path:
+                generated_pages.append(os.path.basename(page_image_path))
+            else:
+                current_app.logger.error(f"Failed to generate page {i}")
+
+        timings["total"] = time.perf_counter() - started
+        current_app.logger.info(f"Manga generation timings: {timings}")
+
+        return {
+            "title": title,
+            "audio_file": audio_file,
+            "audio_segments": audio_segments,
+            "pages": generated_pages,
+            "script": final_script,
+            # Everything needed to regenerate single pages later
+            "brief": brief,
+            "continuity": continuity,
+            "references": [os.path.relpath(path, media_store.folder) for path in reference_image_paths],
+            "page_outputs": page_outputs(continuity, pages_prompts, page_paths),
+            "timings": timings
+        }
+
+    def regenerate_pages(self, brief, continuity, references, outputs, indexes, cascade=False, max_workers=None, progress=None):
+        """
+        Regenerate the pages at `indexes` (0-based) of an existing manga,
+        reusing its stored brief, references and the other pages. With
+        `cascade`, the pages that were conditioned on a regenerated page
+        (directly or through a chain) are regenerated too.
+
+        Returns {"page_outputs", "pages", "regenerated", "replaced"};
+        "regenerated" are the page indexes redone and "replaced" the media
+        names of the page images they superseded.
+        """
+        if not self.client:
+            raise ValueError("GOOGLE_API_KEY not set")
+        max_workers = max_workers or current_app.config.get('MANGA_PAGE_WORKERS', 4)
+        progress = progress or _no_progress
+
+        targets = set(indexes)
+        if cascade:
+            targets = downstream_pages(outputs, targets)
+        prompts = [output['prompt'] for output in outputs]
+        existing = [media_store.path(output['file']) if output['file'] else None for output in outputs]
+        reference_image_paths = [media_store.path(name) for name in references]
+
+        app = current_app._get_current_object()
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            page_paths, _ = self._generate_pages(
+                app, executor, continuity, max_workers, BriefFeed.complete({**brief, "pages": prompts}),
+                reference_image_paths, self._new_asset_cache(), progress, targets=targets, existing=existing
+            )
+
+        # A page that fails again keeps its previous image (if it had one)
+        page_paths = [new or old for new, old in zip(page_paths, existing)]
+        new_outputs = page_outputs(continuity, prompts, page_paths)
+        replaced = [
+            old['file'] for old, new in zip(outputs, new_outputs)
+            if old['file'] and old['file'] != new['file']
+        ]
+        return {
+            "page_outputs": new_outputs,
+            "pages": [output['file'] for output in new_outputs if output['file']],
+            "regenerated": sorted(targets),
+            "replaced": replaced
+        }
+
+    def _generate_voiceover_from_feed(self, feed, text, audio_path, progress=None):
+        """
+        Design (or reuse) the narrator voice as soon as the brief's voice
+        description is known, then synthesize the voiceover once the script
+        and page count are.
+        """
+        voice_description = feed.field("voice_description", "Standard narration voice.")
+        try:
+            # Registers the designed voice, so the voiceover below reuses it
+            get_voice_id_from_profile(voice_description)
+        except Exception as e:
+            current_app.logger.warning(f"Early voice design failed: {e}")
+        brief = feed.brief()
+        return self._generate_voiceover(
+            brief.get("narrator_script", text), voice_description, audio_path, len(brief["pages"]), progress
+        )
+
+    def _generate_voiceover(self, script, voice_description, audio_path, segments=0, progress=None):
+        """
+        Generates the voiceover. With `segments` > 0 (and VOICE_SEGMENTED on)
+        the script is synthesized in parallel segments, one per page, and the
+        timing index is returned; otherwise a single MP3 and an empty index.
+        """
+        progress = progress or _no_progress
+        progress('voice')
+        try:
+            if segments and current_app.config.get('VOICE_SEGMENTED', True):
+                timeline = generate_voice_segments(
+                    script, voice_description, audio_path, segments,
+                    max_workers=current_app.config.get('VOICE_TTS_WORKERS', 4),
+                    on_segment=lambda done, total: progress('voice', current=done, total=total)
+                )
+            else:
+                generate_voice(script, voice_description, audio_path)
+                timeline = []
+            progress('voice', status='done' if os.path.exists(audio_path) else 'failed')
+            return timeline
+        except Exception as e:
+            current_app.logger.error(f"Voice generation failed: {e}")
+            # Continue without voice if fails
+            progress('voice', status='failed')
+            return []
+
+    def _run_timed(self, app, func, *args):
+        """
+        Run `func` inside an app context (for worker threads) and return
+        (result, elapsed_seconds).
+        """
+        with app.app_context():
+            stage_started = time.perf_counter()
+            result = func(*args)
+            return result, time.perf_counter() - stage_started
+
+    def _generate_pages(self, app, executor, continuity, max_workers, feed, reference_image_paths, assets, progress, targets=None, existing=None):
+        """
+        Schedule page generation according to the continuity mode.
+        Returns (page_paths, page_timings), both ordered by page number.
 
-Genres: Manga
+        Page prompts come from `feed` (a BriefFeed); while the brief is still
+        streaming, each page starts as soon as its prompt (and whatever it
+        is conditioned on) is ready. With `targets` only those page indexes
+        are generated; the other pages keep their `existing` paths and are
+        used as-is for continuity.
+        """
+        style_reference = feed.field("visual_style", "Manga style")
+        existing = list(existing or [])
+        results = {}
+        completed = []
+        completed_lock = threading.Lock()
+
+        def total():
+            # Unknown until the brief is complete; count the prompts seen so far
+            return len(targets) if targets is not None else feed.known_pages()
+
+        progress('pages', current=0, total=total() or None)
+
+        def run_page(index, prompt, prev_image_path):
+            outcome = self._run_timed(
+                app, self._generate_page_image,
+                index + 1, prompt, style_reference, reference_image_paths, prev_image_path, assets
+            )
+            with completed_lock:
+                completed.append(index)
+                progress('pages', current=len(completed), total=total())
+            return outcome
+
+        # Bound in-flight page jobs to max_workers (the shared executor also runs the brief and voiceover)
+        slots = threading.BoundedSemaphore(max_workers)
+
+        def run_bounded(index, prompt, prev_image_path):
+            with slots:
+                return run_page(index, prompt, prev_image_path)
+
+        futures = {}
+        last_image_path = None
+        anchor_path = None
+        for index, prompt in enumerate(feed.pages()):
+            current = existing[index] if index < len(existing) else None
+            if targets is not None and index not in targets:
+                results[index] = (current, None)
+            elif continuity == 'strict':
+                results[index] = run_page(index, prompt, last_image_path)
+            elif continuity == 'anchor' and index == 0:
+                results[index] = run_page(index, prompt, None)
+            else:
+                futures[index] = executor.submit(
+                    tracer.propagate(run_bounded), index, prompt, anchor_path if continuity == 'anchor' else None
+                )
+                continue
+            if index == 0:
+                anchor_path = results[0][0]
+            if results[index][0]:
+                last_image_path = results[index][0]
+
+        for index, future in futures.items():
+            results[index] = future.result()
+
+        count = len(results)
+        page_paths = [results[index][0] for index in range(count)]
+        page_timings = [results[index][1] for index in range(count)]
+        progress('pages', status='done', current=len(completed), total=total())
+        return page_paths, page_timings
+
+    def _produce_creative_brief(self, feed, title, text, reference_image_paths, assets, progress):
+        """
+        Fill `feed` with the creative brief (streamed if MANGA_STREAM_BRIEF).
+        Returns (seconds to the complete brief, seconds to the first page prompt).
+        """
+        started = time.perf_counter()
+        try:
+            brief = self._generate_creative_brief(
+                title, text, reference_image_paths, assets,
+                feed=feed if current_app.config.get('MANGA_STREAM_BRIEF', True) else None
+            )
+        except Exception as e:
+            progress('brief', status='failed')
+            feed.fail(e)
+            raise
+        feed.finish(brief)
+        finished = time.perf_counter()
+        progress('brief', status='done')
+        return finished - started, (feed.first_page_at or finished) - started
+
+    def _generate_creative_brief(self, title, text, reference_image_paths, assets=None, feed=None):
+        """
+        The creative brief, from the cache or Gemini. With a `feed`, the
+        response is streamed and its fields and page prompts are published
+        to the feed as they complete.
+        """
+        with tracer.span('gemini.brief', model=BRIEF_MODEL, references=len(reference_image_paths), streamed=feed is not None):
+            reference_digests = [digest_for(path) for path in reference_image_paths]
+            cache_key = brief_cache.make_key(title, text, BRIEF_MODEL, BRIEF_PROMPT_VERSION, reference_digests)
+            brief = brief_cache.get(cache_key)
+            tracer.cache('brief', brief is not None)
+            if brief is not None:
+                current_app.logger.info(f"Creative brief cache hit ({cache_key[:12]})")
+                return brief
+
+            if feed is None:
+                brief = self._request_creative_brief(title, text, reference_image_paths, assets)
+            else:
+                brief = self._stream_creative_brief(title, text, reference_image_paths, feed, assets)
+            brief_cache.set(cache_key, brief)
+            return brief
+
+    def generate_creative_briefs(self, chapters, reference_image_paths, assets=None):
+        """
+        Creative briefs for several chapters ((title, text) pairs) sharing
+        the same reference images. Cached briefs are reused and the rest
+        are requested together in one brief call; chapters the combined
+        response doesn't cover are requested one by one.
+        """
+        reference_digests = [digest_for(path) for path in reference_image_paths]
+        keys = [
+            brief_cache.make_key(title, text, BRIEF_MODEL, BRIEF_PROMPT_VERSION, reference_digests)
+            for title, text in chapters
+        ]
+        briefs = [brief_cache.get(key) for key in keys]
+        for brief in briefs:
+            tracer.cache('brief', brief is not None)
+        missing = [index for index, brief in enumerate(briefs) if brief is None]
+
+        if len(missing) > 1:
+            with tracer.span('gemini.brief_group', model=BRIEF_MODEL, chapters=len(missing),
+                             references=len(reference_image_paths)) as span:
+                try:
+                    grouped = self._request_creative_briefs(
+                        [chapters[index] for index in missing], reference_image_paths, assets
+                    )
+                except ValueError as e:
+                    # Unparseable as a whole: every chapter falls back to its own call
+                    span.error = str(e)
+                    grouped = [None] * len(missing)
+            for index, brief in zip(missing, grouped):
+                if brief is not None:
+                    briefs[index] = brief
+                    brief_cache.set(keys[index], brief)
+
+        for index, brief in enumerate(briefs):
+            if brief is None:
+                briefs[index] = self._generate_creative_brief(*chapters[index], reference_image_paths, assets)
+        return briefs
+
+    def _call_brief_model(self, contents, config):
+        # Throttled (429) calls wait out Retry-After and retry inside the limiter
+        response = rate_limiter.limiter('gemini', BRIEF_MODEL).call(
+            self.client.models.generate_content,
+            model=BRIEF_MODEL,
+            contents=contents,
+            config=config,
+        )
+
+        raw_text = response.text
+        tracer.record(bytes_sent=_payload_size(contents), bytes_received=len(raw_text.encode('utf-8')))
+        # Cleanup markdown
+        if raw_text.startswith("```"):
+            raw_text = re.sub(r"^```(?:\w+)?\s*", "", raw_text, count=1)
+            raw_text = re.sub(r"\s*```$", "", raw_text, count=1)
+
+        return json.loads(raw_text)
+
+    def _request_creative_brief(self, title, text, reference_image_paths, assets=None):
+        contents, config = self._brief_request(title, text, reference_image_paths, assets)
+        return _validate_brief(self._call_brief_model(contents, config))
+
+    def _request_creative_briefs(self, chapters, reference_image_paths, assets=None):
+        """
+        One brief call for several chapters. Returns a brief per chapter,
+        None where the response's entry is missing or malformed.
+        """
+        contents, config = self._brief_group_request(chapters, reference_image_paths, assets)
+        briefs = self._call_brief_model(contents, config)
+        if not isinstance(briefs, list):
+            raise ValueError("Combined creative brief is not a JSON array")
+        briefs = briefs[:len(chapters)] + [None] * (len(chapters) - len(briefs))
+        return [brief if _is_valid_brief(brief) else None for brief in briefs]
+
+    def _stream_creative_brief(self, title, text, reference_image_paths, feed, assets=None):
+        contents, config = self._brief_request(title, text, reference_image_paths, assets)
+
+        def open_stream():
+            # The request is sent on the first read; a 429 surfaces here, where it can be retried
+            stream = iter(self.client.models.generate_content_stream(
+                model=BRIEF_MODEL,
+                contents=contents,
+                config=config,
+            ))
+            return next(stream, None), stream
+
+        def add_page(index, prompt):
+            if not isinstance(prompt, str):
+                raise ValueError(f"Creative brief page {index + 1} is not a prompt string")
+            feed.add_page(index, prompt)
+
+        first, stream = rate_limiter.limiter('gemini', BRIEF_MODEL).call(open_stream)
+        parser = BriefStreamParser(on_field=feed.add_field, on_page=add_page)
+        received = 0
+        chunk = first
+        while chunk is not None:
+            piece = chunk.text or ''
+            received += len(piece.encode('utf-8'))
+            parser.feed(piece)
+            chunk = next(stream, None)
+        tracer.record(bytes_sent=_payload_size(contents), bytes_received=received)
+        return _validate_brief(parser.close())
+
+    def _brief_request(self, title, text, reference_image_paths, assets=None):
+        """
+        The brief prompt (plus reference images) and its generation config.
+        """
+        prompt_generation_request = BRIEF_INSTRUCTIONS + f"""Genres: Manga
 Title: {title}
 Plot:
 {text}
 """
-        images = [Image.open(p) for p in reference_image_paths]
-        
-        try:
-            response = self.client.models.generate_content(
-                model="gemini-2.5-flash",
-                contents=[prompt_generation_request, *images],
-                config=types.GenerateContentConfig(
-                    response_modalities=['Text'],
-                    response_mime_type="application/json"
-                ),
-            )
-            
-            raw_text = response.text
-            # Cleanup markdown
-            if raw_text.startswith("```"):
-                raw_text = re.sub(r"^```(?:\w+)?\s*", "", raw_text, count=1)
-                raw_text = re.sub(r"\s*```$", "", raw_text, count=1)
-                
-            return json.loads(raw_text)
-            
-        finally:
-            for img in images:
-                img.close()
+        from google.genai import types
+        assets = assets or self._new_asset_cache()
+        contents = [prompt_generation_request, *assets.reference_parts(reference_image_paths)]
+        config = types.GenerateContentConfig(
+            response_modalities=['Text'],
+            response_mime_type="application/json"
+        )
+        return contents, config
 
-    def _generate_page_image(self, page_num, prompt_text, style_ref, reference_image_paths, prev_image_path=None):
-        
+    def _brief_group_request(self, chapters, reference_image_paths, assets=None):
+        """
+        The brief prompt for several chapters at once: the same
+        instructions, answered with one brief object per chapter.
+        """
+        listing = "\n".join(
+            f"Chapter {number}\nTitle: {title}\nPlot:\n{text}\n"
+            for number, (title, text) in enumerate(chapters, start=1)
+        )
+        prompt_generation_request = BRIEF_INSTRUCTIONS + f"""Genres: Manga
+The chapters below share the attached images. Write a separate brief for each chapter, based on its own plot.
+Respond with a JSON array of {len(chapters)} briefs, one object per chapter in the order given.
+
+{listing}"""
+        from google.genai import types
+        assets = assets or self._new_asset_cache()
+        contents = [prompt_generation_request, *assets.reference_parts(reference_image_paths)]
+        config = types.GenerateContentConfig(
+            response_modalities=['Text'],
+            response_mime_type="application/json"
+        )
+        return contents, config
+
+    def _generate_page_image(self, page_num, prompt_text, style_ref, reference_image_paths, prev_image_path=None, assets=None):
+        from google.genai import types
         continuation_note = ""
-        continuation_image = None
+        assets = assets or self._new_asset_cache()
         
-        # Load reference images
-        contents = [Image.open(p) for p in reference_image_paths]
+        # Reference images are decoded and encoded once per job by the asset cache
+        contents = assets.reference_parts(reference_image_paths)
         
         if prev_image_path:
             continuation_note = "Continue seamlessly from the attached previous page image to preserve character placement, lighting, and action flow."
             try:
-                continuation_image = Image.open(prev_image_path)
-                contents.append(continuation_image)
+                contents.append(assets.page_part(prev_image_path))
             except Exception as e:
                 current_app.logger.warning(f"Could not load prev image: {e}")
 
@@ -147,36 +624,48 @@ Plot:
         
         contents.insert(0, page_prompt)
 
-        try:
-            # Using the specific model from the script
-            # Note: User might need to ensure this model is enabled in their project
-            response = self.client.models.generate_content(
-                model="gemini-3-pro-image-preview", # As requested by user's script
-                contents=contents,
-                config=types.GenerateContentConfig(
-                    response_modalities=['Text', 'Image'],
-                    image_config=types.ImageConfig(
-                        aspect_ratio="9:16",
-                        image_size="2K"
+        with tracer.span('gemini.page', page=page_num, continued=bool(prev_image_path)) as span:
+            try:
+                # Using the specific model from the script
+                # Note: User might need to ensure this model is enabled in their project
+                response = rate_limiter.limiter('gemini', PAGE_MODEL).call(
+                    self.client.models.generate_content,
+                    model=PAGE_MODEL, # As requested by user's script
+                    contents=contents,
+                    config=types.GenerateContentConfig(
+                        response_modalities=['Text', 'Image'],
+                        image_config=types.ImageConfig(
+                            aspect_ratio="9:16",
+                            image_size="2K"
+                        )
                     )
                 )
-            )
+                tracer.record(bytes_sent=_payload_size(contents))
             
-            for part in response.parts:
-                if part.as_image():
-                    image = part.as_image()
-                    filename = f"manga_page_{uuid.uuid4().hex[:8]}.png"
-                    output_path = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
-                    image.save(output_path)
+                for part in response.parts:
+                    inline = part.inline_data
+                    if inline is None or not inline.data or not (inline.mime_type or '').startswith('image/'):
+                        continue
+                    # The encoded bytes as received: never decoded, re-encoded or copied here
+                    data, mime_type = inline.data, inline.mime_type
+                    tracer.record(bytes_received=len(data))
+                    # Pages are served from the media store under their content hash, in Gemini's format
+                    output_path = media_store.path(media_store.put_bytes(data, _image_extension(mime_type)))
+                    # Hand the same buffer to the next page's request
+                    assets.remember_page(output_path, data, mime_type)
+                    # Thumbnails and responsive sizes are decoded and encoded off this thread
+                    rendition_service.schedule(output_path)
                     return output_path
+                span.status = 'error'
+                span.error = 'No image in response'
                     
-        except Exception as e:
-            current_app.logger.error(f"Error generating page {page_num}: {e}")
-            return None
-        finally:
-            for img in contents:
-                if isinstance(img, Image.Image):
-                    img.close()
-
-import uuid
+            except Exception as e:
+                span.status = 'error'
+                span.error = str(e)
+                current_app.logger.error(f"Error generating page {page_num}: {e}")
+                return None
+
+    def _new_asset_cache(self):
+        return ImageAssetCache(max_dimension=current_app.config.get('REFERENCE_IMAGE_MAX_DIM', 1536))
+
 manga_service = MangaGeneratorService()
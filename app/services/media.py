@@ -0,0 +1,249 @@
+import hashlib
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+from flask import url_for
+from werkzeug.utils import secure_filename
+from app.services.sqlite import ThreadLocalConnection
+
+MEDIA_DIR = 'media'
+# <sha256>.<ext>: the name alone identifies the content, so it can be cached forever
+HASHED_NAME = re.compile(r'^[0-9a-f]{64}\.[a-z0-9]+$')
+CHUNK_SIZE = 1024 * 1024
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS blobs (
+    name TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    refcount INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    project_id INTEGER,
+    accessed_at REAL
+);
+"""
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def is_hashed_name(name):
+    return bool(HASHED_NAME.match(name))
+
+
+def digest_for(path):
+    """
+    Content digest of a stored file: read from a media name for free,
+    hashed from the bytes otherwise.
+    """
+    name = os.path.basename(path)
+    if is_hashed_name(name):
+        return os.path.splitext(name)[0]
+    return file_digest(path)
+
+
+class MediaStore:
+    """
+    Content-addressed media files (pages, audio, uploads) under
+    UPLOAD_FOLDER/media, named <sha256>.<ext>. Served by the media route
+    with immutable caching, strong ETags and byte ranges.
+
+    Identical content is stored once; a blob index (SQLite, shared by all
+    worker processes) keeps each blob's size and reference count, and a
+    blob is deleted when its last reference is released. The index also
+    records the project that owns each blob and when it was last served,
+    for the storage manager.
+    """
+
+    def __init__(self):
+        self.folder = None
+        self.db = ThreadLocalConnection()
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.folder = os.path.join(str(app.config['UPLOAD_FOLDER']), MEDIA_DIR)
+        os.makedirs(self.folder, exist_ok=True)
+        self.db.open(str(app.config.get('MEDIA_DB_PATH') or os.path.join(app.instance_path, 'media.sqlite3')), SCHEMA)
+        app.add_template_global(media_url)
+        app.extensions['media'] = self
+
+    def path(self, name):
+        return os.path.join(self.folder, name)
+
+    def put_file(self, src_path, ext=None, move=True):
+        """
+        Store a file under its content hash and return the media name.
+        Identical content is stored once.
+        """
+        ext = (ext or os.path.splitext(src_path)[1].lstrip('.') or 'bin').lower()
+        name = f"{file_digest(src_path)}.{ext}"
+        if not move:
+            fd, tmp_path = tempfile.mkstemp(dir=self.folder, suffix='.tmp')
+            os.close(fd)
+            shutil.copyfile(src_path, tmp_path)
+            src_path = tmp_path
+        self._commit(src_path, name, os.path.getsize(src_path))
+        return name
+
+    def put_bytes(self, data, ext):
+        """
+        Store an in-memory payload (bytes or a memoryview of them) under its
+        content hash and return the media name. The buffer is hashed and
+        written as-is, never copied or re-read.
+        """
+        view = memoryview(data)
+        name = f"{hashlib.sha256(view).hexdigest()}.{ext.lower()}"
+        fd, tmp_path = tempfile.mkstemp(dir=self.folder, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as out:
+            out.write(view)
+        self._commit(tmp_path, name, view.nbytes)
+        return name
+
+    def save_upload(self, file_storage):
+        """
+        Stream an uploaded FileStorage to disk in chunks while hashing it.
+        Returns the media name; the digest is its stem.
+        """
+        ext = os.path.splitext(secure_filename(file_storage.filename or ''))[1].lstrip('.').lower() or 'bin'
+        digest = hashlib.sha256()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=self.folder, suffix='.upload')
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                for chunk in iter(lambda: file_storage.stream.read(CHUNK_SIZE), b''):
+                    digest.update(chunk)
+                    out.write(chunk)
+                    size += len(chunk)
+        except Exception:
+            os.remove(tmp_path)
+            raise
+        name = f"{digest.hexdigest()}.{ext}"
+        self._commit(tmp_path, name, size)
+        return name
+
+    def _commit(self, tmp_path, name, size):
+        """
+        Move a fully written file into place (or drop it if the blob already
+        exists) and take a reference on the blob.
+        """
+        dest = self.path(name)
+        now = time.time()
+        with self._lock, self.db.get() as conn:
+            # Write lock across processes, so a concurrent release can't delete the blob under us
+            conn.execute("BEGIN IMMEDIATE")
+            if os.path.exists(dest):
+                os.remove(tmp_path)
+            else:
+                os.replace(tmp_path, dest)
+            conn.execute(
+                "INSERT INTO blobs (name, size, refcount, created_at, accessed_at) VALUES (?, ?, 1, ?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET refcount = refcount + 1, accessed_at = excluded.accessed_at",
+                (name, size, now, now)
+            )
+
+    def release(self, name):
+        """
+        Drop a reference; the blob is deleted with its last reference.
+        """
+        if not name or not is_hashed_name(name):
+            return
+        with self._lock, self.db.get() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("UPDATE blobs SET refcount = refcount - 1 WHERE name = ?", (name,))
+            row = conn.execute("SELECT refcount FROM blobs WHERE name = ?", (name,)).fetchone()
+            if row is None or row['refcount'] > 0:
+                return
+            conn.execute("DELETE FROM blobs WHERE name = ?", (name,))
+            try:
+                os.remove(self.path(name))
+            except OSError:
+                pass
+
+    def claim(self, names, project_id):
+        """
+        Record `project_id` as the owner of blobs that don't have one yet.
+        Unowned blobs past the storage manager's grace period are orphans.
+        """
+        names = [name for name in names if name and is_hashed_name(name)]
+        if not names:
+            return
+        with self.db.get() as conn:
+            conn.executemany(
+                "UPDATE blobs SET project_id = ? WHERE name = ? AND project_id IS NULL",
+                [(project_id, name) for name in names]
+            )
+
+    def touch(self, accessed):
+        """
+        Record last access times: {name: timestamp}.
+        """
+        with self.db.get() as conn:
+            conn.executemany(
+                "UPDATE blobs SET accessed_at = ? WHERE name = ?",
+                [(accessed_at, name) for name, accessed_at in accessed.items()]
+            )
+
+    def collect_orphans(self, stored_before, limit):
+        """
+        Delete up to `limit` blobs no project claimed that were last stored
+        or served before `stored_before` (uploads and pages of jobs that
+        never finished). Returns (count, bytes).
+        """
+        rows = self.db.get().execute(
+            "SELECT name FROM blobs WHERE project_id IS NULL AND COALESCE(accessed_at, created_at) < ? LIMIT ?",
+            (stored_before, limit)
+        ).fetchall()
+        count = freed = 0
+        for row in rows:
+            with self._lock, self.db.get() as conn:
+                conn.execute("BEGIN IMMEDIATE")
+                # Re-checked under the write lock: a job may have finished meanwhile
+                current = conn.execute(
+                    "SELECT size FROM blobs WHERE name = ? AND project_id IS NULL "
+                    "AND COALESCE(accessed_at, created_at) < ?", (row['name'], stored_before)
+                ).fetchone()
+                if current is None:
+                    continue
+                conn.execute("DELETE FROM blobs WHERE name = ?", (row['name'],))
+                try:
+                    os.remove(self.path(row['name']))
+                except OSError:
+                    pass
+            count += 1
+            freed += current['size']
+        return count, freed
+
+    def refcount(self, name):
+        row = self.db.get().execute("SELECT refcount FROM blobs WHERE name = ?", (name,)).fetchone()
+        return row['refcount'] if row else 0
+
+    def resolve(self, name, legacy_prefix=''):
+        """
+        Filesystem path of a media name, falling back to files saved
+        directly in the upload folder before the media store existed.
+        """
+        if is_hashed_name(name):
+            return self.path(name)
+        return os.path.join(os.path.dirname(self.folder), legacy_prefix, name)
+
+
+def media_url(name, legacy_prefix=''):
+    """
+    URL for a stored file: the media route for content-hashed names, the
+    static uploads folder for older files.
+    """
+    if not name:
+        return None
+    if is_hashed_name(name) or name.startswith(('renditions/', 'comics/')):
+        return url_for('main.media', name=name)
+    return url_for('static', filename=f"uploads/{legacy_prefix}{name}")
+
+
+media_store = MediaStore()
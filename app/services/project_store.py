@@ -0,0 +1,154 @@
+import base64
+import binascii
+import json
+import os
+import time
+from datetime import datetime
+from app.models import PROJECT_TYPES
+from app.services.sqlite import ThreadLocalConnection
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS projects (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    type TEXT NOT NULL,
+    title TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    data TEXT NOT NULL,
+    version INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_projects_created_at ON projects (created_at DESC, id DESC);
+CREATE TABLE IF NOT EXISTS generation (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    value INTEGER NOT NULL,
+    modified_at REAL NOT NULL
+);
+INSERT OR IGNORE INTO generation (id, value, modified_at) VALUES (1, 0, strftime('%s', 'now'));
+"""
+
+
+def encode_cursor(project):
+    """
+    Opaque listing cursor for the page after `project`.
+    """
+    raw = f"{project.created_at.isoformat()}|{project.id}".encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """
+    (created_at, id) from a cursor; ValueError if it isn't one.
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode('utf-8')
+        created_at, project_id = raw.rsplit('|', 1)
+        return datetime.fromisoformat(created_at).isoformat(), int(project_id)
+    except (binascii.Error, UnicodeDecodeError, ValueError) as e:
+        raise ValueError(f"Invalid cursor: {cursor!r}") from e
+
+
+class ProjectStore:
+    """
+    SQLite (WAL) repository for AvatarProject / MangaProject.
+
+    Shared by every worker process: ids are allocated by SQLite on insert,
+    lookups go through the primary key and listings walk the created_at
+    index newest first. Each thread uses its own connection.
+
+    Every write bumps a store-wide generation counter in the same
+    transaction and stamps the project with it (`version`), so listings
+    can be validated (ETag / Last-Modified) and rendered fragments cached
+    without reading the projects themselves.
+    """
+
+    def __init__(self):
+        self.db = ThreadLocalConnection()
+
+    def init_app(self, app):
+        path = str(app.config.get('PROJECT_DB_PATH') or os.path.join(app.instance_path, 'projects.sqlite3'))
+        self.db.open(path, SCHEMA)
+        app.extensions['project_store'] = self
+
+    def _connect(self):
+        return self.db.get()
+
+    @staticmethod
+    def _to_row(project):
+        data = {field: getattr(project, field) for field in project.DATA_FIELDS}
+        return project.type, project.title, project.created_at.isoformat(), json.dumps(data)
+
+    @staticmethod
+    def _from_row(row):
+        project_cls = PROJECT_TYPES[row['type']]
+        return project_cls(
+            id=row['id'],
+            title=row['title'],
+            created_at=datetime.fromisoformat(row['created_at']),
+            version=row['version'],
+            **json.loads(row['data'])
+        )
+
+    @staticmethod
+    def _bump(conn):
+        conn.execute("UPDATE generation SET value = value + 1, modified_at = ? WHERE id = 1", (time.time(),))
+        return conn.execute("SELECT value FROM generation WHERE id = 1").fetchone()[0]
+
+    def generation(self):
+        """
+        (generation, modified_at): changes whenever any project is written.
+        """
+        row = self._connect().execute("SELECT value, modified_at FROM generation WHERE id = 1").fetchone()
+        return row['value'], row['modified_at']
+
+    def create(self, project_cls, **fields):
+        """
+        Insert a new project; the id is allocated atomically by SQLite.
+        """
+        project = project_cls(id=None, **fields)
+        with self._connect() as conn:
+            project.version = self._bump(conn)
+            cursor = conn.execute(
+                "INSERT INTO projects (type, title, created_at, data, version) VALUES (?, ?, ?, ?, ?)",
+                (*self._to_row(project), project.version)
+            )
+        project.id = cursor.lastrowid
+        return project
+
+    def update(self, project):
+        """
+        Persist a modified project's data fields.
+        """
+        _, title, _, data = self._to_row(project)
+        with self._connect() as conn:
+            project.version = self._bump(conn)
+            conn.execute(
+                "UPDATE projects SET title = ?, data = ?, version = ? WHERE id = ?",
+                (title, data, project.version, project.id)
+            )
+        return project
+
+    def get(self, project_id, project_type=None):
+        row = self._connect().execute("SELECT * FROM projects WHERE id = ?", (project_id,)).fetchone()
+        if row is None or (project_type and row['type'] != project_type):
+            return None
+        return self._from_row(row)
+
+    def list_recent(self, limit=24, before=None):
+        """
+        Newest-first page of projects. `before` is a (created_at, id) cursor
+        taken from the last project of the previous page (see decode_cursor).
+        """
+        if before:
+            created_at, project_id = before
+            rows = self._connect().execute(
+                "SELECT * FROM projects WHERE (created_at, id) < (?, ?) "
+                "ORDER BY created_at DESC, id DESC LIMIT ?",
+                (created_at.isoformat() if isinstance(created_at, datetime) else created_at, project_id, limit)
+            ).fetchall()
+        else:
+            rows = self._connect().execute(
+                "SELECT * FROM projects ORDER BY created_at DESC, id DESC LIMIT ?", (limit,)
+            ).fetchall()
+        return [self._from_row(row) for row in rows]
+
+
+project_store = ProjectStore()
@@ -0,0 +1,250 @@
+import random
+import threading
+import time
+from contextlib import contextmanager
+from app.services.http_client import parse_retry_after
+from app.services.tracing import tracer
+
+OK = 'ok'
+THROTTLED = 'throttled'
+OVERLOADED = 'overloaded'
+ERROR = 'error'
+
+# Server-side overload (and timeouts) shrink concurrency like a 429 but
+# aren't retried here; callers own those retries
+OVERLOAD_STATUSES = (500, 502, 503, 504)
+
+
+def error_status(error):
+    """
+    HTTP status behind a provider SDK exception, if any: google-genai
+    APIError (.code), ElevenLabs ApiError (.status_code), requests
+    HTTPError (.response.status_code).
+    """
+    for attribute in ('code', 'status_code'):
+        value = getattr(error, attribute, None)
+        if isinstance(value, int):
+            return value
+    response = getattr(error, 'response', None)
+    return getattr(response, 'status_code', None)
+
+
+def error_retry_after(error):
+    headers = getattr(error, 'headers', None) or getattr(getattr(error, 'response', None), 'headers', None)
+    if not headers:
+        return None
+    return parse_retry_after(headers.get('Retry-After') or headers.get('retry-after'))
+
+
+def classify_status(status):
+    if status == 429:
+        return THROTTLED
+    if status in OVERLOAD_STATUSES:
+        return OVERLOADED
+    return OK
+
+
+def classify_error(error):
+    status = error_status(error)
+    if status is not None:
+        outcome = classify_status(status)
+        return ERROR if outcome == OK else outcome
+    # requests, httpx and the SDKs all name their timeout exceptions *Timeout*
+    if isinstance(error, TimeoutError) or 'timeout' in type(error).__name__.lower():
+        return OVERLOADED
+    return ERROR
+
+
+class TokenBucket:
+    """
+    `rate` requests per second with bursts of up to `burst`. A Retry-After
+    pauses the whole bucket.
+    """
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = max(1.0, float(burst))
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    wait = self.paused_until - now
+                else:
+                    if self.rate:
+                        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                    else:
+                        self.tokens = self.burst
+                    self.updated = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        with self._lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            # Resume gently rather than with a full burst
+            self.tokens = min(self.tokens, 1.0)
+
+
+class AdaptiveConcurrency:
+    """
+    AIMD concurrency limit: +1 per window of successful calls while latency
+    stays near the best seen, multiplicative decrease on throttling or
+    overload (and a gentler one when latency climbs).
+    """
+
+    def __init__(self, initial=4, minimum=1, maximum=16, decrease=0.5, latency_tolerance=2.0, latency_slack=0.05):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.limit = float(min(max(initial, minimum), maximum))
+        self.decrease = decrease
+        self.latency_tolerance = latency_tolerance
+        # Seconds of headroom, so jitter on near-instant calls doesn't read as congestion
+        self.latency_slack = latency_slack
+        self.in_flight = 0
+        self.baseline = None
+        self._changed = threading.Condition()
+
+    def acquire(self):
+        with self._changed:
+            while self.in_flight >= int(self.limit):
+                self._changed.wait()
+            self.in_flight += 1
+
+    def release(self, outcome, latency):
+        with self._changed:
+            self.in_flight -= 1
+            if outcome in (THROTTLED, OVERLOADED):
+                self.limit = max(self.minimum, self.limit * self.decrease)
+            elif latency is not None:
+                if self.baseline is None or latency < self.baseline:
+                    self.baseline = latency
+                else:
+                    # Let the baseline drift up slowly so one lucky call doesn't pin it
+                    self.baseline += (latency - self.baseline) * 0.01
+                if latency > self.baseline * self.latency_tolerance + self.latency_slack:
+                    self.limit = max(self.minimum, self.limit * 0.9)
+                else:
+                    self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self._changed.notify_all()
+
+
+class _Slot:
+    def __init__(self):
+        self.outcome = OK
+        self.retry_after = None
+
+    def status(self, status_code, retry_after=None):
+        """
+        Report a response that didn't raise (e.g. an HTTP 429).
+        """
+        self.outcome = classify_status(status_code)
+        self.retry_after = parse_retry_after(retry_after) if retry_after else None
+
+
+class ProviderLimiter:
+    """
+    Token bucket plus adaptive concurrency for one provider (or one model
+    of a provider). Throttled calls pause the bucket for Retry-After (or
+    an exponential backoff) and are retried.
+    """
+
+    def __init__(self, name, rate=None, burst=1, concurrency=4, min_concurrency=1, max_concurrency=16,
+                 max_retries=4, backoff_factor=1.0, max_backoff=60):
+        self.name = name
+        self.bucket = TokenBucket(rate, burst)
+        self.concurrency = AdaptiveConcurrency(concurrency, min_concurrency, max_concurrency)
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+
+    @contextmanager
+    def slot(self):
+        """
+        Hold a request slot for one provider call. Exceptions are classified
+        by their status; responses that don't raise are reported with
+        `slot.status(...)`.
+        """
+        self.bucket.acquire()
+        self.concurrency.acquire()
+        slot = _Slot()
+        started = time.perf_counter()
+        try:
+            yield slot
+        except Exception as e:
+            slot.outcome = classify_error(e)
+            slot.retry_after = error_retry_after(e)
+            raise
+        finally:
+            latency = time.perf_counter() - started if slot.outcome == OK else None
+            self.concurrency.release(slot.outcome, latency)
+            if slot.outcome == THROTTLED:
+                self.throttled(slot.retry_after)
+            tracer.record_limit(self.name, self.concurrency.limit, slot.outcome)
+
+    def throttled(self, retry_after=None, attempt=0):
+        delay = retry_after if retry_after is not None else self.backoff(attempt)
+        self.bucket.pause(min(delay, self.max_backoff))
+        return delay
+
+    def backoff(self, attempt):
+        # Jittered so callers throttled together don't retry together
+        return min(self.backoff_factor * (2 ** attempt), self.max_backoff) * random.uniform(0.5, 1.0)
+
+    def call(self, func, *args, **kwargs):
+        """
+        Run `func` in a slot, retrying it while the provider throttles.
+        """
+        for attempt in range(self.max_retries + 1):
+            try:
+                with self.slot():
+                    return func(*args, **kwargs)
+            except Exception as e:
+                if classify_error(e) != THROTTLED or attempt == self.max_retries:
+                    raise
+                tracer.record(retries=1)
+                # The slot already paused the bucket; wait out our own share too
+                time.sleep(min(error_retry_after(e) or self.backoff(attempt), self.max_backoff))
+
+
+class RateLimiter:
+    """
+    Per-provider (and per-model) limiters shared by the service modules,
+    configured by RATE_LIMITS: {"provider" or "provider:model": {rate,
+    burst, concurrency, max_concurrency, ...}}. Unconfigured keys get an
+    unthrottled bucket with adaptive concurrency. Per process.
+    """
+
+    def __init__(self):
+        self.settings = {}
+        self.max_retries = 4
+        self._limiters = {}
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.settings = dict(app.config.get('RATE_LIMITS') or {})
+        self.max_retries = app.config.get('RATE_LIMIT_RETRIES', 4)
+        with self._lock:
+            self._limiters = {}
+        app.extensions['rate_limiter'] = self
+
+    def limiter(self, provider, model=None):
+        key = f"{provider}:{model}" if model else provider
+        with self._lock:
+            limiter = self._limiters.get(key)
+            if limiter is None:
+                settings = self.settings.get(key) or self.settings.get(provider) or {}
+                limiter = ProviderLimiter(key, **{'max_retries': self.max_retries, **settings})
+                self._limiters[key] = limiter
+            return limiter
+
+
+rate_limiter = RateLimiter()
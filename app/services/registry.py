@@ -0,0 +1,92 @@
+import os
+import threading
+from flask import current_app
+
+
+class ServiceRegistry:
+    """
+    Provider clients (Gemini, ElevenLabs, Anam HTTP) built on first use.
+
+    create_app only registers factories, so importing the app never loads
+    the provider SDKs. Clients are built from app.config in the process
+    that uses them: a registry inherited across a fork (gunicorn --preload)
+    drops its instances and rebuilds them in the worker.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._factories = {}
+        self._instances = {}
+        self._overrides = {}
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+
+    def register(self, name, factory):
+        """
+        `factory(app)` returns the client, or None if it isn't configured.
+        """
+        self._factories[name] = factory
+
+    def override(self, name, instance):
+        """
+        Use `instance` instead of the factory (e.g. a fake provider).
+        """
+        with self._lock:
+            self._overrides[name] = instance
+
+    def get(self, name):
+        with self._lock:
+            if name in self._overrides:
+                return self._overrides[name]
+            if self._pid != os.getpid():
+                # Forked: never share the parent's sockets or SDK state
+                self._instances = {}
+                self._pid = os.getpid()
+            if name not in self._instances:
+                self._instances[name] = self._factories[name](self.app)
+            return self._instances[name]
+
+    def loaded(self):
+        with self._lock:
+            return sorted(set(self._instances) | set(self._overrides))
+
+
+def get_service(name):
+    return current_app.extensions['services'].get(name)
+
+
+def _genai_client(app):
+    api_key = app.config.get('GOOGLE_API_KEY')
+    if not api_key:
+        return None
+    from google import genai
+    return genai.Client(api_key=api_key)
+
+
+def _elevenlabs_client(app):
+    from elevenlabs.client import ElevenLabs
+    return ElevenLabs(api_key=app.config.get('ELEVENLABS_API_KEY'))
+
+
+def _anam_http(app):
+    from app.services.http_client import HTTPClient
+    from app.services.rate_limits import rate_limiter
+    config = app.config
+    return HTTPClient(
+        config.get('ANAM_API_URL') or 'https://api.anam.ai/v1',
+        headers={"Authorization": f"Bearer {config.get('ANAM_API_KEY')}"},
+        pool_size=config.get('ANAM_POOL_SIZE', 10),
+        connect_timeout=config.get('ANAM_CONNECT_TIMEOUT', 5),
+        read_timeout=config.get('ANAM_READ_TIMEOUT', 60),
+        max_retries=config.get('ANAM_MAX_RETRIES', 3),
+        limiter=rate_limiter.limiter('anam')
+    )
+
+
+def init_services(app):
+    registry = ServiceRegistry(app)
+    registry.register('genai', _genai_client)
+    registry.register('elevenlabs', _elevenlabs_client)
+    registry.register('anam_http', _anam_http)
+    app.extensions['services'] = registry
+    return registry
@@ -0,0 +1,183 @@
+import os
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from PIL import Image, features
+from app.services.media import media_store, media_url
+from app.services.storage import storage_manager
+
+RENDITION_DIR = 'renditions'
+MIME_TYPES = {'webp': 'image/webp', 'avif': 'image/avif'}
+# Perceptually similar quality settings (AVIF's scale is much steeper)
+QUALITY = {'webp': 80, 'avif': 55}
+
+
+def rendition_name(filename, label, fmt):
+    stem = os.path.splitext(os.path.basename(filename))[0]
+    return f"{stem}_{label}.{fmt}"
+
+
+def render_renditions(source_path, output_dir, widths, thumb_width, formats):
+    """
+    Write resized copies of source_path for every width (never upscaled)
+    plus a thumbnail, in every format. Runs in a worker process.
+    Returns the written file names.
+    """
+    written = []
+    with Image.open(source_path) as image:
+        image.load()
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGB')
+
+        sizes = [(str(width), width) for width in sorted(widths, reverse=True)] + [('thumb', thumb_width)]
+        current = image
+        for label, width in sizes:
+            width = min(width, image.width)
+            height = max(1, round(image.height * width / image.width))
+            # Downscale from the previous (larger) rendition: cheaper than from the 2K original
+            if current.width != width:
+                current = current.resize((width, height), Image.LANCZOS)
+            for fmt in formats:
+                name = rendition_name(source_path, label, fmt)
+                path = os.path.join(output_dir, name)
+                tmp_path = f"{path}.{os.getpid()}.tmp"
+                current.save(tmp_path, format=fmt.upper(), quality=QUALITY.get(fmt, 80))
+                # Atomic, so pages never reference a half-written file
+                os.replace(tmp_path, path)
+                written.append(name)
+    return written
+
+
+class RenditionService:
+    """
+    Derived WebP/AVIF renditions of generated manga pages at several widths
+    plus a thumbnail. Encoding runs in a process pool off the request and
+    job threads; missing renditions are regenerated lazily when a template
+    asks for them.
+    """
+
+    def __init__(self):
+        self.widths = (480, 960, 1440)
+        self.thumb_width = 320
+        self.formats = ('webp',)
+        self.max_workers = 2
+        self._executor = None
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.widths = tuple(app.config.get('RENDITION_WIDTHS', self.widths))
+        self.thumb_width = app.config.get('RENDITION_THUMB_WIDTH', self.thumb_width)
+        self.formats = tuple(
+            fmt for fmt in app.config.get('RENDITION_FORMATS', self.formats) if features.check(fmt)
+        )
+        self.max_workers = app.config.get('RENDITION_WORKERS', self.max_workers)
+        os.makedirs(self.output_dir, exist_ok=True)
+        app.add_template_global(self.srcset, 'page_srcset')
+        app.add_template_global(self.thumbnail, 'page_thumbnail')
+        app.extensions['renditions'] = self
+
+    @property
+    def output_dir(self):
+        # Inside the media folder so renditions get the media route's caching
+        return media_store.path(RENDITION_DIR)
+
+    def _get_executor(self):
+        # Created on first use so the pool is never inherited across a fork. Workers
+        # start from a clean server process (or spawn), never by forking this one,
+        # whose job threads may hold locks or open SQLite connections.
+        with self._lock:
+            if self._executor is None:
+                method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers, mp_context=multiprocessing.get_context(method)
+                )
+            return self._executor
+
+    def schedule(self, source_path):
+        """
+        Queue rendition encoding for a page (no-op if already queued).
+        Returns None if the pool can't take it; renditions are retried when
+        the page is next rendered.
+        """
+        if not self.formats:
+            return None
+        filename = os.path.basename(source_path)
+        executor = self._get_executor()
+        with self._lock:
+            future = self._pending.get(filename)
+            if future is not None:
+                return future
+            try:
+                future = executor.submit(
+                    render_renditions, source_path, self.output_dir, self.widths, self.thumb_width, self.formats
+                )
+            except BrokenProcessPool:
+                # A worker died (or couldn't start); the next call starts a fresh pool
+                if self._executor is executor:
+                    self._executor = None
+                return None
+            self._pending[filename] = future
+        future.add_done_callback(lambda done: self._forget(filename, done))
+        return future
+
+    def _forget(self, filename, future):
+        with self._lock:
+            self._pending.pop(filename, None)
+        if not future.cancelled() and future.exception() is None:
+            # Indexed as evictable: they're regenerated lazily if the budget drops them
+            for name in future.result():
+                storage_manager.register(f"{RENDITION_DIR}/{name}")
+
+    def _available(self, filename, label, fmt):
+        return os.path.exists(os.path.join(self.output_dir, rendition_name(filename, label, fmt)))
+
+    def _ensure(self, filename):
+        """
+        True if every rendition of the page exists; otherwise schedules
+        them (lazily) and returns False so callers fall back to the original.
+        """
+        labels = [str(width) for width in self.widths] + ['thumb']
+        if all(self._available(filename, label, fmt) for label in labels for fmt in self.formats):
+            return True
+        source_path = media_store.resolve(filename)
+        if os.path.exists(source_path):
+            self.schedule(source_path)
+        return False
+
+    def ready(self, filename):
+        """
+        True once `thumbnail` and `srcset` serve renditions rather than the
+        original (schedules them if missing).
+        """
+        return not self.formats or self._ensure(filename)
+
+    def srcset(self, filename):
+        """
+        {mime_type: srcset} for a page, e.g. for <picture><source> tags.
+        Empty until the renditions exist.
+        """
+        if not self.formats or not self._ensure(filename):
+            return {}
+        return {
+            MIME_TYPES[fmt]: ", ".join(
+                f"{media_url(f'{RENDITION_DIR}/' + rendition_name(filename, str(width), fmt))} {width}w"
+                for width in self.widths
+            )
+            for fmt in self.formats
+        }
+
+    def thumbnail(self, filename):
+        """
+        URL of the page thumbnail, falling back to the original page while
+        the thumbnail is being generated.
+        """
+        if self.formats and self._ensure(filename):
+            # WebP has the widest <img> support; AVIF is only offered through srcset
+            fmt = 'webp' if 'webp' in self.formats else self.formats[0]
+            return media_url(f"{RENDITION_DIR}/{rendition_name(filename, 'thumb', fmt)}")
+        return media_url(filename)
+
+
+rendition_service = RenditionService()
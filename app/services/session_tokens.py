@@ -0,0 +1,114 @@
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from app.services.tracing import tracer
+
+
+class SessionTokenManager:
+    """
+    Pool of pre-minted Anam session tokens per avatar.
+
+    Tokens are treated as single use: `acquire` hands out a pooled token
+    that is still inside its validity window (minting one inline only when
+    the pool is empty) and then refills the pool in the background. Only
+    "hot" avatars — recently created or viewed — are kept warm.
+    """
+
+    def __init__(self, app, mint, pool_size=2, ttl=3600, margin=60, hot_avatars=10, workers=2):
+        self.app = app
+        self.mint = mint  # mint(avatar_id) -> (token, expires_at or None)
+        self.pool_size = pool_size
+        self.ttl = ttl
+        self.margin = margin
+        self.hot_avatars = hot_avatars
+        self._pools = {}  # avatar_id -> deque[(token, expires_at)]
+        self._hot = OrderedDict()  # avatar_id -> last use, most recent last
+        self._refilling = set()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='anam-token')
+
+    def _mint(self, avatar_id):
+        token, expires_at = self.mint(avatar_id)
+        return token, expires_at or time.time() + self.ttl
+
+    def acquire(self, avatar_id):
+        """
+        Return a valid session token for the avatar.
+        """
+        now = time.time()
+        token = None
+        with self._lock:
+            self._mark_hot(avatar_id)
+            pool = self._pools.get(avatar_id)
+            while pool:
+                candidate, expires_at = pool.popleft()
+                if expires_at - self.margin > now:
+                    token = candidate
+                    break
+        self.warm(avatar_id)
+        tracer.cache('session_token', token is not None)
+        if token is None:
+            token, _ = self._mint(avatar_id)
+        return token
+
+    def warm(self, avatar_id):
+        """
+        Mark the avatar hot and top up its pool in the background.
+        """
+        with self._lock:
+            self._mark_hot(avatar_id)
+            if avatar_id in self._refilling:
+                return
+            self._refilling.add(avatar_id)
+        self._executor.submit(self._refill, avatar_id)
+
+    def _mark_hot(self, avatar_id):
+        # Caller holds self._lock
+        self._hot[avatar_id] = time.time()
+        self._hot.move_to_end(avatar_id)
+        while len(self._hot) > self.hot_avatars:
+            cold, _ = self._hot.popitem(last=False)
+            self._pools.pop(cold, None)
+
+    def _refill(self, avatar_id):
+        try:
+            with self.app.app_context():
+                while True:
+                    with self._lock:
+                        if avatar_id not in self._hot:
+                            return
+                        pool = self._pools.setdefault(avatar_id, deque())
+                        now = time.time()
+                        while pool and pool[0][1] - self.margin <= now:
+                            pool.popleft()
+                        if len(pool) >= self.pool_size:
+                            return
+                    try:
+                        minted = self._mint(avatar_id)
+                    except Exception as e:
+                        self.app.logger.warning(f"Could not pre-mint session token for {avatar_id}: {e}")
+                        return
+                    with self._lock:
+                        self._pools.setdefault(avatar_id, deque()).append(minted)
+        finally:
+            with self._lock:
+                self._refilling.discard(avatar_id)
+
+    def forget(self, avatar_id):
+        with self._lock:
+            self._hot.pop(avatar_id, None)
+            self._pools.pop(avatar_id, None)
+
+
+def parse_expiry(value):
+    """
+    Turn an ISO-8601 timestamp (as returned by the API) into epoch seconds.
+    """
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp()
+    except (TypeError, ValueError):
+        return None
@@ -0,0 +1,33 @@
+import os
+import sqlite3
+import threading
+
+
+class ThreadLocalConnection:
+    """
+    One SQLite connection per thread (and per process, so nothing opened
+    before a fork is reused after it), in WAL mode so readers never block
+    the writer across worker processes.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self._local = threading.local()
+
+    def open(self, path, schema=None):
+        self.path = path
+        self._local = threading.local()
+        if schema:
+            with self.get() as conn:
+                conn.executescript(schema)
+
+    def get(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
@@ -0,0 +1,353 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from app.services.media import media_store, is_hashed_name
+from app.services.tracing import tracer
+
+SCRATCH_DIR = 'scratch'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS derived (
+    path TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    project_id INTEGER,
+    accessed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_derived_accessed_at ON derived (accessed_at);
+"""
+
+
+def _disk_usage(path):
+    """
+    Bytes under `path` (a file or a directory tree), or None if it's gone.
+    """
+    try:
+        if not os.path.isdir(path):
+            return os.path.getsize(path)
+        total = 0
+        for root, _, files in os.walk(path):
+            for name in files:
+                try:
+                    total += os.path.getsize(os.path.join(root, name))
+                except OSError:
+                    pass
+        return total
+    except OSError:
+        return None
+
+
+def _remove(path):
+    if os.path.isdir(path):
+        shutil.rmtree(path, ignore_errors=True)
+    else:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+class StorageManager:
+    """
+    Keeps the media folder within STORAGE_BUDGET_BYTES.
+
+    Blobs are tracked in the media store's index (size, owning project,
+    last access); derived files (page renditions, comic page caches: each
+    top-level entry of a media subfolder) in a `derived` table next to it.
+    A background sweeper (per process, every STORAGE_SWEEP_INTERVAL
+    seconds) works through the folders a batch at a time: it indexes files
+    it hasn't seen, deletes stale temp/scratch files and orphaned blobs
+    (never claimed by a project), and while usage is over budget evicts
+    the least recently used derived entries no project depends on, which
+    are regenerated on demand. Blobs owned by projects are never evicted.
+    """
+
+    def __init__(self):
+        self.budget = 0
+        self.low_water = 0.9
+        self.interval = 0
+        self.batch = 500
+        self.grace = 6 * 3600
+        self.scratch_folder = None
+        self.last_sweep = None
+        self._app = None
+        self._walk = None
+        self._touched = {}
+        self._sweeper_pid = None
+        self._lock = threading.Lock()
+        self._sweep_lock = threading.Lock()
+
+    def init_app(self, app):
+        self.budget = app.config.get('STORAGE_BUDGET_BYTES', self.budget)
+        self.low_water = app.config.get('STORAGE_LOW_WATER', self.low_water)
+        self.interval = app.config.get('STORAGE_SWEEP_INTERVAL', self.interval)
+        self.batch = app.config.get('STORAGE_SWEEP_BATCH', self.batch)
+        self.grace = app.config.get('STORAGE_ORPHAN_GRACE', self.grace)
+        upload_folder = str(app.config['UPLOAD_FOLDER'])
+        self.scratch_folder = os.path.join(upload_folder, SCRATCH_DIR)
+        os.makedirs(self.scratch_folder, exist_ok=True)
+        with media_store.db.get() as conn:
+            conn.executescript(SCHEMA)
+        self._app = app
+        self._walk = None
+        self._touched = {}
+        self.last_sweep = None
+        app.extensions['storage'] = self
+
+    @staticmethod
+    def _unit(name):
+        """
+        The indexed entry a media name belongs to: the blob itself, the
+        top-level entry of its media subfolder, or None for legacy uploads.
+        """
+        if is_hashed_name(name):
+            return name
+        parts = name.replace(os.sep, '/').split('/')
+        if len(parts) < 2:
+            return None
+        return '/'.join(parts[:2])
+
+    def claim(self, project):
+        """
+        Record `project` as the owner of the media it depends on, so none
+        of it is collected or evicted.
+        """
+        names = project.media_names
+        media_store.claim(names, project.id)
+        for unit in {self._unit(name) for name in names if not is_hashed_name(name)} - {None}:
+            self.register(unit, project_id=project.id)
+
+    def register(self, name, project_id=None, accessed_at=None):
+        """
+        Index (or re-measure) the derived entry holding media name `name`.
+        """
+        unit = self._unit(name)
+        if unit is None or is_hashed_name(unit):
+            return
+        size = _disk_usage(media_store.path(unit))
+        if size is None:
+            return
+        with media_store.db.get() as conn:
+            conn.execute(
+                "INSERT INTO derived (path, kind, size, project_id, accessed_at) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(path) DO UPDATE SET size = excluded.size, "
+                "project_id = COALESCE(derived.project_id, excluded.project_id), accessed_at = excluded.accessed_at",
+                (unit, unit.split('/', 1)[0], size, project_id, accessed_at or time.time())
+            )
+        self._start_sweeper()
+
+    def touch(self, name):
+        """
+        Record an access (buffered; written by the next sweep).
+        """
+        unit = self._unit(name)
+        if unit is None:
+            return
+        with self._lock:
+            self._touched[unit] = time.time()
+            flush = len(self._touched) >= self.batch
+        if flush:
+            self._flush_touches()
+        self._start_sweeper()
+
+    def _flush_touches(self):
+        with self._lock:
+            touched, self._touched = self._touched, {}
+        if not touched:
+            return
+        media_store.touch({unit: at for unit, at in touched.items() if is_hashed_name(unit)})
+        with media_store.db.get() as conn:
+            conn.executemany(
+                "UPDATE derived SET accessed_at = ? WHERE path = ?",
+                [(at, unit) for unit, at in touched.items() if not is_hashed_name(unit)]
+            )
+
+    @contextmanager
+    def scratch_dir(self):
+        """
+        A private working directory for a job's intermediate files, removed
+        afterwards (or by the sweeper, if the process dies first).
+        """
+        self._start_sweeper()
+        with tempfile.TemporaryDirectory(dir=self.scratch_folder, prefix='job-', ignore_cleanup_errors=True) as path:
+            yield path
+
+    def _start_sweeper(self):
+        # Started on first use in each process, so it's never lost across a fork
+        if not self.interval or self._sweeper_pid == os.getpid():
+            return
+        with self._lock:
+            if self._sweeper_pid == os.getpid():
+                return
+            self._sweeper_pid = os.getpid()
+        app = self._app
+
+        def run():
+            while True:
+                time.sleep(self.interval)
+                with app.app_context():
+                    try:
+                        self.sweep()
+                    except Exception as e:
+                        app.logger.error(f"Storage sweep failed: {e}")
+
+        threading.Thread(target=run, name='storage-sweeper', daemon=True).start()
+
+    def _entries(self):
+        """
+        (kind, DirEntry) for everything the sweeper checks: media files,
+        the top-level entries of each media subfolder, and scratch files.
+        """
+        with os.scandir(media_store.folder) as entries:
+            for entry in entries:
+                if not entry.is_dir():
+                    yield None, entry
+                    continue
+                with os.scandir(entry.path) as children:
+                    for child in children:
+                        yield entry.name, child
+        if os.path.isdir(self.scratch_folder):
+            with os.scandir(self.scratch_folder) as entries:
+                for entry in entries:
+                    yield SCRATCH_DIR, entry
+
+    def _check(self, kind, entry, cutoff):
+        """
+        Remove one entry if it is stale garbage, returning the reason, or
+        index it if it's a derived entry the index hasn't seen.
+        """
+        try:
+            modified = entry.stat().st_mtime
+        except OSError:
+            return None
+        stale = modified < cutoff
+        if kind == SCRATCH_DIR or entry.name.endswith(('.tmp', '.upload')):
+            if stale:
+                _remove(entry.path)
+                return 'temp'
+            return None
+        if kind is None:
+            # A blob file the index lost (e.g. a crash between the move and the insert)
+            if stale and is_hashed_name(entry.name) and not media_store.refcount(entry.name):
+                _remove(entry.path)
+                return 'orphan'
+            return None
+        unit = f"{kind}/{entry.name}"
+        known = media_store.db.get().execute("SELECT 1 FROM derived WHERE path = ?", (unit,)).fetchone()
+        if known is None:
+            self.register(unit, accessed_at=modified)
+        return None
+
+    def sweep(self):
+        """
+        One incremental pass: flush access times, check the next batch of
+        entries, collect orphaned blobs and enforce the budget. Returns
+        what it removed.
+        """
+        with self._sweep_lock:
+            started = time.time()
+            cutoff = started - self.grace
+            self._flush_touches()
+            removed = {'temp': 0, 'orphan': 0, 'evicted': 0}
+
+            if self._walk is None:
+                self._walk = self._entries()
+            for _ in range(self.batch):
+                try:
+                    kind, entry = next(self._walk)
+                except StopIteration:
+                    # Full pass done; the next sweep starts over
+                    self._walk = None
+                    break
+                except OSError:
+                    self._walk = None  # A folder went away mid-pass
+                    break
+                reason = self._check(kind, entry, cutoff)
+                if reason:
+                    removed[reason] += 1
+
+            orphans, _ = media_store.collect_orphans(cutoff, self.batch)
+            removed['orphan'] += orphans
+            removed['evicted'] = self._enforce_budget()
+
+            usage = self.usage()
+            tracer.record_storage(usage['bytes_by_kind'], removed)
+            self.last_sweep = {
+                'at': started,
+                'duration': round(time.time() - started, 3),
+                'removed': removed,
+                'used_bytes': usage['used_bytes']
+            }
+            return self.last_sweep
+
+    def _used(self, conn):
+        row = conn.execute(
+            "SELECT (SELECT COALESCE(SUM(size), 0) FROM blobs) + (SELECT COALESCE(SUM(size), 0) FROM derived)"
+        ).fetchone()
+        return row[0]
+
+    def _enforce_budget(self):
+        """
+        Evict unowned derived entries, least recently used first, until
+        usage is back under the low-water mark.
+        """
+        if not self.budget:
+            return 0
+        conn = media_store.db.get()
+        used = self._used(conn)
+        if used <= self.budget:
+            return 0
+        target = self.budget * self.low_water
+        rows = conn.execute(
+            "SELECT path, size FROM derived WHERE project_id IS NULL ORDER BY accessed_at LIMIT ?", (self.batch,)
+        ).fetchall()
+        evicted = 0
+        for row in rows:
+            if used <= target:
+                break
+            _remove(media_store.path(row['path']))
+            with conn:
+                conn.execute("DELETE FROM derived WHERE path = ?", (row['path'],))
+            used -= row['size']
+            evicted += 1
+        if used > self.budget and len(rows) < self.batch:
+            self._app.logger.warning(
+                f"Media storage over budget ({used} of {self.budget} bytes): the rest belongs to projects"
+            )
+        return evicted
+
+    def usage(self):
+        """
+        Bytes and file counts by kind, the largest projects and the last
+        sweep's results.
+        """
+        conn = media_store.db.get()
+        blobs = conn.execute(
+            "SELECT COUNT(*) AS count, COALESCE(SUM(size), 0) AS size, "
+            "COALESCE(SUM(project_id IS NULL), 0) AS unowned FROM blobs"
+        ).fetchone()
+        derived = {
+            row['kind']: {'count': row['count'], 'bytes': row['size']}
+            for row in conn.execute("SELECT kind, COUNT(*) AS count, SUM(size) AS size FROM derived GROUP BY kind")
+        }
+        projects = conn.execute(
+            "SELECT project_id, SUM(size) AS size FROM ("
+            "SELECT project_id, size FROM blobs UNION ALL SELECT project_id, size FROM derived"
+            ") WHERE project_id IS NOT NULL GROUP BY project_id ORDER BY size DESC LIMIT 10"
+        ).fetchall()
+        bytes_by_kind = {'blobs': blobs['size'], **{kind: entry['bytes'] for kind, entry in derived.items()}}
+        return {
+            'budget_bytes': self.budget,
+            'used_bytes': sum(bytes_by_kind.values()),
+            'bytes_by_kind': bytes_by_kind,
+            'blobs': {'count': blobs['count'], 'bytes': blobs['size'], 'unowned': blobs['unowned']},
+            'derived': derived,
+            'top_projects': [{'project_id': row['project_id'], 'bytes': row['size']} for row in projects],
+            'last_sweep': self.last_sweep
+        }
+
+
+storage_manager = StorageManager()
@@ -0,0 +1,321 @@
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+# Seconds; provider calls range from sub-second token mints to minute-long page renders
+DURATION_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+
+_current_trace = contextvars.ContextVar('trace', default=None)
+_current_span = contextvars.ContextVar('span', default=None)
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+class Counter:
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for label_values, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labels, label_values)} {value}")
+        return lines
+
+
+class Gauge:
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def set(self, value, *label_values):
+        with self._lock:
+            self._values[label_values] = value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        with self._lock:
+            for label_values, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labels, label_values)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, labels=(), buckets=DURATION_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}  # label values -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            entry = self._values.setdefault(label_values, [0] * len(self.buckets) + [0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[i] += 1
+            entry[-2] += value
+            entry[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for label_values, entry in sorted(self._values.items()):
+                for bound, count in zip(self.buckets, entry):
+                    labels = _format_labels(self.labels, label_values, [('le', bound)])
+                    lines.append(f"{self.name}_bucket{labels} {count}")
+                labels = _format_labels(self.labels, label_values, [('le', '+Inf')])
+                lines.append(f"{self.name}_bucket{labels} {entry[-1]}")
+                labels = _format_labels(self.labels, label_values)
+                lines.append(f"{self.name}_sum{labels} {entry[-2]}")
+                lines.append(f"{self.name}_count{labels} {entry[-1]}")
+        return lines
+
+
+class Span:
+    """
+    One timed operation (a provider call, a pipeline stage). Attributes
+    are free-form; bytes, retries and cache lookups also feed the metrics.
+    """
+
+    def __init__(self, name, parent=None, **attributes):
+        self.id = uuid.uuid4().hex[:16]
+        self.name = name
+        self.parent_id = parent.id if parent else None
+        self.attributes = attributes
+        self.thread = threading.current_thread().name
+        self.started_at = time.time()
+        self._started = time.perf_counter()
+        self.duration = None
+        self.status = 'ok'
+        self.error = None
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.retries = 0
+        self.cache = {}  # cache name -> 'hit' / 'miss'
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'parent_id': self.parent_id,
+            'name': self.name,
+            'thread': self.thread,
+            'started_at': self.started_at,
+            'duration': self.duration,
+            'status': self.status,
+            'error': self.error,
+            'bytes_sent': self.bytes_sent,
+            'bytes_received': self.bytes_received,
+            'retries': self.retries,
+            'cache': dict(self.cache),
+            'attributes': dict(self.attributes)
+        }
+
+
+class Trace:
+    """
+    The spans of one background job, in completion order.
+    """
+
+    def __init__(self, trace_id):
+        self.id = trace_id
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def add(self, span):
+        with self._lock:
+            self.spans.append(span)
+
+    def to_dict(self):
+        with self._lock:
+            spans = [span.to_dict() for span in self.spans]
+        return {'id': self.id, 'spans': sorted(spans, key=lambda span: span['started_at'])}
+
+
+class Tracer:
+    """
+    Spans around the generation pipeline's provider calls, aggregated into
+    Prometheus histograms/counters (served on /metrics) and, per job, into
+    a trace that can be dumped as JSON (TRACE_DUMP_DIR) for profiling.
+
+    The current trace and span live in context variables; work handed to a
+    thread pool keeps them when submitted through `propagate`. Metrics are
+    per process.
+    """
+
+    def __init__(self):
+        self.dump_dir = None
+        self.span_duration = Histogram(
+            'comics_span_duration_seconds', "Duration of traced pipeline operations.", ('span', 'status')
+        )
+        self.bytes_sent = Counter('comics_span_bytes_sent_total', "Bytes sent to providers.", ('span',))
+        self.bytes_received = Counter('comics_span_bytes_received_total', "Bytes received from providers.", ('span',))
+        self.retries = Counter('comics_span_retries_total', "Provider request retries.", ('span',))
+        self.cache_lookups = Counter('comics_cache_lookups_total', "Cache lookups by result.", ('cache', 'result'))
+        self.provider_requests = Counter(
+            'comics_provider_requests_total', "Rate-limited provider calls by outcome.", ('limiter', 'outcome')
+        )
+        self.concurrency_limit = Gauge(
+            'comics_provider_concurrency_limit', "Adaptive concurrency limit per provider.", ('limiter',)
+        )
+        self.storage_bytes = Gauge('comics_storage_bytes', "Indexed media bytes on disk by kind.", ('kind',))
+        self.storage_evictions = Counter(
+            'comics_storage_evictions_total', "Media files removed by the storage sweeper.", ('reason',)
+        )
+        self.cache_stats = Gauge(
+            'comics_cache_stats', "Cache counters and sizes by cache (since the app started).", ('cache', 'stat')
+        )
+        self.metrics = [
+            self.span_duration, self.bytes_sent, self.bytes_received, self.retries, self.cache_lookups,
+            self.provider_requests, self.concurrency_limit, self.storage_bytes, self.storage_evictions,
+            self.cache_stats
+        ]
+
+    def init_app(self, app):
+        self.dump_dir = app.config.get('TRACE_DUMP_DIR')
+        if self.dump_dir:
+            os.makedirs(self.dump_dir, exist_ok=True)
+        app.extensions['tracer'] = self
+
+    @contextmanager
+    def span(self, name, **attributes):
+        span = Span(name, parent=_current_span.get(), **attributes)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.status = 'error'
+            span.error = str(e)
+            raise
+        finally:
+            _current_span.reset(token)
+            self._finish(span)
+
+    def _finish(self, span):
+        span.duration = time.perf_counter() - span._started
+        self.span_duration.observe(span.duration, span.name, span.status)
+        if span.bytes_sent:
+            self.bytes_sent.inc(span.name, amount=span.bytes_sent)
+        if span.bytes_received:
+            self.bytes_received.inc(span.name, amount=span.bytes_received)
+        if span.retries:
+            self.retries.inc(span.name, amount=span.retries)
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.add(span)
+
+    def traced(self, name, **attributes):
+        """
+        Decorator: run the function inside a span.
+        """
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.span(name, **attributes):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    @contextmanager
+    def trace(self, trace_id, name, **attributes):
+        """
+        Collect every span opened inside (including in propagated worker
+        threads) under a root span `name`. Yields the Trace.
+        """
+        trace = Trace(trace_id)
+        token = _current_trace.set(trace)
+        try:
+            with self.span(name, **attributes):
+                yield trace
+        finally:
+            _current_trace.reset(token)
+            if self.dump_dir:
+                self._dump(trace)
+
+    def _dump(self, trace):
+        path = os.path.join(self.dump_dir, f"{trace.id}.json")
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(trace.to_dict(), f, indent=1)
+        os.replace(tmp_path, path)
+
+    def record(self, bytes_sent=0, bytes_received=0, retries=0):
+        """
+        Add to the current span's counters (no-op outside a span).
+        """
+        span = _current_span.get()
+        if span is not None:
+            span.bytes_sent += bytes_sent
+            span.bytes_received += bytes_received
+            span.retries += retries
+
+    def cache(self, name, hit):
+        result = 'hit' if hit else 'miss'
+        self.cache_lookups.inc(name, result)
+        span = _current_span.get()
+        if span is not None:
+            span.cache[name] = result
+
+    def record_limit(self, limiter, limit, outcome):
+        self.provider_requests.inc(limiter, outcome)
+        self.concurrency_limit.set(round(limit, 2), limiter)
+        span = _current_span.get()
+        if span is not None and outcome == 'throttled':
+            span.attributes['throttled'] = span.attributes.get('throttled', 0) + 1
+
+    def record_storage(self, bytes_by_kind, evictions=None):
+        for kind, size in bytes_by_kind.items():
+            self.storage_bytes.set(size, kind)
+        for reason, count in (evictions or {}).items():
+            if count:
+                self.storage_evictions.inc(reason, amount=count)
+
+    def record_cache_stats(self, cache, stats):
+        for stat, value in stats.items():
+            self.cache_stats.set(value, cache, stat)
+
+    def propagate(self, func):
+        """
+        Bind `func` to the caller's trace context, for executor.submit.
+        """
+        context = contextvars.copy_context()
+
+        def run(*args, **kwargs):
+            # A Context can only be entered by one thread at a time
+            return context.copy().run(func, *args, **kwargs)
+        return run
+
+    def render_metrics(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+tracer = Tracer()
@@ -1,103 +1,245 @@
-import os
-import uuid
-from elevenlabs.client import ElevenLabs
-from dotenv import load_dotenv
-
-load_dotenv()
-
-client = ElevenLabs(
-    api_key=os.getenv("ELEVENLABS_API_KEY"),
-)
-
-# A simple mapping of descriptions to pre-made ElevenLabs Voice IDs.
-VOICE_MAPPING = {
-    "male_deep": "ErXwobaYiN019PkySvjV", # Antoni
-    "male_narrator": "TxGEqnHWrfWFTfGW9XjX", # Josh
-    "female_soft": "EXAVITQu4vr4xnSDxMaL", # Bella
-    "female_energetic": "21m00Tcm4TlvDq8ikWAM", # Rachel
-    "default": "21m00Tcm4TlvDq8ikWAM", # Rachel
-}
-
-def create_custom_voice(voice_description: str, voice_name: str = None) -> str:
-    """
-    Uses ElevenLabs 'Voice Design' to generate a voice from text.
-    """
-    if not voice_name:
-        voice_name = f"Custom Voice {uuid.uuid4().hex[:8]}"
-
-    print(f"Creating custom voice: '{voice_name}' based on: '{voice_description}'")
-    
-    try:
-        # 1. Generate the Voice Preview
-        response = client.text_to_voice.create_previews(
-            voice_description=voice_description,
-            text="This is how I sound. Do I fit the character?" 
-        )
-        
-        # 2. Pick the best one (picking the first for automation)
-        generated_voice_id = response.previews[0].generated_voice_id
-        
-        # 3. Save it to Library
-        new_voice = client.text_to_voice.create_voice_from_preview(
-            voice_name=voice_name,
-            voice_description=voice_description,
-            generated_voice_id=generated_voice_id
-        )
-        
-        return new_voice.voice_id
-    except Exception as e:
-        print(f"Error creating custom voice: {e}")
-        return VOICE_MAPPING["default"]
-
-def get_voice_id_from_profile(profile: str) -> str:
-    """
-    Selects a voice ID based on the profile string. 
-    If it looks like a description, it tries to generate a custom voice.
-    For simplicity in this hack, we'll assume if it's not in mapping, it's a description.
-    """
-    profile_lower = profile.lower()
-    
-    # Check if it matches existing keys short codes
-    if profile_lower in VOICE_MAPPING:
-        return VOICE_MAPPING[profile_lower]
-        
-    # Fallback logic for old keywords if exact match failed
-    if "man" in profile_lower or "male" in profile_lower:
-        if "deep" in profile_lower or "gruff" in profile_lower:
-            return VOICE_MAPPING["male_deep"]
-        return VOICE_MAPPING["male_narrator"]
-    
-    if "woman" in profile_lower or "female" in profile_lower:
-        if "soft" in profile_lower or "gentle" in profile_lower:
-            return VOICE_MAPPING["female_soft"]
-        return VOICE_MAPPING["female_energetic"]
-    
-    # If we are here, treat 'profile' as a description for a new voice!
-    # To avoid re-creating every time, one might cache this, but for now we create new.
-    return create_custom_voice(profile, voice_name=f"Voice for {profile[:20]}")
-
-def generate_voice(text: str, voice_profile: str, output_path: str):
-    """
-    Generates audio for the given text using a voice matching the profile.
-    """
-    try:
-        voice_id = get_voice_id_from_profile(voice_profile)
-        print(f"Using Voice ID: {voice_id} for generation.")
-        
-        audio = client.text_to_speech.convert(
-            text=text,
-            voice_id=voice_id,
-            model_id="eleven_monolingual_v1"
-        )
-        
-        # Ensure directory exists
-        os.makedirs(os.path.dirname(output_path), exist_ok=True)
-        
-        with open(output_path, "wb") as f:
-            for chunk in audio:
-                f.write(chunk)
-                
-        print(f"Generated audio: {output_path}")
-        
-    except Exception as e:
-        print(f"Error generating voice for '{text[:20]}...': {e}")
+import os
+import re
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from flask import current_app
+from app.services.voice_registry import voice_registry
+from app.services.audio import concatenate_mp3
+from app.services.tracing import tracer
+from app.services.rate_limits import rate_limiter
+from app.services.registry import get_service
+
+TTS_MODEL = "eleven_monolingual_v1"
+
+def _client():
+    # ElevenLabs client, built on first use from ELEVENLABS_API_KEY
+    return get_service('elevenlabs')
+
+def _limited(model, func, *args, **kwargs):
+    # Shares the ElevenLabs quota across jobs; 429s back off and retry
+    return rate_limiter.limiter('elevenlabs', model).call(func, *args, **kwargs)
+
+# A simple mapping of descriptions to pre-made ElevenLabs Voice IDs.
+VOICE_MAPPING = {
+    "male_deep": "ErXwobaYiN019PkySvjV", # Antoni
+    "male_narrator": "TxGEqnHWrfWFTfGW9XjX", # Josh
+    "female_soft": "EXAVITQu4vr4xnSDxMaL", # Bella
+    "female_energetic": "21m00Tcm4TlvDq8ikWAM", # Rachel
+    "default": "21m00Tcm4TlvDq8ikWAM", # Rachel
+}
+
+# Serializes voice design so concurrent jobs don't design the same voice twice
+_design_lock = threading.Lock()
+
+def create_custom_voice(voice_description: str, voice_name: str = None) -> str:
+    """
+    Uses ElevenLabs 'Voice Design' to generate a voice from text.
+    """
+    if not voice_name:
+        voice_name = f"Custom Voice {uuid.uuid4().hex[:8]}"
+
+    current_app.logger.info(f"Creating custom voice: '{voice_name}' based on: '{voice_description}'")
+    
+    try:
+        with tracer.span('elevenlabs.voice_design'):
+            # 1. Generate the Voice Preview
+            response = _limited(
+                'voice_design', _client().text_to_voice.create_previews,
+                voice_description=voice_description,
+                text="This is how I sound. Do I fit the character?" 
+            )
+        
+            # 2. Pick the best one (picking the first for automation)
+            generated_voice_id = response.previews[0].generated_voice_id
+        
+            # 3. Save it to Library
+            new_voice = _limited(
+                'voice_design', _client().text_to_voice.create_voice_from_preview,
+                voice_name=voice_name,
+                voice_description=voice_description,
+                generated_voice_id=generated_voice_id
+            )
+        
+            return new_voice.voice_id
+    except Exception as e:
+        current_app.logger.error(f"Error creating custom voice: {e}")
+        return VOICE_MAPPING["default"]
+
+def get_voice_id_from_profile(profile: str) -> str:
+    """
+    Selects a voice ID based on the profile string. 
+    If it looks like a description, it tries to generate a custom voice.
+    For simplicity in this hack, we'll assume if it's not in mapping, it's a description.
+    """
+    profile_lower = profile.lower()
+    
+    # Check if it matches existing keys short codes
+    if profile_lower in VOICE_MAPPING:
+        return VOICE_MAPPING[profile_lower]
+        
+    # Fallback logic for old keywords if exact match failed
+    if "man" in profile_lower or "male" in profile_lower:
+        if "deep" in profile_lower or "gruff" in profile_lower:
+            return VOICE_MAPPING["male_deep"]
+        return VOICE_MAPPING["male_narrator"]
+    
+    if "woman" in profile_lower or "female" in profile_lower:
+        if "soft" in profile_lower or "gentle" in profile_lower:
+            return VOICE_MAPPING["female_soft"]
+        return VOICE_MAPPING["female_energetic"]
+    
+    # If we are here, treat 'profile' as a description for a voice.
+    # Reuse a previously designed voice for the same (or a similar) description.
+    voice_id = voice_registry.lookup(profile)
+    tracer.cache('voice_registry', voice_id is not None)
+    if voice_id:
+        current_app.logger.info(f"Reusing designed voice {voice_id} for: '{profile[:40]}'")
+        return voice_id
+
+    with _design_lock:
+        voice_id = voice_registry.lookup(profile)
+        if voice_id:
+            return voice_id
+
+        voice_id = create_custom_voice(profile, voice_name=f"Voice for {profile[:20]}")
+        if voice_id != VOICE_MAPPING["default"]:
+            for evicted_id in voice_registry.add(profile, voice_id):
+                delete_custom_voice(evicted_id)
+        return voice_id
+
+@tracer.traced('elevenlabs.voice_delete')
+def delete_custom_voice(voice_id: str):
+    """
+    Removes a designed voice evicted from the registry from the ElevenLabs library.
+    """
+    try:
+        _limited(None, _client().voices.delete, voice_id)
+        current_app.logger.info(f"Deleted stale custom voice: {voice_id}")
+    except Exception as e:
+        current_app.logger.error(f"Error deleting custom voice {voice_id}: {e}")
+
+@tracer.traced('elevenlabs.tts')
+def generate_voice(text: str, voice_profile: str, output_path: str):
+    """
+    Generates audio for the given text using a voice matching the profile.
+    """
+    try:
+        voice_id = get_voice_id_from_profile(voice_profile)
+        current_app.logger.info(f"Using Voice ID: {voice_id} for generation.")
+        
+        # Ensure directory exists
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        
+        _limited(TTS_MODEL, _write_speech, text, voice_id, output_path)
+                
+        current_app.logger.info(f"Generated audio: {output_path}")
+        
+    except Exception as e:
+        current_app.logger.error(f"Error generating voice for '{text[:20]}...': {e}")
+
+def split_script(text: str, segments: int) -> list:
+    """
+    Splits the script at sentence boundaries into at most `segments` parts
+    of roughly equal length (one per manga page).
+    """
+    sentences = [s for s in re.split(r'(?<=[.!?\u2026])\s+', text.strip()) if s]
+    if not sentences:
+        return []
+    segments = max(1, min(segments, len(sentences)))
+    target = len(text) / segments
+
+    parts, current = [], []
+    for i, sentence in enumerate(sentences):
+        current.append(sentence)
+        remaining_sentences = len(sentences) - i - 1
+        remaining_parts = segments - len(parts) - 1
+        current_length = sum(len(s) for s in current)
+        # Close the part once it reaches the target, but leave a sentence for every remaining part
+        if remaining_parts and (current_length >= target or remaining_sentences == remaining_parts):
+            parts.append(" ".join(current))
+            current = []
+    if current:
+        parts.append(" ".join(current))
+    return parts
+
+@tracer.traced('elevenlabs.tts_segment')
+def synthesize_segment(text: str, voice_id: str, output_path: str):
+    """
+    Synthesizes one script segment to an MP3 file.
+    """
+    _limited(TTS_MODEL, _write_speech, text, voice_id, output_path)
+    return output_path
+
+def _write_speech(text: str, voice_id: str, output_path: str):
+    # The audio streams while it is written, so the request lasts until the file is complete
+    audio = _client().text_to_speech.convert(
+        text=text,
+        voice_id=voice_id,
+        model_id=TTS_MODEL
+    )
+    received = 0
+    try:
+        with open(output_path, "wb") as f:
+            for chunk in audio:
+                f.write(chunk)
+                received += len(chunk)
+    except Exception:
+        # Don't leave a truncated segment behind
+        if os.path.exists(output_path):
+            os.remove(output_path)
+        raise
+    finally:
+        tracer.record(bytes_sent=len(text.encode('utf-8')), bytes_received=received)
+    return output_path
+
+@tracer.traced('elevenlabs.voiceover')
+def generate_voice_segments(text: str, voice_profile: str, output_path: str, segments: int, max_workers: int = 4, on_segment=None) -> list:
+    """
+    Generates audio in `segments` parts synthesized concurrently.
+
+    Writes one MP3 per segment (<output>_partNN.mp3) and the joined MP3 at
+    output_path (frames concatenated, no re-encode). Returns the timing
+    index: a list of {"index", "file", "start", "duration", "text"} dicts.
+    """
+    try:
+        voice_id = get_voice_id_from_profile(voice_profile)
+        current_app.logger.info(f"Using Voice ID: {voice_id} for segmented generation.")
+
+        parts = split_script(text, segments)
+        if not parts:
+            return []
+
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        base, _ = os.path.splitext(output_path)
+        paths = [f"{base}_part{i:02d}.mp3" for i in range(1, len(parts) + 1)]
+
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(parts)))) as executor:
+            futures = [
+                executor.submit(tracer.propagate(synthesize_segment), part, voice_id, path)
+                for part, path in zip(parts, paths)
+            ]
+            for done, future in enumerate(as_completed(futures), start=1):
+                future.result()
+                if on_segment:
+                    on_segment(done, len(parts))
+
+        durations = concatenate_mp3(paths, output_path)
+
+        timeline, start = [], 0.0
+        for i, (part, path, duration) in enumerate(zip(parts, paths, durations)):
+            timeline.append({
+                "index": i,
+                "file": os.path.basename(path),
+                "start": round(start, 3),
+                "duration": round(duration, 3),
+                "text": part
+            })
+            start += duration
+
+        current_app.logger.info(f"Generated audio: {output_path} ({len(parts)} segments)")
+        return timeline
+
+    except Exception as e:
+        current_app.logger.error(f"Error generating segmented voice for '{text[:20]}...': {e}")
+        return []
@@ -0,0 +1,218 @@
+import json
+import math
+import os
+import re
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+STOP_WORDS = {
+    'a', 'an', 'and', 'the', 'of', 'with', 'in', 'on', 'for', 'to', 'is', 'as',
+    'voice', 'tone', 'that', 'this', 'their', 'his', 'her', 'very', 'slightly'
+}
+
+
+def normalize_description(description):
+    """
+    Lowercase, drop punctuation and collapse whitespace.
+    """
+    return " ".join(re.findall(r"[a-z0-9']+", description.lower()))
+
+
+def _terms(normalized):
+    words = [word for word in normalized.split() if word not in STOP_WORDS]
+    # Unigrams plus bigrams so "deep gravelly" outranks "deep" and "gravelly" apart
+    return Counter(words + [f"{a} {b}" for a, b in zip(words, words[1:])])
+
+
+class VoiceRegistry:
+    """
+    Persistent map of voice descriptions to designed ElevenLabs voice ids.
+
+    Lookups first try the exact normalized description, then the most
+    similar registered description (TF-IDF cosine over description terms)
+    above `threshold`. The registry keeps at most `max_voices` entries;
+    evicting the least recently used one also hands its voice id back to
+    the caller so the library voice can be deleted.
+
+    The file is shared by all worker processes: every change re-reads,
+    mutates and replaces it under an exclusive flock on <path>.lock. Uses
+    found by lookups are buffered and written at most every
+    `flush_interval` seconds (and with the next add).
+    """
+
+    def __init__(self, path=None, max_voices=30, threshold=0.75, flush_interval=60):
+        self.path = path
+        self.max_voices = max_voices
+        self.threshold = threshold
+        self.flush_interval = flush_interval
+        self._entries = {}  # normalized description -> entry dict
+        self._used = {}  # normalized description -> (last used, uses) not yet written
+        self._flushed_at = time.monotonic()
+        self._signature = None
+        self._lock = threading.RLock()
+
+    def init_app(self, app):
+        self.path = str(app.config.get('VOICE_REGISTRY_PATH') or os.path.join(app.instance_path, 'voice_registry.json'))
+        self.max_voices = app.config.get('VOICE_REGISTRY_MAX_VOICES', self.max_voices)
+        self.threshold = app.config.get('VOICE_MATCH_THRESHOLD', self.threshold)
+        self.flush_interval = app.config.get('VOICE_REGISTRY_FLUSH_INTERVAL', self.flush_interval)
+        with self._lock:
+            self._entries = {}
+            self._used = {}
+            self._signature = None
+            self._reload()
+
+    def _reload(self, force=False):
+        """
+        Re-read the registry file if another process changed it.
+        """
+        # Caller holds self._lock
+        if not self.path:
+            return
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return
+        signature = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if signature == self._signature and not force:
+            return
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                self._entries = json.load(f)
+            self._signature = signature
+        except (OSError, ValueError):
+            pass
+
+    def _save(self):
+        # Caller holds the file lock (see _update)
+        tmp_path = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self._entries, f, indent=2)
+        os.replace(tmp_path, self.path)
+        stat = os.stat(self.path)
+        self._signature = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+    @contextmanager
+    def _update(self):
+        """
+        Read-modify-write: holds the file lock while the caller mutates the
+        freshly loaded entries (with the buffered uses applied), then saves.
+        """
+        with self._lock:
+            if not self.path:
+                self._apply_used()
+                yield
+                return
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(f"{self.path}.lock", 'a') as lock_file:
+                if fcntl:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    self._reload(force=True)
+                    self._apply_used()
+                    yield
+                    self._save()
+                finally:
+                    if fcntl:
+                        fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _apply_used(self):
+        # Caller holds self._lock
+        for normalized, (last_used, uses) in self._used.items():
+            entry = self._entries.get(normalized)
+            if entry:
+                entry['last_used'] = max(entry.get('last_used', 0), last_used)
+                entry['uses'] = entry.get('uses', 0) + uses
+        self._used = {}
+        self._flushed_at = time.monotonic()
+
+    def flush(self):
+        """
+        Write the buffered uses.
+        """
+        with self._lock:
+            if self._used:
+                with self._update():
+                    pass
+
+    def lookup(self, description):
+        """
+        Return the voice id registered for a matching description, or None.
+        """
+        normalized = normalize_description(description)
+        with self._lock:
+            self._reload()
+            match = normalized if normalized in self._entries else self._most_similar(normalized)
+            if match is None:
+                return None
+            _, uses = self._used.get(match, (0, 0))
+            self._used[match] = (time.time(), uses + 1)
+            if time.monotonic() - self._flushed_at >= self.flush_interval:
+                self.flush()
+            return self._entries[match]['voice_id']
+
+    def _most_similar(self, normalized):
+        if not self._entries:
+            return None
+        documents = {key: _terms(key) for key in self._entries}
+        document_frequency = Counter()
+        for terms in documents.values():
+            document_frequency.update(terms.keys())
+        count = len(documents) + 1
+
+        def vector(terms):
+            return {
+                term: freq * (1 + math.log(count / (1 + document_frequency[term])))
+                for term, freq in terms.items()
+            }
+
+        query = vector(_terms(normalized))
+        query_norm = math.sqrt(sum(weight * weight for weight in query.values()))
+        if not query_norm:
+            return None
+
+        best_key, best_score = None, 0.0
+        for key, terms in documents.items():
+            candidate = vector(terms)
+            norm = math.sqrt(sum(weight * weight for weight in candidate.values()))
+            if not norm:
+                continue
+            dot = sum(weight * candidate.get(term, 0.0) for term, weight in query.items())
+            score = dot / (query_norm * norm)
+            if score > best_score:
+                best_key, best_score = key, score
+        return best_key if best_score >= self.threshold else None
+
+    def add(self, description, voice_id):
+        """
+        Register a designed voice. Returns the voice ids evicted to stay
+        within max_voices (the caller deletes them from the library).
+        """
+        normalized = normalize_description(description)
+        now = time.time()
+        with self._update():
+            self._entries[normalized] = {
+                'voice_id': voice_id,
+                'description': description,
+                'created_at': now,
+                'last_used': now,
+                'uses': 1
+            }
+            evicted = []
+            while len(self._entries) > self.max_voices:
+                oldest = min(self._entries, key=lambda key: self._entries[key]['last_used'])
+                evicted.append(self._entries.pop(oldest)['voice_id'])
+            # Another description may still point at an evicted voice id
+            in_use = {entry['voice_id'] for entry in self._entries.values()}
+            evicted = [evicted_id for evicted_id in evicted if evicted_id not in in_use]
+        return evicted
+
+
+voice_registry = VoiceRegistry()
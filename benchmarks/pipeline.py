@@ -0,0 +1,212 @@
+"""
+End-to-end throughput benchmark against the local provider fakes.
+
+Drives N concurrent manga and avatar submissions through the Flask app
+(form POST -> background job -> materialized project) and reports p50/p95
+job latency, throughput and peak RSS.
+
+    python -m benchmarks.pipeline --manga 20 --avatars 10 --concurrency 8 --latency 0.2
+    python -m benchmarks.pipeline --max-p95 5 --min-throughput 2   # non-zero exit on regression
+"""
+import argparse
+import io
+import json
+import random
+import resource
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from PIL import Image
+
+# Make `app` importable when run as a script from anywhere
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app import create_app  # noqa: E402
+
+
+def _png(size=256):
+    # Distinct content per upload, so the media store's dedupe doesn't flatter the numbers
+    buffer = io.BytesIO()
+    Image.frombytes('RGB', (size, size), random.randbytes(size * size * 3)).save(buffer, format='PNG')
+    buffer.seek(0)
+    return buffer
+
+
+def _percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def _peak_rss_mb():
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    scale = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale
+    return round(own, 1), round(children, 1)
+
+
+def _submit(client, kind, index):
+    if kind == 'manga':
+        data = {
+            'submit': 'Generate Manga & Voice',
+            'title': f"Benchmark manga {index}",
+            'plot': "A courier races across a rainy neon city to deliver a mysterious package.",
+            'reference_images': [(_png(), f"ref_{index}.png")]
+        }
+    else:
+        data = {
+            'submit': 'Create Avatar',
+            'title': f"Benchmark avatar {index}",
+            'gender': 'neutral',
+            'protagonist_image': (_png(), f"hero_{index}.png")
+        }
+    response = client.post('/manga' if kind == 'manga' else '/avatars', data=data,
+                           content_type='multipart/form-data', headers={'Accept': 'application/json'})
+    if response.status_code != 202:
+        raise RuntimeError(f"{kind} submission failed with {response.status_code}")
+    return response.json['id']
+
+
+def _wait(client, job_id, poll_interval, timeout):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        payload = client.get(f"/jobs/{job_id}/status", headers={'Accept': 'application/json'}).json
+        if payload['status'] in ('done', 'failed'):
+            return payload
+        time.sleep(poll_interval)
+    raise TimeoutError(f"Job {job_id} did not finish within {timeout}s")
+
+
+def run_benchmark(app, manga=10, avatars=10, concurrency=8, poll_interval=0.02, timeout=300):
+    """
+    Submit `manga` + `avatars` jobs from `concurrency` client threads and
+    wait for all of them. Returns the report dict.
+    """
+    kinds = ['manga'] * manga + ['avatar'] * avatars
+    random.shuffle(kinds)
+    local = threading.local()
+
+    def client():
+        if not hasattr(local, 'client'):
+            local.client = app.test_client()
+        return local.client
+
+    def one(args):
+        index, kind = args
+        started = time.time()
+        job_id = _submit(client(), kind, index)
+        submitted = time.time()
+        payload = _wait(client(), job_id, poll_interval, timeout)
+        return {
+            'kind': kind,
+            'status': payload['status'],
+            'submit_latency': submitted - started,
+            # The job's own finish time, so the poll interval doesn't count
+            'latency': payload['updated_at'] - started
+        }
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(one, enumerate(kinds)))
+    elapsed = time.perf_counter() - started
+
+    def summary(rows):
+        latencies = [row['latency'] for row in rows if row['status'] == 'done']
+        return {
+            'jobs': len(rows),
+            'failed': sum(row['status'] != 'done' for row in rows),
+            'p50': _percentile(latencies, 0.50),
+            'p95': _percentile(latencies, 0.95),
+            'max': max(latencies) if latencies else None
+        }
+
+    own_rss, children_rss = _peak_rss_mb()
+    return {
+        'elapsed': elapsed,
+        'throughput': sum(row['status'] == 'done' for row in results) / elapsed if elapsed else 0.0,
+        'concurrency': concurrency,
+        'all': summary(results),
+        'manga': summary([row for row in results if row['kind'] == 'manga']),
+        'avatar': summary([row for row in results if row['kind'] == 'avatar']),
+        'submit_p95': _percentile([row['submit_latency'] for row in results], 0.95),
+        'peak_rss_mb': own_rss,
+        'peak_children_rss_mb': children_rss
+    }
+
+
+def make_app(workdir, latency=0.0, jitter=0.0, failure_rate=0.0, payload_bytes=64 * 1024, pages=4, throttle_rate=0.0,
+             **overrides):
+    workdir = Path(workdir)
+    return create_app('testing', config_overrides={
+        'UPLOAD_FOLDER': workdir / 'uploads',
+        'PROJECT_DB_PATH': workdir / 'projects.sqlite3',
+        'MEDIA_DB_PATH': workdir / 'media.sqlite3',
+        'JOB_DB_PATH': workdir / 'jobs.sqlite3',
+        'BRIEF_CACHE_DIR': workdir / 'brief_cache',
+        'VOICE_REGISTRY_PATH': workdir / 'voice_registry.json',
+        'ANAM_INVENTORY_PATH': workdir / 'avatar_inventory.json',
+        'FAKE_LATENCY': latency,
+        'FAKE_JITTER': jitter,
+        'FAKE_FAILURE_RATE': failure_rate,
+        'FAKE_THROTTLE_RATE': throttle_rate,
+        'FAKE_PAYLOAD_BYTES': payload_bytes,
+        'FAKE_BRIEF_PAGES': pages,
+        **overrides
+    })
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--manga', type=int, default=10, help="manga submissions")
+    parser.add_argument('--avatars', type=int, default=10, help="avatar submissions")
+    parser.add_argument('--concurrency', type=int, default=8, help="concurrent client threads")
+    parser.add_argument('--latency', type=float, default=0.05, help="fake provider latency per call (s)")
+    parser.add_argument('--jitter', type=float, default=0.0, help="extra random latency per call (s)")
+    parser.add_argument('--failure-rate', type=float, default=0.0, help="fake provider failure rate (0..1)")
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help="fake provider 429 rate (0..1)")
+    parser.add_argument('--payload-bytes', type=int, default=64 * 1024, help="fake page image / audio size")
+    parser.add_argument('--pages', type=int, default=4, help="pages per manga")
+    parser.add_argument('--timeout', type=float, default=300, help="per-job timeout (s)")
+    parser.add_argument('--max-p95', type=float, help="fail if overall p95 latency exceeds this (s)")
+    parser.add_argument('--min-throughput', type=float, help="fail if throughput is below this (jobs/s)")
+    parser.add_argument('--json', action='store_true', help="print the report as JSON")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory(prefix='comics-bench-') as workdir:
+        app = make_app(
+            workdir, latency=args.latency, jitter=args.jitter, failure_rate=args.failure_rate,
+            payload_bytes=args.payload_bytes, pages=args.pages, throttle_rate=args.throttle_rate
+        )
+        report = run_benchmark(app, args.manga, args.avatars, args.concurrency, timeout=args.timeout)
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print(f"{report['all']['jobs']} jobs in {report['elapsed']:.2f}s "
+              f"({report['throughput']:.2f} jobs/s, concurrency {report['concurrency']})")
+        for kind in ('manga', 'avatar'):
+            row = report[kind]
+            if row['jobs']:
+                print(f"  {kind:<7} p50 {row['p50'] or 0:.3f}s  p95 {row['p95'] or 0:.3f}s  "
+                      f"max {row['max'] or 0:.3f}s  failed {row['failed']}")
+        print(f"  submit p95 {report['submit_p95']:.3f}s  peak RSS {report['peak_rss_mb']} MB "
+              f"(children {report['peak_children_rss_mb']} MB)")
+
+    failures = []
+    if args.max_p95 is not None and (report['all']['p95'] or 0) > args.max_p95:
+        failures.append(f"p95 {report['all']['p95']:.3f}s > {args.max_p95}s")
+    if args.min_throughput is not None and report['throughput'] < args.min_throughput:
+        failures.append(f"throughput {report['throughput']:.2f} < {args.min_throughput} jobs/s")
+    for failure in failures:
+        print(f"REGRESSION: {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
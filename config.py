@@ -1,18 +1,149 @@
+import json
 import os
 from pathlib import Path
+from dotenv import load_dotenv
 
 BASE_DIR = Path(__file__).resolve().parent
 
+# Load environment variables from .env before the settings below read them
+load_dotenv(BASE_DIR / '.env')
+
 class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'dev-key-please-change'
     
     # Uploads
     UPLOAD_FOLDER = BASE_DIR / 'app' / 'static' / 'uploads'
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB max upload
+    # Hand media transfers to the front proxy: an internal nginx location
+    # (X-Accel-Redirect) or X-Sendfile for Apache/lighttpd
+    MEDIA_X_ACCEL_PREFIX = os.environ.get('MEDIA_X_ACCEL_PREFIX')
+    USE_X_SENDFILE = os.environ.get('USE_X_SENDFILE') == '1'
+    # Blob index for deduplicated media (SQLite, defaults to <instance>/media.sqlite3)
+    MEDIA_DB_PATH = os.environ.get('MEDIA_DB_PATH')
+    # Media storage budget: past it, least recently used renditions and comic page
+    # caches are evicted down to STORAGE_LOW_WATER of the budget (0 = unbounded)
+    STORAGE_BUDGET_BYTES = int(os.environ.get('STORAGE_BUDGET_BYTES', 10 * 1024 ** 3))
+    STORAGE_LOW_WATER = float(os.environ.get('STORAGE_LOW_WATER', 0.9))
+    # Background sweeps (seconds apart, 0 = off) and entries checked per sweep
+    STORAGE_SWEEP_INTERVAL = int(os.environ.get('STORAGE_SWEEP_INTERVAL', 300))
+    STORAGE_SWEEP_BATCH = int(os.environ.get('STORAGE_SWEEP_BATCH', 500))
+    # Age (seconds) after which temp files and blobs no project claimed are deleted
+    STORAGE_ORPHAN_GRACE = int(os.environ.get('STORAGE_ORPHAN_GRACE', 6 * 3600))
+
+    # Project store (SQLite, defaults to <instance>/projects.sqlite3)
+    PROJECT_DB_PATH = os.environ.get('PROJECT_DB_PATH')
+    PROJECTS_PER_PAGE = int(os.environ.get('PROJECTS_PER_PAGE', 24))
+    # Rendered project cards kept in memory (per process)
+    FRAGMENT_CACHE_MAX_ENTRIES = int(os.environ.get('FRAGMENT_CACHE_MAX_ENTRIES', 1024))
 
-    # API Keys
+    # API Keys (provider clients are built from these on first use)
+    GOOGLE_API_KEY = os.environ.get('GOOGLE_API_KEY')
+    ELEVENLABS_API_KEY = os.environ.get('ELEVENLABS_API_KEY')
     ANAM_API_KEY = os.environ.get('ANAM_API_KEY')
-    ANAM_API_URL = os.environ.get('ANAM_API_URL')
+    ANAM_API_URL = os.environ.get('ANAM_API_URL', 'https://api.anam.ai/v1')
+    ANAM_POOL_SIZE = int(os.environ.get('ANAM_POOL_SIZE', 10))
+    ANAM_CONNECT_TIMEOUT = float(os.environ.get('ANAM_CONNECT_TIMEOUT', 5))
+    ANAM_READ_TIMEOUT = float(os.environ.get('ANAM_READ_TIMEOUT', 60))
+    ANAM_MAX_RETRIES = int(os.environ.get('ANAM_MAX_RETRIES', 3))
+    # Max seconds to wait for avatar deletes to show up before creating a new one
+    ANAM_CLEANUP_WAIT_TIMEOUT = float(os.environ.get('ANAM_CLEANUP_WAIT_TIMEOUT', 10))
+    # Avatars kept before the least recently viewed ones are deleted
+    ANAM_AVATAR_LIMIT = int(os.environ.get('ANAM_AVATAR_LIMIT', 5))
+    # Reuse the live avatar made from an identical protagonist image instead of uploading again
+    ANAM_AVATAR_REUSE = os.environ.get('ANAM_AVATAR_REUSE', '1') == '1'
+    # Protagonist images are cropped, fit in this box and sent in the smallest of these formats
+    ANAM_AVATAR_IMAGE_MAX_DIM = int(os.environ.get('ANAM_AVATAR_IMAGE_MAX_DIM', 1024))
+    ANAM_AVATAR_IMAGE_QUALITY = int(os.environ.get('ANAM_AVATAR_IMAGE_QUALITY', 88))
+    ANAM_AVATAR_IMAGE_FORMATS = tuple(os.environ.get('ANAM_AVATAR_IMAGE_FORMATS', 'JPEG,WEBP').upper().split(','))
+    # Local avatar inventory (defaults to <instance>/avatar_inventory.json), reconciled in the
+    # background every N seconds; avatar views are written to it on the same interval
+    ANAM_INVENTORY_PATH = os.environ.get('ANAM_INVENTORY_PATH')
+    ANAM_INVENTORY_SYNC_INTERVAL = int(os.environ.get('ANAM_INVENTORY_SYNC_INTERVAL', 300))
+    # Pre-minted session tokens per recently created/viewed avatar
+    ANAM_TOKEN_POOL_SIZE = int(os.environ.get('ANAM_TOKEN_POOL_SIZE', 2))
+    ANAM_TOKEN_HOT_AVATARS = int(os.environ.get('ANAM_TOKEN_HOT_AVATARS', 10))
+    # Assumed token lifetime when the API does not return expiresAt
+    ANAM_SESSION_TOKEN_TTL = int(os.environ.get('ANAM_SESSION_TOKEN_TTL', 3600))
+
+    # Manga generation
+    # Page continuity: 'strict' (chained), 'anchor' (pages condition on page 1), 'parallel'
+    MANGA_CONTINUITY = os.environ.get('MANGA_CONTINUITY', 'strict')
+    MANGA_PAGE_WORKERS = int(os.environ.get('MANGA_PAGE_WORKERS', 4))
+    # Stream the creative brief and start pages/voice design as each part of it completes
+    MANGA_STREAM_BRIEF = os.environ.get('MANGA_STREAM_BRIEF', '1') == '1'
+    # Batches: manga generated at once, and chapters (same series and references) per brief call
+    MANGA_BATCH_CONCURRENCY = int(os.environ.get('MANGA_BATCH_CONCURRENCY', 4))
+    MANGA_BATCH_BRIEF_GROUP = int(os.environ.get('MANGA_BATCH_BRIEF_GROUP', 4))
+    # Records accepted by one POST /manga/batch (the CLI has no limit)
+    MANGA_BATCH_MAX_RECORDS = int(os.environ.get('MANGA_BATCH_MAX_RECORDS', 100))
+    # Reference images are downscaled to fit this box before being sent to Gemini
+    REFERENCE_IMAGE_MAX_DIM = int(os.environ.get('REFERENCE_IMAGE_MAX_DIM', 1536))
+
+    # Derived page renditions (responsive widths + thumbnail), encoded in a process pool
+    RENDITION_WIDTHS = (480, 960, 1440)
+    RENDITION_THUMB_WIDTH = 320
+    # e.g. 'avif,webp' to also offer AVIF (smaller, but much slower to encode)
+    RENDITION_FORMATS = tuple(os.environ.get('RENDITION_FORMATS', 'webp').split(','))
+    RENDITION_WORKERS = int(os.environ.get('RENDITION_WORKERS', 2))
+
+    # Comic ingestion: PDF/image pages rasterized in a process pool (PDFs need pypdfium2 or PyMuPDF)
+    COMIC_DPI = int(os.environ.get('COMIC_DPI', 150))
+    COMIC_MAX_PAGE_DIM = int(os.environ.get('COMIC_MAX_PAGE_DIM', 2048))
+    COMIC_WORKERS = int(os.environ.get('COMIC_WORKERS', 2))
+    # Representative pages of a PDF reference handed to the creative brief
+    COMIC_REFERENCE_FRAMES = int(os.environ.get('COMIC_REFERENCE_FRAMES', 4))
+
+    # Write each job's trace (spans with latency, bytes, retries, cache hits) as <dir>/<job id>.json
+    TRACE_DUMP_DIR = os.environ.get('TRACE_DUMP_DIR')
+
+    # Background jobs (run per web worker process; state shared through SQLite,
+    # defaults to <instance>/jobs.sqlite3)
+    JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 8))
+    JOB_MAX_FINISHED = int(os.environ.get('JOB_MAX_FINISHED', 200))
+    JOB_DB_PATH = os.environ.get('JOB_DB_PATH')
+    # How often (seconds) event streams poll for jobs running in another worker
+    JOB_POLL_INTERVAL = float(os.environ.get('JOB_POLL_INTERVAL', 0.5))
+    # Owners stamp their running jobs this often (seconds); a job not stamped
+    # for JOB_STALE_AFTER seconds is failed (its worker died)
+    JOB_HEARTBEAT_INTERVAL = float(os.environ.get('JOB_HEARTBEAT_INTERVAL', 10))
+    JOB_STALE_AFTER = float(os.environ.get('JOB_STALE_AFTER', 60))
+
+    # Creative brief cache (memory LRU + disk, defaults to <instance>/brief_cache)
+    BRIEF_CACHE_DIR = os.environ.get('BRIEF_CACHE_DIR')
+    BRIEF_CACHE_MAX_ENTRIES = int(os.environ.get('BRIEF_CACHE_MAX_ENTRIES', 128))
+    BRIEF_CACHE_MAX_BYTES = int(os.environ.get('BRIEF_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+    BRIEF_CACHE_TTL = int(os.environ.get('BRIEF_CACHE_TTL', 7 * 24 * 3600))
+
+    # Designed ElevenLabs voices (defaults to <instance>/voice_registry.json)
+    VOICE_REGISTRY_PATH = os.environ.get('VOICE_REGISTRY_PATH')
+    VOICE_REGISTRY_MAX_VOICES = int(os.environ.get('VOICE_REGISTRY_MAX_VOICES', 30))
+    VOICE_MATCH_THRESHOLD = float(os.environ.get('VOICE_MATCH_THRESHOLD', 0.75))
+    # Seconds between writes of the last-used times recorded by lookups
+    VOICE_REGISTRY_FLUSH_INTERVAL = int(os.environ.get('VOICE_REGISTRY_FLUSH_INTERVAL', 60))
+    # Synthesize the narration in parallel per-page segments joined without re-encoding
+    VOICE_SEGMENTED = os.environ.get('VOICE_SEGMENTED', '1') == '1'
+    VOICE_TTS_WORKERS = int(os.environ.get('VOICE_TTS_WORKERS', 4))
+
+    # Per-provider limits ("provider" or "provider:model"): rate (requests/s), burst,
+    # initial concurrency and its AIMD bounds. RATE_LIMITS (JSON) overrides entries.
+    RATE_LIMITS = {
+        'gemini:gemini-2.5-flash': {'rate': 2.0, 'burst': 4, 'concurrency': 4, 'max_concurrency': 16},
+        'gemini:gemini-3-pro-image-preview': {'rate': 0.5, 'burst': 2, 'concurrency': 2, 'max_concurrency': 8},
+        'elevenlabs': {'rate': 2.0, 'burst': 4, 'concurrency': 4, 'max_concurrency': 10},
+        'elevenlabs:voice_design': {'rate': 0.5, 'burst': 1, 'concurrency': 1, 'max_concurrency': 2},
+        'anam': {'rate': 5.0, 'burst': 5, 'concurrency': 4, 'max_concurrency': 10},
+        **json.loads(os.environ.get('RATE_LIMITS') or '{}')
+    }
+    RATE_LIMIT_RETRIES = int(os.environ.get('RATE_LIMIT_RETRIES', 4))
+
+    # Local Gemini/ElevenLabs/Anam stand-ins (app.services.fakes) instead of the live APIs
+    FAKE_PROVIDERS = os.environ.get('FAKE_PROVIDERS') == '1'
+    FAKE_LATENCY = float(os.environ.get('FAKE_LATENCY', 0))
+    FAKE_JITTER = float(os.environ.get('FAKE_JITTER', 0))
+    FAKE_FAILURE_RATE = float(os.environ.get('FAKE_FAILURE_RATE', 0))
+    FAKE_THROTTLE_RATE = float(os.environ.get('FAKE_THROTTLE_RATE', 0))
+    FAKE_PAYLOAD_BYTES = int(os.environ.get('FAKE_PAYLOAD_BYTES', 64 * 1024))
+    FAKE_BRIEF_PAGES = int(os.environ.get('FAKE_BRIEF_PAGES', 4))
 
 class DevelopmentConfig(Config):
     DEBUG = True
@@ -20,6 +151,11 @@ class DevelopmentConfig(Config):
 class TestingConfig(Config):
     TESTING = True
     WTF_CSRF_ENABLED = False
+    FAKE_PROVIDERS = True
+    # The fakes have no quota; only adaptive concurrency applies
+    RATE_LIMITS = {}
+    # Sweeps are run explicitly
+    STORAGE_SWEEP_INTERVAL = 0
 
 class ProductionConfig(Config):
     DEBUG = False
@@ -1,14 +1,20 @@
 import pytest
-from app import create_app, db
+from app import create_app
 
 @pytest.fixture
-def app():
-    app = create_app('testing')
+def app(tmp_path):
+    # Every store and cache under a throwaway directory; providers are the local fakes
+    app = create_app('testing', config_overrides={
+        'UPLOAD_FOLDER': tmp_path / 'uploads',
+        'PROJECT_DB_PATH': tmp_path / 'projects.sqlite3',
+        'MEDIA_DB_PATH': tmp_path / 'media.sqlite3',
+        'JOB_DB_PATH': tmp_path / 'jobs.sqlite3',
+        'BRIEF_CACHE_DIR': tmp_path / 'brief_cache',
+        'VOICE_REGISTRY_PATH': tmp_path / 'voice_registry.json',
+        'ANAM_INVENTORY_PATH': tmp_path / 'avatar_inventory.json'
+    })
     with app.app_context():
-        db.create_all()
         yield app
-        db.session.remove()
-        db.drop_all()
 
 @pytest.fixture
 def client(app):
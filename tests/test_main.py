@@ -1,3 +1,9 @@
+import json
+import os
+import time
+
+import pytest
+
 def test_health(client):
     response = client.get('/health')
     assert response.status_code == 200
@@ -7,3 +13,620 @@ def test_index_page(client):
     response = client.get('/')
     assert response.status_code == 200
     assert b'Comics Factory' in response.data
+
+def test_pipeline_with_fake_providers(app):
+    from benchmarks.pipeline import run_benchmark
+    report = run_benchmark(app, manga=2, avatars=2, concurrency=2, timeout=60)
+    assert report['all']['jobs'] == 4
+    assert report['all']['failed'] == 0
+
+def test_project_listing_revalidates(client):
+    response = client.get('/projects')
+    assert response.status_code == 200
+    assert client.get('/projects', headers={'If-None-Match': response.headers['ETag']}).status_code == 304
+
+def test_manga_batch_cli(app, runner, tmp_path):
+    from benchmarks.pipeline import _png
+    (tmp_path / 'ref.png').write_bytes(_png().getvalue())
+    records = tmp_path / 'records.jsonl'
+    records.write_text("\n".join(json.dumps(record) for record in [
+        {'title': 'Chapter 1', 'plot': 'A courier takes a job.', 'series': 'courier', 'references': ['ref.png']},
+        {'title': 'Chapter 2', 'plot': 'The package starts ticking.', 'series': 'courier', 'references': ['ref.png']},
+        {'title': 'Standalone', 'plot': 'A quiet day at the harbour.'},
+        {'title': 'Broken'}
+    ]))
+    result = runner.invoke(args=['manga', 'batch', str(records)])
+    lines = [json.loads(line) for line in result.output.splitlines() if line.startswith('{')]
+    assert result.exit_code == 1
+    assert sorted(line['status'] for line in lines) == ['done', 'done', 'done', 'failed']
+    # The two chapters of the series shared one brief call
+    assert app.extensions['fake_providers']['gemini'].behavior.calls == 2 + 3 * 4
+
+def test_job_state_is_shared_across_workers(app, client):
+    from benchmarks.pipeline import _png
+    from app.services.jobs import job_manager
+    response = client.post('/manga', headers={'Accept': 'application/json'}, data={
+        'title': 'Shared', 'plot': 'A courier takes a job.', 'reference_images': [(_png(), 'ref.png')]
+    })
+    assert response.status_code == 202
+    job_id = response.json['id']
+    while not job_manager.get(job_id).finished:
+        time.sleep(0.05)
+    # Another worker process only has the store
+    with job_manager._lock:
+        del job_manager._jobs[job_id]
+    status = client.get(f'/jobs/{job_id}/status')
+    assert status.status_code == 200
+    assert status.json['status'] == 'done'
+    assert client.get(f'/jobs/{job_id}/trace').json['spans']
+    assert b'event: progress' in client.get(f'/jobs/{job_id}/events').data
+
+    # A job whose worker died stops heartbeating and reads as failed
+    with job_manager.db.get() as conn:
+        conn.execute("UPDATE jobs SET status = 'running', trace = NULL, heartbeat_at = ? WHERE id = ?",
+                     (time.time() - job_manager.stale_after - 1, job_id))
+    status = client.get(f'/jobs/{job_id}/status')
+    assert status.json['status'] == 'failed'
+    assert 'stopped' in status.json['error']
+
+def test_brief_cache(tmp_path, monkeypatch):
+    import os
+    from app.services.brief_cache import BriefCache
+    from app.services.media import digest_for
+    reference = tmp_path / 'ref.png'
+    reference.write_bytes(b'one')
+    key = BriefCache.make_key('Title', 'Plot', 'model', 1, [digest_for(str(reference))])
+    cache = BriefCache(tmp_path / 'briefs', ttl=60)
+    os.makedirs(cache.cache_dir)
+    assert cache.get(key) is None
+    cache.set(key, {'pages': ['one']})
+    assert cache.get(key) == {'pages': ['one']}
+    # A fresh process reads it back from disk
+    assert BriefCache(cache.cache_dir, ttl=60).get(key) == {'pages': ['one']}
+
+    # Changing a reference image changes the key
+    reference.write_bytes(b'two')
+    assert BriefCache.make_key('Title', 'Plot', 'model', 1, [digest_for(str(reference))]) != key
+
+    # Expired in both tiers
+    now = time.time()
+    monkeypatch.setattr(time, 'time', lambda: now + 120)
+    assert cache.get(key) is None
+    assert not os.path.exists(cache._path(key))
+    monkeypatch.undo()
+
+    # Over the byte budget the oldest entries go first
+    small = BriefCache(tmp_path / 'small', max_disk_bytes=100)
+    os.makedirs(small.cache_dir)
+    for index in range(3):
+        small.set(f'key{index}', {'pages': ['x' * 30]})
+        os.utime(small._path(f'key{index}'), (now - 10 + index, now - 10 + index))
+    small.set('key3', {'pages': ['x' * 30]})
+    assert sorted(os.listdir(small.cache_dir)) == ['key2.json', 'key3.json']
+
+def test_sweep_keeps_claimed_media(tmp_path):
+    import os
+    from benchmarks.pipeline import make_app, _png
+    from app.models import MangaProject
+    from app.services.manga_generator import manga_service
+    from app.services.media import media_store, is_hashed_name
+    from app.services.project_store import project_store
+    from app.services.storage import storage_manager
+    app = make_app(tmp_path, STORAGE_ORPHAN_GRACE=0)
+    with app.app_context():
+        reference = media_store.put_bytes(_png().getvalue(), 'png')
+        result = manga_service.generate_manga('Kept', 'A courier takes a job.', [media_store.path(reference)])
+        project = project_store.create(
+            MangaProject, title='Kept', script=result['script'], audio_path=result['audio_file'],
+            pages=result['pages'], audio_segments=result['audio_segments'], references=[reference]
+        )
+        storage_manager.claim(project)
+        segments = [segment['file'] for segment in project.audio_segments]
+        assert segments and all(is_hashed_name(name) for name in segments)
+        orphan = media_store.put_bytes(b'never claimed', 'bin')
+        # Voiceovers of older projects live under uploads/audio; scratch files are the job's own
+        legacy = os.path.join(app.config['UPLOAD_FOLDER'], 'audio', 'voiceover_1.mp3')
+        scratch = os.path.join(storage_manager.scratch_folder, 'part01.mp3')
+        for path in (legacy, scratch):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(b'audio')
+            os.utime(path, (time.time() - 3600, time.time() - 3600))
+        time.sleep(0.01)
+
+        assert storage_manager.sweep()['removed']['orphan'] >= 1
+        assert not os.path.exists(media_store.path(orphan))
+        assert all(os.path.exists(media_store.path(name)) for name in project.media_names)
+        assert os.path.exists(legacy) and not os.path.exists(scratch)
+
+def test_cascade_regenerates_dependent_pages(app):
+    from benchmarks.pipeline import _png
+    from app.services.manga_generator import manga_service
+    from app.services.media import media_store
+    reference = media_store.put_bytes(_png().getvalue(), 'png')
+    result = manga_service.generate_manga('Strict', 'A courier takes a job.', [media_store.path(reference)],
+                                          continuity='strict')
+    outputs = result['page_outputs']
+    assert [output['conditioned_on'] for output in outputs] == [None, 0, 1, 2]
+
+    def regenerate(index):
+        return manga_service.regenerate_pages(result['brief'], 'strict', [reference], outputs, [index], cascade=True)
+
+    # Page 3 takes page 4 (conditioned on it) along, pages 1 and 2 are untouched
+    partial = regenerate(2)
+    assert partial['regenerated'] == [2, 3]
+    assert [output['file'] for output in partial['page_outputs'][:2]] == [output['file'] for output in outputs[:2]]
+    assert sorted(partial['replaced']) == sorted(output['file'] for output in outputs[2:])
+
+    # Every page of a strict manga depends on page 1
+    full = regenerate(0)
+    assert full['regenerated'] == [0, 1, 2, 3]
+    assert not {output['file'] for output in full['page_outputs']} & {output['file'] for output in outputs}
+
+def test_throttling_shrinks_and_recovers_concurrency(tmp_path):
+    import pytest
+    from benchmarks.pipeline import make_app
+    from app.services.fakes import FakeThrottled
+    from app.services.rate_limits import rate_limiter
+    app = make_app(tmp_path, throttle_rate=1.0)
+    with app.app_context():
+        behavior = app.extensions['fake_providers']['gemini'].behavior
+        limiter = rate_limiter.limiter('gemini', 'throttle-test')
+        initial = limiter.concurrency.limit
+
+        started = time.monotonic()
+        with pytest.raises(FakeThrottled):
+            limiter.call(behavior.call, 'gemini.test')
+        elapsed = time.monotonic() - started
+        assert behavior.calls == limiter.max_retries + 1
+        # Each retry waited out the 0.05s Retry-After, not the (seconds long) default backoff
+        assert limiter.max_retries * 0.05 <= elapsed < 1
+        assert limiter.concurrency.limit == limiter.concurrency.minimum < initial
+
+        behavior.throttle_rate = 0.0
+        for _ in range(50):
+            limiter.call(behavior.call, 'gemini.test')
+        assert limiter.concurrency.limit >= initial
+
+def test_brief_cache_stats_on_metrics(client):
+    from app.services.brief_cache import brief_cache
+    # A fresh app starts from empty counters
+    assert brief_cache.stats() == {'hits': 0, 'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'memory_entries': 0}
+    brief_cache.get('missing')
+    brief_cache.set('present', {'pages': ['one']})
+    brief_cache.get('present')
+    metrics = client.get('/metrics').get_data(as_text=True)
+    assert 'comics_cache_stats{cache="brief",stat="misses"} 1' in metrics
+    assert 'comics_cache_stats{cache="brief",stat="memory_hits"} 1' in metrics
+
+def test_reference_image_encoded_once_per_job(app, monkeypatch):
+    from benchmarks.pipeline import _png
+    from app.services.image_assets import ImageAssetCache
+    from app.services.manga_generator import manga_service
+    from app.services.media import media_store
+    encoded = []
+    encode = ImageAssetCache._encode
+    monkeypatch.setattr(ImageAssetCache, '_encode', lambda self, path: encoded.append(path) or encode(self, path))
+    path = media_store.path(media_store.put_bytes(_png(1024).getvalue(), 'png'))
+    assets = ImageAssetCache(max_dimension=512)
+
+    manga_service.generate_manga('Once', 'A courier takes a job.', [path], continuity='strict', assets=assets)
+    # The brief and every page shared one decode; pages conditioned on their predecessor from memory
+    assert encoded == [path]
+    part = assets.reference_part(path)
+    assert part is assets.reference_part(path)
+    assert part.inline_data.mime_type == 'image/jpeg'
+
+def test_voice_registry_shared_across_workers(app):
+    from app.services.voice_registry import VoiceRegistry, voice_registry
+    other = VoiceRegistry(voice_registry.path, max_voices=2, flush_interval=3600)
+    voice_registry.max_voices = 2
+    voice_registry.add('gravelly old sailor', 'voice-a')
+    # Another worker's add goes through the shared file instead of overwriting it
+    other.add('bright young pilot', 'voice-b')
+    assert voice_registry.lookup('gravelly old sailor') == 'voice-a'
+    assert voice_registry.lookup('bright young pilot') == 'voice-b'
+
+    # Lookups only buffer their use; the file is written by the next add
+    with open(voice_registry.path) as f:
+        saved = f.read()
+    assert other.lookup('gravelly old sailor') == 'voice-a'
+    with open(voice_registry.path) as f:
+        assert f.read() == saved
+    # The buffered use keeps the sailor voice; the pilot is least recently used
+    assert other.add('whispering ghost', 'voice-c') == ['voice-b']
+    assert voice_registry.lookup('whispering ghost') == 'voice-c'
+    assert voice_registry.lookup('gravelly old sailor') == 'voice-a'
+
+def test_split_script_at_sentence_boundaries():
+    from app.services.voice_generator import split_script
+    text = "One fish. Two fish! Red fish? Blue fish. The end."
+    parts = split_script(text, 3)
+    assert len(parts) == 3
+    # Every sentence survives, whole and in order
+    assert " ".join(parts) == text
+    assert all(part.endswith(('.', '!', '?')) for part in parts)
+    # Never more parts than sentences
+    assert split_script("Just one sentence here.", 4) == ["Just one sentence here."]
+    assert split_script("   ", 2) == []
+
+def test_concatenate_mp3_joins_frames(tmp_path):
+    from app.services.audio import concatenate_mp3
+    from app.services.fakes import MP3_FRAME_HEADER, MP3_FRAME_LENGTH
+    frame = MP3_FRAME_HEADER + bytes(MP3_FRAME_LENGTH - len(MP3_FRAME_HEADER))
+    xing = MP3_FRAME_HEADER + bytes(32) + b'Xing' + bytes(MP3_FRAME_LENGTH - len(MP3_FRAME_HEADER) - 36)
+    id3 = b'ID3\x04\x00\x00\x00\x00\x00\x0a' + bytes(10)
+    paths = []
+    for i, frames in enumerate((3, 5)):
+        path = tmp_path / f"part{i}.mp3"
+        # Per-segment ID3 tags and Xing header frames are dropped
+        path.write_bytes(id3 + xing + frame * frames)
+        paths.append(str(path))
+    output = tmp_path / "joined.mp3"
+
+    durations = concatenate_mp3(paths, str(output))
+    assert output.read_bytes() == frame * 8
+    # 128 kbps, 44.1 kHz: 1152 samples per frame
+    assert durations == pytest.approx([3 * 1152 / 44100, 5 * 1152 / 44100])
+
+class _ScriptedSession:
+    """Stands in for requests.Session: raises or returns each scripted outcome in turn."""
+
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = 0
+
+    def request(self, method, url, **kwargs):
+        self.calls += 1
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    def close(self):
+        pass
+
+def _response(status, headers=None):
+    import requests
+    response = requests.Response()
+    response.status_code = status
+    response.headers.update(headers or {})
+    response._content = b'{}'
+    return response
+
+def test_http_client_retries(monkeypatch):
+    import requests
+    from urllib3.exceptions import MaxRetryError, NewConnectionError
+    from app.services import http_client
+    from app.services.http_client import HTTPClient, parse_retry_after
+    sleeps = []
+    monkeypatch.setattr(http_client.time, 'sleep', sleeps.append)
+    client = HTTPClient('https://api.example.com', max_retries=3, backoff_factor=0.5)
+    refused = requests.exceptions.ConnectionError(MaxRetryError(None, '/avatars', NewConnectionError(None, 'refused')))
+
+    # Retry-After (seconds or an HTTP date) replaces the exponential backoff
+    client._session = _ScriptedSession(_response(429, {'Retry-After': '2'}), _response(503), _response(200))
+    assert client.get('avatars').status_code == 200
+    assert sleeps == [2.0, 1.0]
+    assert parse_retry_after('Wed, 21 Oct 2015 07:28:00 GMT') == 0.0
+    assert parse_retry_after('soon') is None
+
+    # Idempotent requests retry any connection failure or timeout
+    client._session = _ScriptedSession(requests.exceptions.ReadTimeout(), refused, _response(200))
+    assert client.get('avatars').status_code == 200
+    assert client._session.calls == 3
+
+    # A create that may have reached the server is never resent...
+    for error in (requests.exceptions.ReadTimeout(), requests.exceptions.ConnectionError('reset')):
+        client._session = _ScriptedSession(error, _response(200))
+        with pytest.raises(type(error)):
+            client.post('avatars', idempotent=False)
+        assert client._session.calls == 1
+    client._session = _ScriptedSession(_response(503), _response(200))
+    assert client.post('avatars', idempotent=False).status_code == 503
+
+    # ...but one that failed to connect, or was rate limited, is
+    client._session = _ScriptedSession(requests.exceptions.ConnectTimeout(), refused, _response(429), _response(201))
+    assert client.post('avatars', idempotent=False).status_code == 201
+    assert client._session.calls == 4
+
+def test_avatar_inventory_evicts_least_recently_viewed(tmp_path):
+    from app.services.avatar_inventory import AvatarInventory
+    inventory = AvatarInventory(str(tmp_path / 'inventory.json'))
+    for avatar_id in ('a', 'b', 'c', 'd'):
+        inventory.add(avatar_id, created_at=f"2024-01-0{len(inventory) + 1}")
+    inventory.touch('a')
+    inventory.touch('c')
+    # b and d were viewed least recently; creation order doesn't matter
+    assert inventory.eviction_candidates(2) == ['b', 'd']
+    assert inventory.eviction_candidates(4) == []
+    # Another worker reading the file sees the same order
+    assert AvatarInventory(inventory.path).eviction_candidates(3) == ['b']
+
+    # Avatars deleted on the provider side are dropped; unknown ones are kept
+    # as the most recently viewed, oldest first
+    inventory.reconcile([
+        {'id': 'a', 'createdAt': '2024-01-01'},
+        {'id': 'c', 'createdAt': '2024-01-03'},
+        {'id': 'z', 'createdAt': '2024-02-02'},
+        {'id': 'y', 'createdAt': '2024-02-01'},
+    ])
+    assert 'b' not in inventory and 'd' not in inventory
+    assert inventory.eviction_candidates(0) == ['a', 'c', 'y', 'z']
+    assert inventory.synced_at
+
+def test_avatar_views_never_wait_on_the_api(app, monkeypatch):
+    import threading
+    from app.services.anam import anam_service
+    listing = threading.Event()
+    release = threading.Event()
+
+    def list_avatars(limit=50):
+        listing.set()
+        release.wait(5)
+        return [{'id': 'a', 'createdAt': '2024-01-01'}, {'id': 'b', 'createdAt': '2024-01-02'}]
+
+    monkeypatch.setattr(anam_service, 'list_avatars', list_avatars)
+    anam_service.sync_interval = 3600
+    with app.app_context():
+        # The first use reconciles in the background while the request carries on
+        inventory = anam_service.inventory
+        assert listing.wait(5)
+        assert len(inventory) == 0
+        release.set()
+        deadline = time.monotonic() + 5
+        while len(inventory) < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert inventory.eviction_candidates(0) == ['a', 'b']
+
+        # Views are buffered rather than rewriting the file each time...
+        with open(inventory.path) as f:
+            saved = f.read()
+        anam_service.touch_avatar('a')
+        with open(inventory.path) as f:
+            assert f.read() == saved
+        # ...and still count when picking avatars to evict
+        monkeypatch.setattr(anam_service, 'delete_avatars', lambda ids: {})
+        app.config['ANAM_AVATAR_LIMIT'] = 2
+        anam_service.cleanup_old_avatars()
+        assert inventory.eviction_candidates(1) == ['b']
+
+def test_missing_rendition_falls_back_to_original(app, monkeypatch):
+    from concurrent.futures.process import BrokenProcessPool
+    from benchmarks.pipeline import _png
+    from app.services.media import media_store, media_url
+    from app.services.renditions import rendition_service
+    name = media_store.put_bytes(_png(1024).getvalue(), 'png')
+    with app.test_request_context():
+        original = media_url(name)
+        scheduled = []
+        schedule = rendition_service.schedule
+        monkeypatch.setattr(rendition_service, 'schedule', lambda path: scheduled.append(path) or schedule(path))
+        # Served from the original page while the renditions are queued
+        assert rendition_service.thumbnail(name) == original
+        assert rendition_service.srcset(name) == {}
+        # Queued once however often the page is rendered meanwhile
+        assert set(scheduled) == {media_store.path(name)}
+        rendition_service.schedule(media_store.path(name)).result(timeout=30)
+        assert rendition_service.thumbnail(name) != original
+        assert 'image/webp' in rendition_service.srcset(name)
+
+        # A broken pool still falls back, and the next page gets a fresh one
+        other = media_store.put_bytes(_png(1024).getvalue(), 'png')
+
+        class BrokenPool:
+            def submit(self, *args):
+                raise BrokenProcessPool()
+
+        monkeypatch.setattr(rendition_service, '_executor', BrokenPool())
+        assert rendition_service.thumbnail(other) == media_url(other)
+        assert rendition_service._executor is None
+
+def test_media_caching_and_ranges(client):
+    from app.blueprints.main.routes import DERIVED_MEDIA_MAX_AGE, MEDIA_MAX_AGE
+    from app.services.media import media_store
+    data = bytes(range(256)) * 4
+    name = media_store.put_bytes(data, 'mp3')
+    url = f"/media/{name}"
+
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response.data == data
+    assert response.cache_control.immutable and response.cache_control.public
+    assert response.cache_control.max_age == MEDIA_MAX_AGE
+    # The content hash is the (strong) ETag
+    etag, weak = response.get_etag()
+    assert etag == name.split('.')[0] and not weak
+
+    response = client.get(url, headers={'If-None-Match': f'"{etag}"'})
+    assert response.status_code == 304
+    assert not response.data
+
+    response = client.get(url, headers={'Range': 'bytes=100-199'})
+    assert response.status_code == 206
+    assert response.data == data[100:200]
+    assert response.headers['Content-Range'] == f"bytes 100-199/{len(data)}"
+
+    # Derived files can be regenerated: short-lived, never immutable
+    os.makedirs(media_store.path('renditions'), exist_ok=True)
+    with open(media_store.path('renditions/page_thumb.webp'), 'wb') as f:
+        f.write(b'webp')
+    response = client.get('/media/renditions/page_thumb.webp')
+    assert response.status_code == 200
+    assert not response.cache_control.immutable
+    assert response.cache_control.max_age == DERIVED_MEDIA_MAX_AGE
+    assert client.get('/media/../config.py').status_code == 404
+
+def test_identical_uploads_share_one_blob(app, tmp_path):
+    import io
+    from werkzeug.datastructures import FileStorage
+    from app.services.media import media_store
+    data = b'same page' * 1000
+    first = media_store.save_upload(FileStorage(io.BytesIO(data), filename='page.PNG'))
+    second = media_store.save_upload(FileStorage(io.BytesIO(data), filename='copy.png'))
+    source = tmp_path / 'page.png'
+    source.write_bytes(data)
+    third = media_store.put_file(str(source), move=False)
+    assert first == second == third
+    assert [name for name in os.listdir(media_store.folder) if name.endswith('.png')] == [first]
+    assert source.exists()
+    assert media_store.refcount(first) == 3
+
+    media_store.release(first)
+    media_store.release(first)
+    assert media_store.refcount(first) == 1
+    assert os.path.exists(media_store.path(first))
+    # The last reference takes the file with it
+    media_store.release(first)
+    assert media_store.refcount(first) == 0
+    assert not os.path.exists(media_store.path(first))
+    assert media_store.put_bytes(data, 'png') == first
+    assert media_store.refcount(first) == 1
+
+def test_service_clients_built_lazily_and_dropped_after_fork(app, monkeypatch):
+    from app.services import registry as registry_module
+    from app.services.registry import get_service, init_services
+    services = init_services(app)
+    built = []
+    services.register('probe', lambda app: built.append(object()) or built[-1])
+    # Registering only records the factory; nothing is built until first use
+    assert built == [] and services.loaded() == []
+    client = get_service('probe')
+    assert built == [client] and get_service('probe') is client
+    assert services.loaded() == ['probe']
+
+    # In a forked worker the parent's client is dropped and rebuilt once
+    parent = registry_module.os.getpid()
+    monkeypatch.setattr(registry_module.os, 'getpid', lambda: parent + 1)
+    forked = get_service('probe')
+    assert forked is not client and get_service('probe') is forked
+    assert len(built) == 2
+
+    # Overrides (fake providers) are used as-is in every process
+    fake = object()
+    services.override('probe', fake)
+    assert get_service('probe') is fake
+
+def test_brief_stream_parser_delivers_pages_incrementally():
+    from app.services.brief_stream import BriefStreamParser
+    brief = {
+        'title': 'The "Quiet" Courier',
+        'style': 'ink\\wash, {muted}',
+        'pages': ['Page one: a door \\"opens\\"', 'Page two, [rain]', 'Page three — end'],
+        'voice': {'profile': 'calm', 'speed': 1.0}
+    }
+    text = "```json\n" + json.dumps(brief, indent=2) + "\n```"
+    fields, pages, delivered_at = [], [], []
+    parser = BriefStreamParser(
+        on_field=lambda name, value: fields.append(name),
+        on_page=lambda index, prompt: (pages.append((index, prompt)), delivered_at.append(offset))
+    )
+    # Fed a few characters at a time, as the response streams in
+    for offset in range(0, len(text), 7):
+        parser.feed(text[offset:offset + 7])
+    assert pages == list(enumerate(brief['pages']))
+    # Each page is handed out as soon as its prompt closes, before the object does
+    closing = [text.index(json.dumps(prompt)) + len(json.dumps(prompt)) for prompt in brief['pages']]
+    assert all(end - 7 <= at < end for at, end in zip(delivered_at, closing))
+    assert delivered_at[0] < text.index('"voice"')
+    assert fields == ['title', 'style', 'pages', 'voice']
+    assert parser.close() == brief
+
+    truncated = BriefStreamParser()
+    truncated.feed(text[:text.index('Page three')])
+    with pytest.raises(ValueError):
+        truncated.close()
+    with pytest.raises(ValueError):
+        BriefStreamParser().feed('{"title" "missing colon"}')
+
+def test_brief_feed_hands_out_pages_as_they_arrive():
+    import threading
+    from app.services.brief_stream import BriefFeed
+    feed = BriefFeed()
+    seen = []
+    reader = threading.Thread(target=lambda: seen.extend(feed.pages()))
+    reader.start()
+    feed.add_field('title', 'Once')
+    feed.add_page(0, 'first')
+    assert feed.page(0) == 'first' and feed.field('title') == 'Once'
+    # Out-of-order or repeated prompts are ignored
+    feed.add_page(2, 'skipped')
+    feed.add_page(0, 'again')
+    feed.add_page(1, 'second')
+    feed.finish({'title': 'Once', 'pages': ['first', 'second', 'third']})
+    reader.join(5)
+    assert seen == ['first', 'second', 'third']
+    assert feed.page(3) is None and feed.field('missing', 'default') == 'default'
+    assert feed.brief() == {'title': 'Once', 'pages': ['first', 'second', 'third']}
+
+    failed = BriefFeed()
+    failed.add_page(0, 'first')
+    failed.fail(ValueError('stream cut'))
+    with pytest.raises(ValueError):
+        failed.page(1)
+    assert BriefFeed.complete({'pages': ['only']}).known_pages() == 1
+
+def test_repeat_image_reuses_its_avatar(app, monkeypatch):
+    import threading
+    from benchmarks.pipeline import _png
+    from app.services.anam import anam_service
+    from app.services.media import media_store
+    fake = app.extensions['fake_providers']['anam']
+    uploads, active, overlapped = [], [], []
+    post = fake.post
+
+    def slow_post(path, **kwargs):
+        if path == 'avatars':
+            active.append(path)
+            overlapped.append(len(active) > 1)
+            time.sleep(0.2)
+            uploads.append(path)
+            active.pop()
+        return post(path, **kwargs)
+
+    monkeypatch.setattr(fake, 'post', slow_post)
+    path = media_store.path(media_store.put_bytes(_png(256).getvalue(), 'png'))
+    results = []
+
+    def create():
+        with app.app_context():
+            results.append(anam_service.create_avatar_from_image(path, 'Hero'))
+
+    # Overlapping jobs for the same image wait for the first upload instead of repeating it
+    threads = [threading.Thread(target=create) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+    assert len(results) == 3 and len(set(results)) == 1
+    assert uploads == ['avatars'] and overlapped == [False]
+
+    # Later jobs reuse the live avatar; once it's gone the image is uploaded again
+    assert anam_service.create_avatar_from_image(path, 'Hero again') == results[0]
+    assert len(uploads) == 1
+    anam_service.inventory.remove(results[0])
+    assert anam_service.create_avatar_from_image(path, 'Hero') != results[0]
+    assert len(uploads) == 2
+
+def test_manga_batch_route_checks_csrf_and_size(app, client):
+    import re
+    records = "\n".join(json.dumps({'title': f"Chapter {i}", 'plot': 'A courier takes a job.'}) for i in range(3))
+    app.config['WTF_CSRF_ENABLED'] = True
+    assert client.post('/manga/batch', data=records, content_type='application/x-ndjson').status_code == 400
+    token = re.search(r'name="csrf_token" type="hidden" value="([^"]+)"', client.get('/').get_data(as_text=True)).group(1)
+    headers = {'X-CSRFToken': token, 'Accept': 'application/json'}
+
+    app.config['MANGA_BATCH_MAX_RECORDS'] = 2
+    response = client.post('/manga/batch', data=records, content_type='application/x-ndjson', headers=headers)
+    assert response.status_code == 400
+    assert 'at most 2' in response.json['error']
+
+    app.config['MANGA_BATCH_MAX_RECORDS'] = 3
+    response = client.post('/manga/batch', data=records, content_type='application/x-ndjson', headers=headers)
+    assert response.status_code == 202
+    assert response.json['title'] == 'Batch of 3 manga'
+    deadline = time.monotonic() + 30
+    while (job := client.get(f"/jobs/{response.json['id']}/status").json)['status'] not in ('done', 'failed'):
+        assert time.monotonic() < deadline
+        time.sleep(0.05)
+    assert job['status'] == 'done' and len(job['result']['records']) == 3